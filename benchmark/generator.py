@@ -0,0 +1,141 @@
+"""
+    Generation of large synthetic games, for benchmarking purposes only.
+
+    The games are filled in bulk and directly in the database, without going through the views, so that tens of
+     thousands of rows can be created in a few seconds. They are realistic enough to exercise the scoring and the
+     display of hands, trades and messages, but the hands are not updated by the accepted trades.
+"""
+import datetime
+import random
+from collections import Counter
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.utils.timezone import now
+from game.deal import dispatch_cards, RuleCardDealer, CommodityCardDealer, InappropriateDealingException, MAX_TRIES
+from game.models import Game, GamePlayer, RuleInHand, CommodityInHand, Message
+from ruleset.models import RuleCard, Commodity
+from trade.models import Trade, Offer, TradedCommodities
+from utils.models import StatsScore
+
+PASSWORD = 'benchmark'
+
+# relative frequency of each final (or not) status of the generated trades
+TRADE_STATUSES = ['INITIATED'] * 1 + ['REPLIED'] * 1 + ['ACCEPTED'] * 4 + ['CANCELLED'] * 2 + ['DECLINED'] * 2
+
+def create_users(prefix, nb_users):
+    password = make_password(PASSWORD) # hashing is slow: do it once for all the users
+    get_user_model().objects.bulk_create([get_user_model()(username = "{0}{1}".format(prefix, index), password = password,
+                                                           first_name = "Player", last_name = "{0}{1}".format(prefix, index),
+                                                           timezone = 'Europe/Paris', send_notifications = False)
+                                          for index in range(nb_users)])
+    return list(get_user_model().objects.filter(username__startswith = prefix).order_by('id'))
+
+def generate_game(ruleset, nb_players = 50, nb_trades = 500, nb_messages = 10000, prefix = 'bench', seed = 0):
+    """ Create an active game of the ruleset, with nb_players players holding their starting cards,
+         nb_trades trades in all statuses between them and nb_messages public messages. """
+    from game.views import MIN_COPIES_OF_EACH_RULECARD # not at the top: importing the views requires the models to be all loaded
+
+    random.seed(seed)
+    date_now = now()
+
+    master = create_users(prefix + 'master', 1)[0]
+    players = create_users(prefix + 'player', nb_players)
+
+    game = Game.objects.create(ruleset = ruleset, master = master,
+                               start_date = date_now - datetime.timedelta(days = 7), end_date = date_now + datetime.timedelta(days = 7))
+    GamePlayer.objects.bulk_create([GamePlayer(game = game, player = player) for player in players])
+
+    rulecards = list(RuleCard.objects.filter(ruleset = ruleset).order_by('-mandatory', 'ref_name'))
+    nb_max_rulecards = int(nb_players * float(ruleset.starting_rules) / MIN_COPIES_OF_EACH_RULECARD)
+    for rulecard in rulecards[:nb_max_rulecards]:
+        game.rules.add(rulecard)
+
+    _deal_hands(game)
+    _generate_trades(game, players, nb_trades, date_now)
+    _generate_messages(game, players, nb_messages, date_now)
+
+    return game
+
+def _deal_hands(game):
+    """ Same dealing as game.deal.deal_cards(), without the check of the spread of the initial scores """
+    gameplayers = GamePlayer.objects.filter(game = game).select_related('player').order_by('id')
+    for _try in range(MAX_TRIES):
+        try:
+            rules = dispatch_cards(gameplayers, game.ruleset.starting_rules, game.rules.order_by('id'), RuleCardDealer())
+            break
+        except InappropriateDealingException:
+            pass
+    else:
+        raise InappropriateDealingException
+    commodities = dispatch_cards(gameplayers, game.ruleset.starting_commodities, Commodity.objects.filter(ruleset = game.ruleset).order_by('id'),
+                                 CommodityCardDealer())
+
+    RuleInHand.objects.bulk_create([RuleInHand(game = game, player = gameplayer.player, rulecard = rulecard, ownership_date = game.start_date)
+                                    for gameplayer, rulecards in rules.iteritems() for rulecard in rulecards])
+    CommodityInHand.objects.bulk_create([CommodityInHand(game = game, player = gameplayer.player, commodity = commodity, nb_cards = nb_cards)
+                                         for gameplayer, hand in commodities.iteritems() for commodity, nb_cards in Counter(hand).iteritems()])
+
+def _generate_trades(game, players, nb_trades, date_now):
+    commodities = {}
+    for cih in CommodityInHand.objects.filter(game = game).order_by('id'):
+        commodities.setdefault(cih.player_id, []).append(cih)
+    rules = {}
+    for rih in RuleInHand.objects.filter(game = game).order_by('id'):
+        rules.setdefault(rih.player_id, []).append(rih)
+
+    trades, tradedcommodities, tradedrules = [], [], []
+    for index in range(nb_trades):
+        initiator, responder = random.sample(players, 2)
+        status = random.choice(TRADE_STATUSES)
+        creation_date = date_now - datetime.timedelta(minutes = (nb_trades - index) * 10)
+
+        initiator_offer = _generate_offer(commodities.get(initiator.id, []), rules.get(initiator.id, []), creation_date,
+                                          tradedcommodities, tradedrules)
+        responder_offer = None
+        if status != 'INITIATED' and random.random() < 0.8 or status in ['REPLIED', 'ACCEPTED']:
+            responder_offer = _generate_offer(commodities.get(responder.id, []), rules.get(responder.id, []),
+                                              creation_date + datetime.timedelta(minutes = 3), tradedcommodities, tradedrules)
+
+        trade = Trade(game = game, initiator = initiator, responder = responder, status = status, creation_date = creation_date,
+                      initiator_offer = initiator_offer, responder_offer = responder_offer)
+        if status in ['ACCEPTED', 'CANCELLED', 'DECLINED']:
+            if status == 'ACCEPTED':
+                trade.finalizer = initiator
+            elif status == 'CANCELLED':
+                trade.finalizer = responder if responder_offer else initiator
+            else:
+                trade.finalizer = initiator if responder_offer else responder
+            trade.closing_date = creation_date + datetime.timedelta(minutes = 5)
+        trades.append(trade)
+
+    TradedCommodities.objects.bulk_create(tradedcommodities)
+    Offer.rules.through.objects.bulk_create(tradedrules)
+    Trade.objects.bulk_create(trades)
+
+def _generate_offer(hand, rule_hand, creation_date, tradedcommodities, tradedrules):
+    selected_commodities = dict((cih, random.randint(1, cih.nb_cards)) for cih in random.sample(hand, min(len(hand), random.randint(1, 3))))
+    selected_rules = [random.choice(rule_hand)] if rule_hand and random.random() < 0.3 else []
+
+    offer = Offer(creation_date = creation_date,
+                  comment = "Let's trade" if random.random() < 0.5 else None,
+                  free_information = "A secret" if random.random() < 0.2 else None)
+    offer.set_card_counts(selected_commodities, selected_rules)
+    offer.save()
+    for cih, nb_traded_cards in selected_commodities.iteritems():
+        tradedcommodities.append(TradedCommodities(offer = offer, commodityinhand = cih, nb_traded_cards = nb_traded_cards))
+    for rih in selected_rules:
+        tradedrules.append(Offer.rules.through(offer_id = offer.id, ruleinhand_id = rih.id))
+    return offer
+
+def _generate_messages(game, players, nb_messages, date_now):
+    Message.objects.bulk_create([Message(game = game, sender = random.choice(players), content = "Message #{0}".format(index),
+                                         posting_date = date_now - datetime.timedelta(seconds = (nb_messages - index) * 30))
+                                 for index in range(nb_messages)])
+
+def generate_stats(game, nb_snapshots = 50):
+    """ Score statistics of all the players of the game, as recorded by utils.stats.record() after nb_snapshots trades """
+    players = list(game.players.all())
+    date_now = now()
+    StatsScore.objects.bulk_create([StatsScore(game = game, player = player, score = random.randint(0, 100),
+                                               date_score = date_now - datetime.timedelta(hours = nb_snapshots - index))
+                                    for index in range(nb_snapshots) for player in players])
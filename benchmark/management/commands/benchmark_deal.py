@@ -0,0 +1,95 @@
+import logging
+import time
+from collections import Counter
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils.timezone import now
+from south.management.commands import patch_for_test_db_setup
+
+from benchmark.generator import create_users
+from game.deal import create_hands, dispatch_cards, RuleCardDealer, CommodityCardDealer, InappropriateDealingException, MAX_TRIES
+from game.ledger import record_deal
+from game.models import CardMovement, CommodityInHand, Game, GamePlayer, RuleInHand
+from ruleset.models import Commodity, RuleCard, Ruleset
+from utils.utils import QueryCounter
+
+class Command(BaseCommand):
+    help = ("Deal the starting cards of games of increasing sizes in a temporary test database, and compare the number of INSERT "
+            "queries and the duration of the creation of the hands (see game.deal.create_hands) with those of the former creation, "
+            "one row at a time: the number of inserts no longer grows with the number of players and cards.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--players', default = '10,100', help = 'Comma separated numbers of players of the games [default: 10,100]'),
+        make_option('--cards',   type = 'int', default = 20, help = 'Number of commodity cards dealt to each player [default: 20]'),
+        make_option('--repeat',  type = 'int', default = 3,  help = 'Runs of each measure, the best one is kept [default: 3]'),
+    )
+
+    def handle(self, *args, **options):
+        # never pollute the real database: everything happens in a test database, created (and migrated) for the occasion
+        patch_for_test_db_setup()
+        setup_test_environment()
+        settings.DEBUG = False
+        logging.disable(logging.INFO)
+        old_database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity = 0, autoclobber = True)
+        try:
+            ruleset = Ruleset.objects.all().order_by('id')[0]
+            self.stdout.write("{0:>8} {1:>6} {2:>6} {3:>16} {4:>16} {5:>16} {6:>16}".format(
+                'players', 'cards', 'rows', 'inserts before', 'seconds before', 'inserts after', 'seconds after'))
+            for nb_players in [int(nb_players) for nb_players in options['players'].split(',')]:
+                game, rules, commodities = self.deal(ruleset, nb_players, options['cards'])
+                nb_rows = sum(len(rulecards) for rulecards in rules.itervalues())\
+                        + 2 * sum(len(Counter(hand)) for hand in commodities.itervalues()) # in the hands and in the ledger
+                before = self.measure(lambda: self.create_hands_row_by_row(game, rules, commodities), game, options['repeat'])
+                after = self.measure(lambda: create_hands(game, rules, commodities), game, options['repeat'])
+                self.stdout.write("{0:>8} {1:>6} {2:>6} {3:>16} {4:>16.4f} {5:>16} {6:>16.4f}".format(
+                    nb_players, options['cards'], nb_rows, before['inserts'], before['seconds'], after['inserts'], after['seconds']))
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity = 0)
+            teardown_test_environment()
+
+    def deal(self, ruleset, nb_players, nb_cards):
+        """ A game of the ruleset with all its rule cards, and the cards dispatched to its players, not yet in their hands """
+        players = create_users("deal{0}_".format(nb_players), nb_players)
+        game = Game.objects.create(ruleset = ruleset, master = players[0], start_date = now(), end_date = now())
+        GamePlayer.objects.bulk_create([GamePlayer(game = game, player = player) for player in players])
+        game.rules.add(*RuleCard.objects.filter(ruleset = ruleset))
+
+        gameplayers = GamePlayer.objects.filter(game = game).select_related('game', 'player')
+        for _try in range(MAX_TRIES):
+            try:
+                rules = dispatch_cards(gameplayers, ruleset.starting_rules, game.rules.all(), RuleCardDealer())
+                break
+            except InappropriateDealingException:
+                pass
+        else:
+            raise InappropriateDealingException
+        commodities = dispatch_cards(gameplayers, nb_cards, Commodity.objects.filter(ruleset = ruleset), CommodityCardDealer())
+        return game, rules, commodities
+
+    def create_hands_row_by_row(self, game, rules, commodities):
+        """ The creation of the hands before create_hands(), for reference """
+        record_deal(game, rules, commodities)
+        for gameplayer, rulecards in rules.iteritems():
+            for rulecard in rulecards:
+                RuleInHand.objects.create(game = game, player = gameplayer.player, rulecard = rulecard, ownership_date = game.start_date)
+        for gameplayer, hand in commodities.iteritems():
+            for commodity in set(hand):
+                CommodityInHand.objects.create(game = game, player = gameplayer.player, commodity = commodity, nb_cards = hand.count(commodity))
+
+    def measure(self, function, game, repeat):
+        best = None
+        for _i in range(repeat):
+            with QueryCounter() as counter:
+                start = time.time()
+                function()
+                duration = time.time() - start
+            if best is None or duration < best:
+                best = duration
+            for model in [CardMovement, RuleInHand, CommodityInHand]: # dealt again at the next run
+                model.objects.filter(game = game).delete()
+        return {'seconds': best, 'inserts': len([query for query in counter.queries if 'INSERT INTO' in query['sql']])}
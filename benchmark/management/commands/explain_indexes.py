@@ -0,0 +1,163 @@
+import logging
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils.timezone import now
+from south.management.commands import patch_for_test_db_setup
+
+from benchmark.generator import generate_game, generate_stats
+from game.helpers import commodities_in_hand, rules_in_hand, rules_formerly_in_hand
+from game.models import GamePlayer, CommodityInHand, RuleInHand
+from ruleset.models import Ruleset, RuleCard, Commodity
+from trade.models import Trade, Offer
+from utils.models import StatsScore, StatsSnapshot
+
+# the models whose index_together serve the hot queries below
+INDEXED_MODELS = [GamePlayer, CommodityInHand, RuleInHand, Trade, StatsScore, StatsSnapshot]
+
+# the lookups of the views and helpers that are run at (almost) each request on a game board
+HOT_QUERIES = [
+    ('commodities_in_hand',    lambda game, player: commodities_in_hand(game, player)),
+    ('rules_in_hand',          lambda game, player: rules_in_hand(game, player)),
+    ('rules_formerly_in_hand', lambda game, player: rules_formerly_in_hand(game, player)),
+    ('pending_trades',         lambda game, player: Trade.objects.filter(game = game, status__in = ['INITIATED', 'REPLIED'])),
+    ('accepted_trades',        lambda game, player: Trade.objects.filter(game = game, status = 'ACCEPTED')),
+    ('stats_scores',           lambda game, player: StatsScore.objects.filter(game = game).order_by('date_score', 'player')),
+    ('stats_snapshots',        lambda game, player: StatsSnapshot.objects.filter(game = game).order_by('date_score', 'id')),
+    ('gameplayer_presence',    lambda game, player: GamePlayer.objects.filter(game__id = game.id, player = player)),
+]
+
+class Command(BaseCommand):
+    help = ("Fill a temporary test database with many synthetic games, then print the query plan (EXPLAIN) and the duration of "
+            "each hot query of a game board, and the duration of bulk inserts in the indexed tables, first with the composite "
+            "indexes declared by the models (index_together), then without them, to show that they are used and what they cost.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--games',    type = 'int', default = 20,   help = 'Number of games [default: 20]'),
+        make_option('--players',  type = 'int', default = 30,   help = 'Number of players in each game [default: 30]'),
+        make_option('--trades',   type = 'int', default = 300,  help = 'Number of trades in each game [default: 300]'),
+        make_option('--messages', type = 'int', default = 1000, help = 'Number of messages in each game [default: 1000]'),
+        make_option('--rows',     type = 'int', default = 1000, help = 'Number of rows inserted in each table to time the writes [default: 1000]'),
+        make_option('--repeat',   type = 'int', default = 5,    help = 'Runs of each measure, the best one is kept [default: 5]'),
+    )
+
+    def handle(self, *args, **options):
+        # never pollute the real database: everything happens in a test database, created (and migrated) for the occasion
+        patch_for_test_db_setup()
+        setup_test_environment()
+        settings.DEBUG = False
+        logging.disable(logging.INFO)
+        old_database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity = 0, autoclobber = True)
+        try:
+            game, player = self.seed(options)
+            with_indexes = self.measure(game, player, options)
+            self.drop_indexes()
+            without_indexes = self.measure(game, player, options)
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity = 0)
+            teardown_test_environment()
+
+        self.report(with_indexes, without_indexes)
+
+    def seed(self, options):
+        ruleset = Ruleset.objects.get(id = 1)
+        for index in range(options['games']):
+            self.stdout.write("Generating game {0}/{1}...".format(index + 1, options['games']))
+            game = generate_game(ruleset, options['players'], options['trades'], options['messages'], prefix = "explain{0}_".format(index), seed = index)
+            generate_stats(game)
+        # the measures are done on the last game, the one inserted last being the worst case for an index on game alone
+        Offer.objects.bulk_create([Offer(comment = 'explain_indexes') for _i in range(options['rows'])]) # to time the inserts of trades
+        self.offers = list(Offer.objects.filter(comment = 'explain_indexes').order_by('id'))
+        return game, game.players.order_by('id')[0]
+
+    def measure(self, game, player, options):
+        results = {'reads': {}, 'plans': {}, 'writes': {}}
+        for name, queryset in HOT_QUERIES:
+            results['reads'][name] = self.timeit(lambda: list(queryset(game, player)), options['repeat'])
+            results['plans'][name] = self.explain(queryset(game, player))
+
+        nb_rows, date_now = options['rows'], now()
+        commodity = Commodity.objects.filter(ruleset = game.ruleset)[0]
+        rulecard = RuleCard.objects.filter(ruleset = game.ruleset)[0]
+        rows = {GamePlayer:      lambda: [GamePlayer(game = game, player = player) for _i in range(nb_rows)],
+                CommodityInHand: lambda: [CommodityInHand(game = game, player = player, commodity = commodity, nb_cards = 1) for _i in range(nb_rows)],
+                RuleInHand:      lambda: [RuleInHand(game = game, player = player, rulecard = rulecard, ownership_date = date_now) for _i in range(nb_rows)],
+                Trade:           lambda: [Trade(game = game, initiator = player, responder = player, initiator_offer = offer) for offer in self.offers],
+                StatsScore:      lambda: [StatsScore(game = game, player = player, score = 0) for _i in range(nb_rows)],
+                StatsSnapshot:   lambda: [StatsSnapshot.pack([(player.id, 0, False)], game = game) for _i in range(nb_rows)]}
+        for model in INDEXED_MODELS:
+            results['writes'][model.__name__] = self.timeit_insert(model, rows[model], options['repeat'])
+        return results
+
+    def timeit(self, function, repeat):
+        best = None
+        for _i in range(repeat):
+            start = time.time()
+            function()
+            duration = time.time() - start
+            if best is None or duration < best:
+                best = duration
+        return best
+
+    def timeit_insert(self, model, rows, repeat):
+        """ The best duration of the bulk insert of the rows, which are rolled back after each run """
+        best = None
+        for _i in range(repeat):
+            with transaction.atomic():
+                instances = rows()
+                start = time.time()
+                model.objects.bulk_create(instances)
+                duration = time.time() - start
+                transaction.set_rollback(True)
+            if best is None or duration < best:
+                best = duration
+        return best
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        if connection.vendor == 'sqlite':
+            prefix = "EXPLAIN QUERY PLAN "
+        elif connection.vendor == 'postgresql':
+            prefix = "EXPLAIN ANALYZE "
+        else:
+            prefix = "EXPLAIN "
+        cursor = connection.cursor()
+        cursor.execute(prefix + sql, params)
+        return [" ".join(unicode(column) for column in row) for row in cursor.fetchall()]
+
+    def drop_indexes(self):
+        """ Drop the composite indexes, whether they have been created by syncdb or by the South migrations """
+        from south.db import db # not at the top: South picks the database backend at import
+        cursor = connection.cursor()
+        for model in INDEXED_MODELS:
+            for field_names in model._meta.index_together:
+                fields = [model._meta.get_field(field_name) for field_name in field_names]
+                for index_name in [db.create_index_name(model._meta.db_table, [field.column for field in fields]),
+                                   "{0}_{1}".format(model._meta.db_table, connection.creation._digest([field.name for field in fields]))]:
+                    cursor.execute("DROP INDEX IF EXISTS {0}".format(connection.ops.quote_name(index_name)))
+
+    def report(self, with_indexes, without_indexes):
+        self.stdout.write("\n{0:25} {1:>14} {2:>14} {3:>8}".format('hot query', 'indexed (ms)', 'without (ms)', 'speedup'))
+        for name, _queryset in HOT_QUERIES:
+            indexed, without = with_indexes['reads'][name], without_indexes['reads'][name]
+            self.write_line(name, indexed, without, without / indexed if indexed else float('inf'))
+        self.stdout.write("\n{0:25} {1:>14} {2:>14} {3:>8}".format('bulk insert', 'indexed (ms)', 'without (ms)', 'overhead'))
+        for model in INDEXED_MODELS:
+            indexed, without = with_indexes['writes'][model.__name__], without_indexes['writes'][model.__name__]
+            self.write_line(model.__name__, indexed, without, indexed / without if without else float('inf'))
+
+        for name, _queryset in HOT_QUERIES:
+            self.stdout.write("\n{0}, with the indexes:".format(name))
+            for line in with_indexes['plans'][name]:
+                self.stdout.write("    " + line)
+            self.stdout.write("{0}, without them:".format(name))
+            for line in without_indexes['plans'][name]:
+                self.stdout.write("    " + line)
+
+    def write_line(self, name, indexed, without, ratio):
+        self.stdout.write("{0:25} {1:>14.3f} {2:>14.3f} {3:>7.2f}x".format(name, 1000 * indexed, 1000 * without, ratio))
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.core.signals import request_started
+from django.db import connection, reset_queries
+from django.test.client import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from south.management.commands import patch_for_test_db_setup
+
+from benchmark.generator import generate_game, PASSWORD
+from game.archive import archive_game
+from game.models import Game
+from ruleset.models import Ruleset
+from scoring.card_scoring import tally_scores
+from utils.utils import QueryCounter
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), '..', '..', 'baseline.json')
+
+class Command(BaseCommand):
+    help = ("Generate a large synthetic game for each ruleset in a temporary test database, then time tally_scores and the "
+            "main views and count their SQL queries. The results are compared to a stored baseline, and the command fails "
+            "if the number of queries has grown or if a duration exceeds the baseline by more than the tolerance.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--players',  type = 'int', default = 50,    help = 'Number of players in each game [default: 50]'),
+        make_option('--trades',   type = 'int', default = 500,   help = 'Number of trades in each game [default: 500]'),
+        make_option('--messages', type = 'int', default = 10000, help = 'Number of messages in each game [default: 10000]'),
+        make_option('--repeat',   type = 'int', default = 3,     help = 'Runs of each read-only measure, the best one is kept [default: 3]'),
+        make_option('--tolerance', type = 'float', default = 1.5, help = 'Accepted ratio between a duration and its baseline [default: 1.5]'),
+        make_option('--baseline', default = DEFAULT_BASELINE,    help = 'Path of the baseline file [default: benchmark/baseline.json]'),
+        make_option('--save-baseline', action = 'store_true', dest = 'save_baseline', default = False,
+                    help = 'Store the results as the new baseline instead of comparing them'),
+    )
+
+    def handle(self, *args, **options):
+        # never pollute the real database: everything happens in a test database, created (and migrated) for the occasion
+        patch_for_test_db_setup()
+        setup_test_environment()
+        settings.DEBUG = False # as in the tests, and so that the debug toolbar doesn't interfere with the measures
+        logging.disable(logging.INFO) # no profiling lines from tally_scores()
+        old_database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity = 0, autoclobber = True)
+        request_started.disconnect(reset_queries) # the queries counted around the requests of the test client must be kept
+        try:
+            results = {}
+            for ruleset in Ruleset.objects.all().order_by('id'):
+                self.stdout.write("Generating a game of {0} players, {1} trades and {2} messages for ruleset '{3}'..."
+                                  .format(options['players'], options['trades'], options['messages'], ruleset.module))
+                game = generate_game(ruleset, options['players'], options['trades'], options['messages'], prefix = ruleset.module)
+                results[ruleset.module] = self.measure(game, options['repeat'])
+        finally:
+            request_started.connect(reset_queries)
+            connection.creation.destroy_test_db(old_database_name, verbosity = 0)
+            teardown_test_environment()
+
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as fic:
+                json.dump(results, fic, indent = 4, sort_keys = True)
+            self.stdout.write("Baseline saved in {0}".format(options['baseline']))
+        else:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def measure(self, game, repeat):
+        player = game.players.order_by('id')[0]
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+        player_client = Client()
+        player_client.login(username = player.username, password = PASSWORD)
+        master_client = Client()
+        master_client.login(username = game.master.username, password = PASSWORD)
+
+        results = {}
+        results['tally_scores'] = self.timeit(lambda: tally_scores(game), repeat)
+        results['game_board'] = self.timeit(lambda: player_client.get(reverse('game', args = [game.id])), repeat)
+        results['game_board_master'] = self.timeit(lambda: master_client.get(reverse('game', args = [game.id])), repeat)
+        results['events'] = self.timeit(lambda: player_client.get(reverse('events', args = [game.id]), **ajax), repeat)
+        results['trade_list'] = self.timeit(lambda: player_client.get(reverse('trade_list', args = [game.id]), **ajax), repeat)
+
+        # closing the game modifies it irreversibly: it can only be measured once, and last
+        game.end_date = game.start_date
+        game.save()
+        results['close_game'] = self.timeit(lambda: master_client.post(reverse('close_game', args = [game.id]), **ajax), 1)
+
+        # the history of the closed game, read from the live tables, then from the archive once it has been moved there
+        results['events_closed'] = self.timeit(lambda: player_client.get(reverse('events', args = [game.id]), **ajax), repeat)
+        results['trade_list_closed'] = self.timeit(lambda: master_client.get(reverse('trade_list', args = [game.id]), **ajax), repeat)
+        results['archive_game'] = self.timeit(lambda: archive_game(Game.objects.get(id = game.id)), 1)
+        results['events_archived'] = self.timeit(lambda: player_client.get(reverse('events', args = [game.id]), **ajax), repeat)
+        results['trade_list_archived'] = self.timeit(lambda: master_client.get(reverse('trade_list', args = [game.id]), **ajax), repeat)
+
+        return results
+
+    def timeit(self, function, repeat):
+        best = None
+        for _i in range(repeat):
+            with QueryCounter() as counter:
+                start = time.time()
+                response = function()
+                duration = time.time() - start
+            if getattr(response, 'status_code', 200) >= 400:
+                raise CommandError("HTTP status code {0} while benchmarking".format(response.status_code))
+            if best is None or duration < best:
+                best = duration
+        return {'seconds': round(best, 4), 'queries': counter.count}
+
+    def compare(self, results, baseline_path, tolerance):
+        baseline = {}
+        if os.path.exists(baseline_path):
+            with open(baseline_path) as fic:
+                baseline = json.load(fic)
+
+        regressions = []
+        self.stdout.write("{0:10} {1:20} {2:>10} {3:>10} {4:>9} {5:>9}".format('ruleset', 'measure', 'seconds', 'baseline', 'queries', 'baseline'))
+        for ruleset, measures in sorted(results.iteritems()):
+            for name, measure in sorted(measures.iteritems()):
+                reference = baseline.get(ruleset, {}).get(name)
+                self.stdout.write("{0:10} {1:20} {2:>10.4f} {3:>10} {4:>9} {5:>9}".format(
+                    ruleset, name, measure['seconds'], reference['seconds'] if reference else '-',
+                    measure['queries'], reference['queries'] if reference else '-'))
+                if reference:
+                    if measure['queries'] > reference['queries']:
+                        regressions.append("{0}/{1}: {2} queries instead of {3}".format(ruleset, name, measure['queries'], reference['queries']))
+                    if measure['seconds'] > reference['seconds'] * tolerance:
+                        regressions.append("{0}/{1}: {2:.4f}s instead of {3:.4f}s".format(ruleset, name, measure['seconds'], reference['seconds']))
+
+        if not baseline:
+            # the baseline depends on the machine, it isn't versioned: the first run on a machine only reports the measures
+            self.stdout.write("No baseline found in {0}, nothing to compare with: run this command with --save-baseline to create one."
+                              .format(baseline_path))
+        elif regressions:
+            raise CommandError("Performance regressions detected:\n  " + "\n  ".join(regressions))
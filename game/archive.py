@@ -0,0 +1,207 @@
+"""
+    The archive of the closed games (see game.models.GameArchive).
+
+    Once a game is closed, its rows in the tables that grow with every game - the hands and their ledger, the trades with their
+     offers, the messages and the score statistics - are only read to display its history. archive_game() moves them into a single
+     JSON document per game, which load_archive() reads back as unsaved model instances, so that the views and the templates of a
+     closed game work the same whether it has been archived or not. The messages posted in the game after its archival stay in
+     their table.
+
+    The document has a list of rows for each archived table, a row being the values of the fields listed in ARCHIVED_TABLES, in this
+     order, with the foreign keys as ids and the dates in ISO 8601:
+        {"messages": [[12, 3, "Hello", "2013-11-02T10:00:00.123456+00:00"], ...], "trades": [[...], ...], ...}
+"""
+import json
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.fields import DateTimeField, FieldDoesNotExist
+from django.utils.dateparse import parse_datetime
+from game.models import CardMovement, CommodityInHand, GameArchive, Message, RuleInHand
+from ruleset.catalog import ruleset_catalog
+from ruleset.models import Commodity, RuleCard
+from scoring.scoreboard import load_scoreboard
+from trade.models import Offer, Trade, TradedCommodities
+from utils.models import StatsScore, StatsSnapshot
+
+DELETION_BATCH_SIZE = 500 # ids per DELETE ... WHERE id IN (...), below the maximum number of parameters of SQLite
+
+# (key in the document, model, archived fields), the rows referenced by other rows first
+ARCHIVED_TABLES = [
+    ('commodities',       CommodityInHand,     ['id', 'player', 'commodity', 'nb_cards', 'nb_submitted_cards']),
+    ('rules',             RuleInHand,          ['id', 'player', 'rulecard', 'ownership_date', 'abandon_date', 'previous_owner', 'next_owner']),
+    ('offers',            Offer,               ['id', 'comment', 'free_information', 'creation_date', 'nb_rulecards', 'nb_commodity_cards']),
+    ('tradedcommodities', TradedCommodities,   ['id', 'offer', 'commodityinhand', 'nb_traded_cards']),
+    ('tradedrules',       Offer.rules.through, ['id', 'offer', 'ruleinhand']),
+    ('trades',            Trade,               ['id', 'initiator', 'responder', 'initiator_offer', 'responder_offer', 'status',
+                                                'finalize_reason', 'finalizer', 'creation_date', 'closing_date']),
+    ('movements',         CardMovement,        ['id', 'player', 'commodity', 'rulecard', 'nb_cards', 'reason', 'trade', 'date']),
+    ('messages',          Message,             ['id', 'sender', 'content', 'posting_date']),
+    ('stats',             StatsScore,          ['id', 'player', 'trade', 'date_score', 'score', 'random']),
+    ('snapshots',         StatsSnapshot,       ['id', 'trade', 'date_score', 'players', 'scores', 'random']),
+]
+
+# the relations of the rebuilt rows that are left as ids, so that the statistics and the ledger can be read without rebuilding the trades
+UNRESOLVED_RELATIONS = set([(StatsScore, 'trade'), (StatsSnapshot, 'trade'), (CardMovement, 'trade')])
+
+def archive_game(game):
+    """ Move the rows of a closed game into its archive, in a single transaction. Returns the archive, or None if the game is not
+         closed or has already been archived. """
+    if not game.is_closed() or GameArchive.objects.filter(game = game).exists():
+        return None
+
+    load_scoreboard(game) # a game closed before the scoreboards existed is frozen from its hands, which won't be there anymore
+
+    with transaction.atomic():
+        content = {}
+        for key, model, fields in ARCHIVED_TABLES:
+            dates = [index for index, field in enumerate(fields) if isinstance(model._meta.get_field(field), DateTimeField)]
+            rows = []
+            for row in _rows_of_the_game(key, game).order_by('id').values_list(*fields):
+                row = list(row)
+                for index in dates:
+                    row[index] = row[index] and row[index].isoformat()
+                rows.append(row)
+            content[key] = rows
+
+        archive = GameArchive.objects.create(game = game, content = json.dumps(content, separators = (',', ':')))
+
+        # only the rows just archived are deleted, not those created meanwhile; the referencing rows first
+        for key, model, fields in reversed(ARCHIVED_TABLES):
+            ids = [archived_row[0] for archived_row in content[key]]
+            for start in range(0, len(ids), DELETION_BATCH_SIZE):
+                model.objects.filter(id__in = ids[start:start + DELETION_BATCH_SIZE]).delete()
+
+    return archive
+
+def _rows_of_the_game(key, game):
+    if key == 'offers':
+        return Offer.objects.filter(Q(trade_initiated__game = game) | Q(trade_responded__game = game))
+    elif key == 'tradedcommodities':
+        return TradedCommodities.objects.filter(commodityinhand__game = game)
+    elif key == 'tradedrules':
+        return Offer.rules.through.objects.filter(ruleinhand__game = game)
+    return dict((key, model) for key, model, _fields in ARCHIVED_TABLES)[key].objects.filter(game = game)
+
+def load_archive(game):
+    """ The archive of the game, or None if it hasn't been archived (only closed games are) """
+    if not game.is_closed():
+        return None
+    try:
+        return ArchivedGame(game, json.loads(GameArchive.objects.get(game = game).content))
+    except GameArchive.DoesNotExist:
+        return None
+
+class ArchivedGame(object):
+    """ The rows of an archived game, rebuilt on demand as unsaved model instances along with their related objects, in a fixed
+         number of queries: the archive itself, then the users they refer to, the commodities and the rule cards being taken from the
+         catalog of the ruleset (see ruleset.catalog). Only the tables needed are rebuilt: the trades and their cards, but not the
+         messages, for the list of trades. """
+    def __init__(self, game, content):
+        self.game = game
+        self.content = content
+        self._instances = {}
+        self._related_rows = {}
+
+    def messages(self):
+        return self._get('messages').values()
+
+    def trades(self):
+        """ The trades, with their offers and the cards of the offers, as loaded by trade.models.TradeQuerySet.with_offers() """
+        return self._get('trades').values()
+
+    def trade(self, trade_id):
+        try:
+            return self._get('trades')[int(trade_id)]
+        except KeyError:
+            raise Trade.DoesNotExist
+
+    def stats_scores(self):
+        return self._get('stats').values()
+
+    def stats_snapshots(self):
+        return self._get('snapshots').values()
+
+    def movements(self):
+        """ The ledger of the cards of the game, see game.ledger """
+        return self._get('movements').values()
+
+    def _get(self, key):
+        if key not in self._instances:
+            self._instances[key] = self._build(key)
+            if key == 'offers': # after they are registered, since their cards refer to them
+                self._prefetch_cards(self._instances[key].values())
+        return self._instances[key]
+
+    def _build(self, key):
+        model, fields = dict((key, (model, fields)) for key, model, fields in ARCHIVED_TABLES)[key]
+        fields = [model._meta.get_field(field) for field in fields]
+        foreign_keys = [field for field in fields if field.rel and (model, field.name) not in UNRESOLVED_RELATIONS]
+        has_game = _has_field(model, 'game')
+
+        instances = _OrderedById()
+        for row in self.content.get(key, []): # the tables added since the game was archived are missing
+            instance = model(**dict((field.attname, _from_json(field, value)) for field, value in zip(fields, row)))
+            if has_game:
+                instance.game = self.game
+            for field in foreign_keys:
+                if getattr(instance, field.attname) is not None:
+                    setattr(instance, field.name, self._related(field.rel.to)[getattr(instance, field.attname)])
+            instances[instance.id] = instance
+        return instances
+
+    def _prefetch_cards(self, offers):
+        commodities_per_offer, rules_per_offer = {}, {}
+        for tradedcommodity in self._get('tradedcommodities').values():
+            commodities_per_offer.setdefault(tradedcommodity.offer_id, []).append(tradedcommodity)
+        for tradedrule in self._get('tradedrules').values():
+            rules_per_offer.setdefault(tradedrule.offer_id, []).append(tradedrule.ruleinhand)
+        for offer in offers:
+            _prefetch(offer, 'tradedcommodities', TradedCommodities.objects.all(), commodities_per_offer.get(offer.id, []))
+            _prefetch(offer, 'rules', RuleInHand.objects.all(), rules_per_offer.get(offer.id, []))
+
+    def _related(self, target):
+        """ The rows of the target model referenced by the archived rows, by id: rebuilt from the archive if it's one of its tables,
+             taken from the catalog of the ruleset for the cards, or else read in a single query """
+        for key, model, _fields in ARCHIVED_TABLES:
+            if model == target:
+                return self._get(key)
+        if target not in self._related_rows:
+            if target in (Commodity, RuleCard): # reference data, in the catalog of the ruleset
+                catalog = ruleset_catalog(self.game.ruleset_id)
+                self._related_rows[target] = dict((card.id, card) for card in (catalog.commodities if target == Commodity else catalog.rulecards))
+            else:
+                self._related_rows[target] = target.objects.in_bulk(self._referenced_ids(target))
+        return self._related_rows[target]
+
+    def _referenced_ids(self, target):
+        ids = set()
+        for key, model, fields in ARCHIVED_TABLES:
+            for index, field in enumerate(fields):
+                if model._meta.get_field(field).rel and model._meta.get_field(field).rel.to == target:
+                    ids.update(row[index] for row in self.content.get(key, []) if row[index] is not None)
+        return list(ids)
+
+class _OrderedById(dict):
+    def values(self):
+        return [self[key] for key in sorted(self)]
+
+def _has_field(model, name):
+    try:
+        model._meta.get_field(name)
+        return True
+    except FieldDoesNotExist:
+        return False
+
+def _from_json(field, value):
+    if isinstance(field, DateTimeField) and value is not None:
+        return parse_datetime(value)
+    return value
+
+def _prefetch(instance, cache_name, queryset, objects):
+    """ Attach the related objects to the instance as prefetch_related() does, so that they are read without any query. The related
+         manager returns the queryset found in the cache whatever its filters: an unfiltered one is much cheaper to build. """
+    queryset._result_cache = objects
+    queryset._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[cache_name] = queryset
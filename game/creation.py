@@ -0,0 +1,124 @@
+"""
+    The creation of the games in the background (see game.models.GameCreationJob).
+
+    The page of the rule cards only records what the game master has chosen in a GameCreationJob and starts it: the game, its
+     players and its rules are inserted in bulk, the cards are dealt (which may take several tries, see game.deal), then the scores
+     at the creation are recorded and the players and the admins are notified by email. The game master polls the progress of the
+     job, and is redirected to the game as soon as it has been dealt, without waiting for the notifications.
+
+    With settings.GAME_CREATION_IN_BACKGROUND, the job is run in a thread of the web server; otherwise it is run within the request.
+     The jobs left pending, e.g. by a restart of the server, are run by the command run_game_creations. A job is claimed by a single
+     UPDATE on its status, so that it is never run twice. The jobs whose thread has died while running them, which no longer make any
+     progress, are released by the same command after settings.GAME_CREATION_TIMEOUT (see release_stale_game_creations).
+"""
+import datetime
+import logging
+import threading
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.utils.timezone import now
+from game.deal import deal_cards
+from game.helpers import rules_in_hand, commodities_in_hand
+from game.models import Game, GameCreationJob, GamePlayer
+from ruleset.models import RuleCard
+from utils import utils, stats
+
+logger = logging.getLogger(__name__)
+
+ERROR_DEAL = "We failed to deal cards without the difference of starting scores being too large. Please try again."
+ERROR_UNEXPECTED = "An unexpected error occurred while creating the game. Please try again."
+
+def start_game_creation(job):
+    """ Run the job in a new thread, or right away if settings.GAME_CREATION_IN_BACKGROUND is off. Returns the job, up to date in
+         the latter case. """
+    if getattr(settings, 'GAME_CREATION_IN_BACKGROUND', False):
+        thread = threading.Thread(target = _run_in_thread, args = (job.id,), name = "game_creation_{0}".format(job.id))
+        thread.daemon = True
+        thread.start()
+        return job
+    return run_game_creation(job.id) or job
+
+def run_game_creation(job_id):
+    """ Create the game of a pending job, deal its cards and notify its players. Returns the job, or None if it wasn't pending. """
+    if not GameCreationJob.objects.filter(id = job_id, status = 'PENDING').update(status = 'CREATING', update_date = now()):
+        return None
+    job = GameCreationJob.objects.select_related('master', 'ruleset').get(id = job_id)
+
+    game = None
+    try:
+        game = _create_game(job)
+
+        job.game = game # recorded to be deleted if the job dies before the cards have been dealt
+        _set_status(job, 'DEALING')
+        if not deal_cards(game):
+            game.delete()
+            job.game = None
+            _set_status(job, 'FAILED', error = ERROR_DEAL)
+            return job
+
+        _set_status(job, 'NOTIFYING') # from now on, the game master is redirected to the game
+        stats.record(game) # the scores at the game creation
+        _notify(job, game)
+        _set_status(job, 'DONE')
+    except Exception as ex:
+        logger.error("Error in run_game_creation({0})".format(job_id), exc_info = ex)
+        if game is not None and not job.is_dealt():
+            game.delete()
+            job.game = None
+        _set_status(job, 'FAILED', error = ERROR_UNEXPECTED)
+    return job
+
+def release_stale_game_creations():
+    """ The jobs still running without any progress for settings.GAME_CREATION_TIMEOUT seconds, left behind by a thread that has
+         died, e.g. with the web server: those not dealt yet are pending again, their game deleted, and the others have failed,
+         like when the notifications fail. Each job is released by a single UPDATE on its status and date, as it is claimed.
+         Returns the number of jobs released. """
+    deadline = now() - datetime.timedelta(seconds = settings.GAME_CREATION_TIMEOUT)
+    nb_released = 0
+    for job in GameCreationJob.objects.filter(status__in = ('CREATING', 'DEALING', 'NOTIFYING'), update_date__lt = deadline):
+        stale = GameCreationJob.objects.filter(id = job.id, status = job.status, update_date = job.update_date)
+        if job.is_dealt():
+            released = stale.update(status = 'FAILED', error = ERROR_UNEXPECTED, update_date = now())
+        else:
+            released = stale.update(status = 'PENDING', game = None, update_date = now())
+            if released and job.game_id:
+                Game.objects.filter(id = job.game_id).delete()
+        if released:
+            logger.warning("Game creation #{0} released after having been stuck in {1} since {2}".format(job.id, job.status, job.update_date))
+            nb_released += released
+    return nb_released
+
+@transaction.atomic
+def _create_game(job):
+    game = Game.objects.create(ruleset = job.ruleset, master = job.master, start_date = job.start_date, end_date = job.end_date)
+    GamePlayer.objects.bulk_create([GamePlayer(game = game, player_id = player_id) for player_id in job.player_ids])
+    game.rules.add(*job.rule_ids)
+    return game
+
+def _notify(job, game):
+    """ The email of each player, with their opponents and their starting hand, and the email of the admins """
+    players = list(get_user_model().objects.filter(id__in = job.player_ids))
+    all_players = dict((player, {'name': player.name, 'url': job.base_url + reverse('otherprofile', args = [player.id])}) for player in players)
+    game_url = job.base_url + reverse('game', args = [game.id])
+
+    for player in players:
+        opponents = sorted((data for opponent, data in all_players.iteritems() if opponent != player), key = lambda opponent: opponent['name'])
+        utils.send_notification_email('game_create', player,
+                                      {'game': game, 'opponents': opponents, 'rules': rules_in_hand(game, player),
+                                       'commodities': commodities_in_hand(game, player), 'player_timezone': player.timezone, 'url': game_url})
+
+    utils.send_notification_email('game_create_admin', [admin[1] for admin in settings.ADMINS],
+                                  {'game': game, 'players': sorted(all_players.itervalues(), key = lambda player: player['name']),
+                                   'rules': RuleCard.objects.filter(id__in = job.rule_ids).order_by('ref_name')})
+
+def _set_status(job, status, error = ''):
+    job.status, job.error, job.update_date = status, error, now()
+    GameCreationJob.objects.filter(id = job.id).update(status = job.status, error = job.error, game = job.game, update_date = job.update_date)
+
+def _run_in_thread(job_id):
+    try:
+        run_game_creation(job_id)
+    finally:
+        connection.close() # the connection of the thread, not reused once it ends
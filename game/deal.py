@@ -1,5 +1,8 @@
+from collections import Counter
 from random import shuffle
-from ruleset.models import Commodity
+from django.db import transaction
+from ruleset.catalog import get_ruleset, ruleset_catalog
+from game.ledger import record_deal
 from game.models import RuleInHand, CommodityInHand, GamePlayer
 from scoring.card_scoring import Scoresheet, tally_scores
 from scoring.models import ScoreFromCommodity
@@ -28,11 +31,12 @@ def deal_cards(game, nb_tries = 0):
         return False
 
     try:
-        gameplayers = GamePlayer.objects.filter(game = game)
-        ruleset_commodities = Commodity.objects.filter(ruleset = game.ruleset)
+        gameplayers = GamePlayer.objects.filter(game = game).select_related('game', 'player')
+        ruleset = get_ruleset(game.ruleset_id)
+        ruleset_commodities = ruleset_catalog(ruleset.id).commodities
 
-        rules       = dispatch_cards(gameplayers, game.ruleset.starting_rules,       game.rules.all(),    RuleCardDealer())
-        commodities = dispatch_cards(gameplayers, game.ruleset.starting_commodities, ruleset_commodities, CommodityCardDealer())
+        rules       = dispatch_cards(gameplayers, ruleset.starting_rules,       game.rules.all(),    RuleCardDealer())
+        commodities = dispatch_cards(gameplayers, ruleset.starting_commodities, ruleset_commodities, CommodityCardDealer())
 
         # evaluate spread
         scoresheets = prepare_scoresheets(commodities)
@@ -42,17 +46,22 @@ def deal_cards(game, nb_tries = 0):
         if max(scores) - min(scores) > MAX_ACCEPTED_SPREAD:
             raise InappropriateDealingException
 
-        for gameplayer, rulecards in rules.iteritems():
-            for rulecard in rulecards:
-                RuleInHand.objects.create(game = game, player = gameplayer.player, rulecard = rulecard, ownership_date = game.start_date)
-        for gameplayer, commodities in commodities.iteritems():
-            for commodity in set(commodities): # only one record per distinct commodity
-                CommodityInHand.objects.create(game = game, player = gameplayer.player, commodity = commodity, nb_cards = commodities.count(commodity))
-
+        create_hands(game, rules, commodities)
         return True
     except InappropriateDealingException:
         return deal_cards(game, nb_tries = nb_tries + 1) # recursive call to try again
 
+@transaction.atomic
+def create_hands(game, rules, commodities):
+    """ rules: {gameplayer: [rulecard]}, commodities: {gameplayer: [commodity]}, as dispatched by dispatch_cards(). The ledger and the
+         hands are written in a single transaction, with one insert per table whatever the number of players and cards (a few with
+         SQLite, which limits the number of parameters of a query). """
+    record_deal(game, rules, commodities)
+    RuleInHand.objects.bulk_create([RuleInHand(game = game, player_id = gameplayer.player_id, rulecard = rulecard, ownership_date = game.start_date)
+                                    for gameplayer, rulecards in rules.iteritems() for rulecard in rulecards])
+    CommodityInHand.objects.bulk_create([CommodityInHand(game = game, player_id = gameplayer.player_id, commodity = commodity, nb_cards = nb_cards)
+                                         for gameplayer, hand in commodities.iteritems() for commodity, nb_cards in Counter(hand).iteritems()])
+
 def dispatch_cards(gameplayers, nb_cards_per_player, cards, card_dealer):
     """ A deck of n copies of the cards is prepared, with n chosen so that less than an
          additional complete copy will be needed for everyone to get nb_cards_per_player cards
@@ -99,11 +108,11 @@ def prepare_scoresheets(dealt_commodities):
     scoresheets = []
     for gameplayer, commodities in dealt_commodities.iteritems():
         scores_from_commodity = []
-        for commodity in set(commodities):
+        for commodity, nb_cards in Counter(commodities).iteritems():
             scores_from_commodity.append(ScoreFromCommodity(game = gameplayer.game, player = gameplayer.player,
                                                             commodity = commodity,
-                                                            nb_submitted_cards = commodities.count(commodity),
-                                                            nb_scored_cards = commodities.count(commodity),
+                                                            nb_submitted_cards = nb_cards,
+                                                            nb_scored_cards = nb_cards,
                                                             actual_value = commodity.value))
         scoresheets.append(Scoresheet(gameplayer = gameplayer, scores_from_commodity = scores_from_commodity))
     return scoresheets
@@ -15,12 +15,21 @@ class CreateGameForm(forms.Form):
     start_date = forms.DateTimeField()
     end_date = forms.DateTimeField()
 
-    players = forms.ModelMultipleChoiceField(queryset = get_user_model().objects.none())
+    # the players are picked through game.views.search_players: only the ids submitted are read, never the whole table of the users
+    players = forms.ModelMultipleChoiceField(queryset = get_user_model().objects.none(), widget = forms.MultipleHiddenInput)
 
     def __init__(self, game_master, *args, **kwargs):
         super(CreateGameForm, self).__init__(*args, **kwargs)
         self.fields['start_date'].initial = roundTimeToMinute(localtime(now()), roundToMinutes = 15).strftime("%m/%d/%Y %H:%M")
-        self.fields['players'].queryset = get_user_model().objects.exclude(id = game_master.id).order_by_full_name()
+        self.fields['players'].queryset = get_user_model().objects.exclude(id = game_master.id)
+
+    def selected_players(self):
+        """ The players submitted, to display them again with the errors of the form """
+        try:
+            ids = [int(player_id) for player_id in self['players'].value() or []]
+        except (TypeError, ValueError):
+            return []
+        return self.fields['players'].queryset.filter(id__in = ids).order_by_full_name() if ids else []
 
     def clean(self):
         cleaned_data = super(CreateGameForm, self).clean()
@@ -1,5 +1,8 @@
 from django.core.exceptions import PermissionDenied
-from game.models import RuleInHand, CommodityInHand
+from django.utils.crypto import salted_hmac
+from django.utils.timesince import timesince, timeuntil
+from django.utils.timezone import now, localtime
+from game.models import Game, RuleInHand, CommodityInHand
 from trade.models import Offer
 
 
@@ -49,4 +52,33 @@ def _check_game_access_or_PermissionDenied(game, user, players = None):
     super_access = game.has_super_access(user)
     if user not in players and not super_access:
         raise PermissionDenied
-    return super_access
\ No newline at end of file
+    return super_access
+
+def game_etag(request, game_id):
+    """ The ETag of a page of a game for the current user, see game_freshness().
+        It's signed, so that sending back a matching ETag proves that the user has been granted access to this version of the game.
+        Costs a single lookup by primary key; returns None if the game doesn't exist.
+    """
+    try:
+        version, start_date, end_date, closing_date = Game.objects.values_list('version', 'start_date', 'end_date', 'closing_date').get(id = game_id)
+    except Game.DoesNotExist:
+        return None
+    return salted_hmac('game.helpers.game_etag', request.path + game_freshness(request.user, version, start_date, end_date, closing_date)).hexdigest()
+
+def game_freshness(user, version, start_date, end_date, closing_date):
+    """ A string that changes with the version of the game (see Game.bump_version()) and with anything else, not written in the
+         database, that changes what the user sees of the game: the state of the game and how long ago or until when it is
+         (e.g. "ending in 2 days, 3 hours"), the current day (for the dates displayed as "today" or "yesterday") and the timezone
+         of the user. """
+    date_now = now()
+    if date_now < start_date:
+        state = "starting in " + timeuntil(start_date, date_now)
+    elif date_now < end_date:
+        state = "ending in " + timeuntil(end_date, date_now)
+    elif closing_date and closing_date <= date_now:
+        state = "closed " + timesince(closing_date, date_now)
+    else:
+        state = "ended " + timesince(end_date, date_now)
+
+    return u"-".join(unicode(item) for item in [version, user.id, getattr(user, 'timezone', None), start_date, end_date, closing_date,
+                                                 state, localtime(date_now).date()])
@@ -0,0 +1,152 @@
+"""
+    The ledger of the cards of a game.
+
+    Every card dealt, exchanged in a trade or submitted to the game master is recorded as a CardMovement, which is never updated
+     nor deleted. The hands of the players (RuleInHand and CommodityInHand) are the materialized current state of the ledger: they
+     are updated incrementally in the same transaction as the movements are recorded, so that the game board keeps reading them
+     as before.
+
+    hands_at() rebuilds the hands of all the players at any date in one pass over the ledger. The ledger of the games played before
+     it existed is rebuilt from their hands and their accepted trades by backfill_ledger().
+"""
+from collections import Counter
+from django.db.models import F
+from game.models import CardMovement, CommodityInHand, GamePlayer, RuleInHand
+
+def record_deal(game, rules, commodities):
+    """ rules: {gameplayer: [rulecard]}, commodities: {gameplayer: [commodity]}, as dealt by game.deal.deal_cards(), which creates
+         the hands. A single insert. """
+    movements = []
+    for gameplayer, rulecards in rules.iteritems():
+        movements.extend(CardMovement(game = game, player_id = gameplayer.player_id, rulecard = rulecard, nb_cards = 1,
+                                      reason = 'DEAL', date = game.start_date) for rulecard in rulecards)
+    for gameplayer, hand in commodities.iteritems():
+        movements.extend(CardMovement(game = game, player_id = gameplayer.player_id, commodity = commodity, nb_cards = nb_cards,
+                                      reason = 'DEAL', date = game.start_date) for commodity, nb_cards in Counter(hand).iteritems())
+    CardMovement.objects.bulk_create(movements)
+
+def record_trade(trade):
+    """ Exchange the cards of both offers of a trade that has just been accepted: a single insert in the ledger, then the hands
+         are updated with a constant number of queries, plus one update per commodity already in a hand """
+    movements = _trade_movements(trade)
+    CardMovement.objects.bulk_create(movements)
+
+    # the rule cards change hands: the former ones are abandoned and new ones are created for their new owner
+    abandoned_rules = {}
+    for rih in trade.initiator_offer.rulecards:
+        abandoned_rules.setdefault(trade.responder, []).append(rih.id)
+    for rih in trade.responder_offer.rulecards:
+        abandoned_rules.setdefault(trade.initiator, []).append(rih.id)
+    for next_owner, ids in abandoned_rules.iteritems():
+        RuleInHand.objects.filter(id__in = ids).update(abandon_date = trade.closing_date, next_owner = next_owner)
+    RuleInHand.objects.bulk_create([RuleInHand(game_id = trade.game_id, player_id = movement.player_id, rulecard_id = movement.rulecard_id,
+                                               ownership_date = trade.closing_date,
+                                               previous_owner = trade.initiator if movement.player_id == trade.responder_id else trade.responder)
+                                    for movement in movements if movement.rulecard_id and movement.nb_cards > 0])
+
+    # the commodities are counters: one update for each commodity already in the hand, a single insert for the others
+    deltas = Counter()
+    for movement in movements:
+        if movement.commodity_id:
+            deltas[(movement.player_id, movement.commodity_id)] += movement.nb_cards
+    hands = dict(((cih.player_id, cih.commodity_id), cih.id) for cih in
+                 CommodityInHand.objects.filter(game = trade.game_id, player__in = [trade.initiator_id, trade.responder_id],
+                                                commodity__in = set(commodity_id for _player_id, commodity_id in deltas)))
+    new_commodities = []
+    for (player_id, commodity_id), delta in deltas.iteritems():
+        if (player_id, commodity_id) in hands:
+            if delta:
+                CommodityInHand.objects.filter(id = hands[(player_id, commodity_id)]).update(nb_cards = F('nb_cards') + delta)
+        else:
+            new_commodities.append(CommodityInHand(game_id = trade.game_id, player_id = player_id, commodity_id = commodity_id, nb_cards = delta))
+    CommodityInHand.objects.bulk_create(new_commodities)
+
+def _trade_movements(trade):
+    movements = []
+    for giver, receiver, offer in [(trade.initiator_id, trade.responder_id, trade.initiator_offer),
+                                   (trade.responder_id, trade.initiator_id, trade.responder_offer)]:
+        for rih in offer.rulecards:
+            movements.append(CardMovement(game_id = trade.game_id, player_id = giver, rulecard_id = rih.rulecard_id, nb_cards = -1,
+                                          reason = 'TRADE', trade = trade, date = trade.closing_date))
+            movements.append(CardMovement(game_id = trade.game_id, player_id = receiver, rulecard_id = rih.rulecard_id, nb_cards = 1,
+                                          reason = 'TRADE', trade = trade, date = trade.closing_date))
+        for tradedcommodity in offer.tradedcommodities:
+            commodity_id = tradedcommodity.commodityinhand.commodity_id
+            movements.append(CardMovement(game_id = trade.game_id, player_id = giver, commodity_id = commodity_id,
+                                          nb_cards = -tradedcommodity.nb_traded_cards, reason = 'TRADE', trade = trade, date = trade.closing_date))
+            movements.append(CardMovement(game_id = trade.game_id, player_id = receiver, commodity_id = commodity_id,
+                                          nb_cards = tradedcommodity.nb_traded_cards, reason = 'TRADE', trade = trade, date = trade.closing_date))
+    return movements
+
+def record_submission(gameplayer, selected_commodities):
+    """ selected_commodities: {commodityinhand: nb_submitted_cards}, submitted by the player at gameplayer.submit_date """
+    CardMovement.objects.bulk_create([CardMovement(game_id = gameplayer.game_id, player_id = gameplayer.player_id, commodity_id = cih.commodity_id,
+                                                   nb_cards = nb_submitted_cards, reason = 'SUBMIT', date = gameplayer.submit_date)
+                                      for cih, nb_submitted_cards in selected_commodities.iteritems() if nb_submitted_cards])
+    for cih, nb_submitted_cards in selected_commodities.iteritems():
+        cih.nb_submitted_cards = nb_submitted_cards
+        cih.save()
+
+class Hand(object):
+    """ The cards of a player at some point of the ledger, by id of commodity and of rule card """
+    def __init__(self):
+        self.commodities = Counter()
+        self.submitted_commodities = Counter()
+        self.rulecards = Counter()
+
+    def apply(self, commodity_id, rulecard_id, nb_cards, reason):
+        if reason == 'SUBMIT':
+            cards, card_id = self.submitted_commodities, commodity_id
+        else:
+            cards, card_id = (self.commodities, commodity_id) if commodity_id else (self.rulecards, rulecard_id)
+        cards[card_id] += nb_cards
+        if not cards[card_id]:
+            del cards[card_id]
+
+def hands_at(game, date = None):
+    """ The hands of the players of the game at the date (by default, their current hands), as {player id: Hand}, in a single query """
+    movements = CardMovement.objects.filter(game = game)
+    if date is not None:
+        movements = movements.filter(date__lte = date)
+    hands = {}
+    for player_id, commodity_id, rulecard_id, nb_cards, reason in movements.order_by('date', 'id')\
+                                                                          .values_list('player', 'commodity', 'rulecard', 'nb_cards', 'reason'):
+        hands.setdefault(player_id, Hand()).apply(commodity_id, rulecard_id, nb_cards, reason)
+    return hands
+
+def backfill_ledger(game):
+    """ Rebuild the ledger of a game played before it existed, from its current hands and its accepted trades: the cards dealt are
+         the rules without a previous owner and the commodities in hand minus those received in trades. Returns False if the game
+         already has a ledger. """
+    from trade.models import Trade # not at the top: the trades refer to the hands
+
+    if CardMovement.objects.filter(game = game).exists():
+        return False
+
+    trade_movements = []
+    for trade in Trade.objects.filter(game = game, status = 'ACCEPTED').order_by('closing_date', 'id').with_offers():
+        trade_movements.extend(_trade_movements(trade))
+
+    dealt_commodities = Counter()
+    for cih in CommodityInHand.objects.filter(game = game):
+        dealt_commodities[(cih.player_id, cih.commodity_id)] += cih.nb_cards
+    for movement in trade_movements:
+        if movement.commodity_id:
+            dealt_commodities[(movement.player_id, movement.commodity_id)] -= movement.nb_cards
+
+    movements = [CardMovement(game = game, player_id = player_id, commodity_id = commodity_id, nb_cards = nb_cards, reason = 'DEAL',
+                              date = game.start_date)
+                 for (player_id, commodity_id), nb_cards in sorted(dealt_commodities.iteritems()) if nb_cards]
+    movements.extend(CardMovement(game = game, player_id = rih.player_id, rulecard_id = rih.rulecard_id, nb_cards = 1, reason = 'DEAL',
+                                  date = game.start_date)
+                     for rih in RuleInHand.objects.filter(game = game, previous_owner__isnull = True).order_by('id'))
+    movements.extend(trade_movements)
+
+    submit_dates = dict(GamePlayer.objects.filter(game = game, submit_date__isnull = False).values_list('player', 'submit_date'))
+    movements.extend(CardMovement(game = game, player_id = cih.player_id, commodity_id = cih.commodity_id, nb_cards = cih.nb_submitted_cards,
+                                  reason = 'SUBMIT', date = submit_dates[cih.player_id])
+                     for cih in CommodityInHand.objects.filter(game = game, nb_submitted_cards__gt = 0).order_by('id')
+                     if cih.player_id in submit_dates)
+
+    CardMovement.objects.bulk_create(movements)
+    return True
@@ -0,0 +1,26 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from game.archive import archive_game
+from game.models import Game
+
+class Command(BaseCommand):
+    help = ("Move the hands, trades, messages and score statistics of the closed games into their archive (see game.archive), "
+            "so that these tables only hold the rows of the games in progress. Meant to be run periodically, e.g. every night.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--days', type = 'int', default = 7, help = 'Archive only the games closed for at least this number of days [default: 7]'),
+    )
+
+    def handle(self, *args, **options):
+        closed_games = Game.objects.filter(closing_date__lte = now() - datetime.timedelta(days = options['days']), gamearchive__isnull = True)
+        nb_archived = 0
+        for game in closed_games.order_by('closing_date'):
+            if archive_game(game):
+                nb_archived += 1
+                if int(options['verbosity']) > 1:
+                    self.stdout.write("Game #{0} archived".format(game.id))
+        self.stdout.write("{0} game{1} archived".format(nb_archived, 's' if nb_archived > 1 else ''))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from game.ledger import backfill_ledger
+from game.models import Game
+
+class Command(BaseCommand):
+    help = ("Rebuild the ledger of the cards (see game.ledger) of the games dealt before it existed, from their hands and their "
+            "accepted trades. The games already archived are left out, their hands being gone.")
+
+    def handle(self, *args, **options):
+        nb_games = 0
+        for game in Game.objects.filter(gamearchive__isnull = True, ruleinhand__isnull = False).distinct().order_by('id'):
+            with transaction.atomic():
+                if backfill_ledger(game):
+                    nb_games += 1
+                    if int(options['verbosity']) > 1:
+                        self.stdout.write("Ledger of game #{0} rebuilt".format(game.id))
+        self.stdout.write("{0} ledger{1} rebuilt".format(nb_games, 's' if nb_games > 1 else ''))
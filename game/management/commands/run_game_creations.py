@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from game.creation import release_stale_game_creations, run_game_creation
+from game.models import GameCreationJob
+
+class Command(BaseCommand):
+    help = ("Run the creations of games still pending (see game.creation), e.g. those left behind by a restart of the web server, "
+            "once those stuck for settings.GAME_CREATION_TIMEOUT have been released. Meant to be run periodically, or at the start of the server.")
+
+    def handle(self, *args, **options):
+        nb_released = release_stale_game_creations()
+        if nb_released:
+            self.stdout.write("{0} stale game creation{1} released".format(nb_released, 's' if nb_released > 1 else ''))
+
+        nb_run = 0
+        for job_id in GameCreationJob.objects.filter(status = 'PENDING').order_by('creation_date').values_list('id', flat = True):
+            job = run_game_creation(job_id)
+            if job:
+                nb_run += 1
+                if int(options['verbosity']) > 1:
+                    self.stdout.write("Game creation #{0}: {1}".format(job.id, job.get_status_display()))
+        self.stdout.write("{0} game creation{1} run".format(nb_run, 's' if nb_run > 1 else ''))
@@ -1,6 +1,6 @@
 import datetime
 from django.db import models
-from django.db.models import Q, Sum
+from django.db.models import F, Q, Sum
 from django.utils.timezone import now
 from mystrade import settings
 from ruleset.models import Ruleset, RuleCard, Commodity
@@ -19,9 +19,19 @@ class Game(models.Model):
     closing_date = models.DateTimeField("The date when the game has actually been closed, and the scores calculated, by the game master",
                                         null = True)
 
+    version = models.PositiveIntegerField("Incremented at each change visible on the game board, see bump_version()",
+                                          default = 0, editable = False)
+
     def __unicode__(self):
         return "{0}".format(self.id)
 
+    @classmethod
+    def bump_version(cls, game_id):
+        """ To be called in the same transaction as each posting or deletion of a message, trade transition, hand submission and
+             closing of the game. It's an UPDATE ... SET version = version + 1, so that concurrent changes are never lost, and the
+             version must never be written by a full save() of a Game that may have been loaded before a change (see close_game). """
+        cls.objects.filter(id = game_id).update(version = F('version') + 1)
+
     def has_ended(self):
         return now() >= self.end_date
 
@@ -51,6 +61,9 @@ class GamePlayer(models.Model):
     submit_date = models.DateTimeField(null = True)
     last_seen = models.DateTimeField("The last time this player sent an HTTP request related to this game", null = True)
 
+    class Meta:
+        index_together = [('game', 'player')] # is the user a player of the game?
+
 class RuleInHand(models.Model):
     game = models.ForeignKey(Game)
     player = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete = models.PROTECT)
@@ -62,6 +75,9 @@ class RuleInHand(models.Model):
     previous_owner = models.ForeignKey(settings.AUTH_USER_MODEL, null = True, verbose_name = "The player that gave this rulecard", related_name = '+')
     next_owner = models.ForeignKey(settings.AUTH_USER_MODEL, null = True, verbose_name = "The player to whom this rulecard was given", related_name = '+')
 
+    class Meta:
+        index_together = [('game', 'player', 'abandon_date')] # the rules currently in hand (abandon_date is null) or formerly
+
     def __unicode__(self):
         return "Rule <{0}> owned by {1} in game {2}".format(self.rulecard.ref_name, self.player.name, self.game_id)
 
@@ -82,6 +98,9 @@ class CommodityInHand(models.Model):
     nb_submitted_cards = models.PositiveSmallIntegerField("Number of cards submitted to the game master at the end of the game",
                                                           null = True)
 
+    class Meta:
+        index_together = [('game', 'player', 'nb_cards')] # the commodities currently in hand (nb_cards > 0)
+
     def __unicode__(self):
         return "{0} {1} card{2} owned by {3} in game {4}".format(self.nb_cards, self.commodity.name.lower(),
                 's' if self.nb_cards > 1 else '', self.player.name, self.game_id)
@@ -96,6 +115,26 @@ class CommodityInHand(models.Model):
                                 .aggregate(Sum('nb_traded_cards'))['nb_traded_cards__sum']
                                 or 0) # if there are no records to aggregate
 
+class CardMovement(models.Model):
+    """ A line of the append-only ledger of the cards of a game (see game.ledger): cards of a commodity or a rule card dealt to a
+         player, given (nb_cards < 0) or received (nb_cards > 0) in a trade, or commodity cards submitted at the end of the game.
+        The hands (RuleInHand and CommodityInHand) are the current state of the ledger, updated along with it. """
+    REASON_CHOICES = (('DEAL', 'Dealt at the start of the game'), ('TRADE', 'Exchanged in an accepted trade'),
+                      ('SUBMIT', 'Submitted to the game master'))
+
+    game = models.ForeignKey(Game)
+    player = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete = models.PROTECT, related_name = '+')
+    commodity = models.ForeignKey(Commodity, null = True)
+    rulecard = models.ForeignKey(RuleCard, null = True)
+
+    nb_cards = models.SmallIntegerField()
+    reason = models.CharField(max_length = 6, choices = REASON_CHOICES)
+    trade = models.ForeignKey('trade.Trade', null = True, related_name = '+')
+    date = models.DateTimeField(default = now)
+
+    class Meta:
+        index_together = [('game', 'date')] # the replay of the ledger of a game
+
 class Message(models.Model):
     MAX_LENGTH = 255
     GRACE_PERIOD = 20 # in minutes
@@ -116,4 +155,48 @@ class Message(models.Model):
         return self.posting_date
 
     def has_happened(self):
-        return self.date <= now()
\ No newline at end of file
+        return self.date <= now()
+
+class GameArchive(models.Model):
+    """ The hands, trades, messages and score statistics of a closed game, moved out of their tables into a single JSON document
+         once the game is over, so that these tables only hold the rows of the games in progress (see game.archive). """
+    game = models.OneToOneField(Game)
+    content = models.TextField()
+    archive_date = models.DateTimeField(default = now)
+
+class GameCreationJob(models.Model):
+    """ The creation of a game requested by a game master on the page of the rule cards, run in the background (see game.creation):
+         the game is created and its cards dealt, then the players are notified. The page polled by the game master while the
+         job runs redirects them to the game as soon as it has been dealt. """
+    STATUS_CHOICES = (('PENDING', 'Waiting to be run'), ('CREATING', 'Creating the game'), ('DEALING', 'Dealing the cards'),
+                      ('NOTIFYING', 'Notifying the players'), ('DONE', 'Game created'), ('FAILED', 'Failed'))
+
+    master = models.ForeignKey(settings.AUTH_USER_MODEL, related_name = '+')
+    ruleset = models.ForeignKey(Ruleset)
+    start_date = models.DateTimeField()
+    end_date = models.DateTimeField()
+    players = models.TextField("The ids of the players, comma separated")
+    rules = models.TextField("The ids of the rule cards selected, comma separated")
+    base_url = models.CharField("The root of the absolute urls of the notification emails", max_length = 255)
+
+    status = models.CharField(max_length = 9, choices = STATUS_CHOICES, default = 'PENDING')
+    error = models.CharField(max_length = 255, blank = True)
+    game = models.ForeignKey(Game, null = True, on_delete = models.SET_NULL, related_name = '+')
+
+    creation_date = models.DateTimeField(default = now)
+    update_date = models.DateTimeField(default = now)
+
+    @property
+    def player_ids(self):
+        return [int(player_id) for player_id in self.players.split(',') if player_id]
+
+    @property
+    def rule_ids(self):
+        return [int(rule_id) for rule_id in self.rules.split(',') if rule_id]
+
+    def is_dealt(self):
+        """ The game is recorded as soon as it is created, but it can only be played once its cards have been dealt """
+        return self.game_id is not None and self.status not in ('CREATING', 'DEALING')
+
+    def is_finished(self):
+        return self.status in ('DONE', 'FAILED')
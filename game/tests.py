@@ -1,29 +1,43 @@
 import ast
 import datetime
+import json
+from collections import Counter
+from StringIO import StringIO
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
 from django.core import mail
+from django.core.cache import get_cache
+from django.core.management import call_command
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.db.models.aggregates import Sum
-from django.test import TestCase, TransactionTestCase
-from django.test.utils import override_settings
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.utils import dateformat
 from django.utils.datetime_safe import strftime
 from django.utils.formats import date_format
 from django.utils.timezone import now, utc, localtime
 from model_mommy import mommy
-from game import views, deal
+from game import views, deal, creation
 
-from game.deal import InappropriateDealingException, RuleCardDealer, deal_cards, \
+from game.archive import archive_game, load_archive
+from game.creation import run_game_creation
+from game.deal import InappropriateDealingException, RuleCardDealer, create_hands, deal_cards, \
     prepare_deck, dispatch_cards, CommodityCardDealer, MAX_TRIES
 from game.forms import validate_number_of_players, validate_dates
 from game.helpers import rules_in_hand, rules_formerly_in_hand, commodities_in_hand, known_rules, free_informations_until_now
-from game.models import Game, RuleInHand, CommodityInHand, GamePlayer, Message
+from game.ledger import Hand, backfill_ledger, hands_at, record_submission, record_trade
+from game.models import Game, RuleInHand, CommodityInHand, GamePlayer, Message, GameArchive, CardMovement, GameCreationJob
 from game.views import SECONDS_BEFORE_OFFLINE
+from ruleset.catalog import ruleset_catalog
 from ruleset.models import Ruleset, RuleCard, Commodity
 from scoring.card_scoring import Scoresheet
-from scoring.models import ScoreFromCommodity, ScoreFromRule
-from trade.models import Offer, Trade, TradedCommodities
+from scoring.models import PlayerRating, RatingChange, ScoreFromCommodity, ScoreFromRule
+from scoring.scoreboard import load_scoreboard
+from trade.models import Offer, Trade, TradedCommodities, TradeQuerySet
+from utils.models import StatsScore, StatsSnapshot
 from utils.tests import MystradeTestCase
 
 class EntryPageViewTest(MystradeTestCase):
@@ -118,6 +132,7 @@ class EntryPageViewTest(MystradeTestCase):
         self.assertContains(response, "09/05/2013 4:30 p.m.")
         self.assertNotContains(response, "09/05/2013 11:30 p.m.")
 
+@override_settings(GAME_CREATION_IN_BACKGROUND = False) # no thread on the in-memory test database
 class GameCreationViewsTest(TestCase):
     fixtures = ['initial_data.json',
                 'test_users.json'] # from profile app
@@ -163,6 +178,41 @@ class GameCreationViewsTest(TestCase):
         self.assertEqual(1352762100, self.client.session['end_date'])
         self.assertItemsEqual([player.id for player in self.testUsersNoCreate], self.client.session['players'])
 
+    def test_create_game_page_does_not_list_all_the_users(self):
+        response = self.client.get("/game/create/")
+        self.assertNotContains(response, get_user_model().objects.get(username = 'test9').name)
+
+        response = self.client.post("/game/create/", {'ruleset': self.ruleset.id, 'start_date': '', 'end_date': '11/13/2012 00:15',
+                                                      'players': [player.id for player in self.testUsersNoCreate[:2]]})
+        self.assertEqual(sorted(self.testUsersNoCreate[:2], key = lambda player: player.name.lower()), list(response.context['form'].selected_players()))
+        self.assertContains(response, 'name="players" value="{0}"'.format(self.testUsersNoCreate[0].id))
+
+    def test_search_players_by_prefix_of_the_name_or_the_username(self):
+        luke = mommy.make(get_user_model(), username = 'jedi', first_name = 'Luke', last_name = 'Skywalker')
+        response = self.client.get("/game/create/players/", {'q': 'LUKE s'}, HTTP_X_REQUESTED_WITH = 'XMLHttpRequest')
+        self.assertEqual({'players': [{'id': luke.id, 'name': 'Luke Skywalker'}], 'more': False}, json.loads(response.content))
+
+        response = self.client.get("/game/create/players/", {'q': 'jed'}, HTTP_X_REQUESTED_WITH = 'XMLHttpRequest')
+        self.assertEqual([luke.id], [player['id'] for player in json.loads(response.content)['players']])
+
+        response = self.client.get("/game/create/players/", {'q': 'test1'}, HTTP_X_REQUESTED_WITH = 'XMLHttpRequest')
+        self.assertNotIn(self.testUserCanCreate.id, [player['id'] for player in json.loads(response.content)['players']]) # the game master
+
+        self.assertEqual(403, self.client.get("/game/create/players/", {'q': 'jed'}).status_code)
+
+    def test_search_players_by_pages(self):
+        for index in range(views.PLAYER_SEARCH_PAGE_SIZE + 1):
+            mommy.make(get_user_model(), username = 'player{0:02d}'.format(index), first_name = '', last_name = '')
+        users = list(get_user_model().objects.filter(username__startswith = 'player').order_by_full_name())
+
+        page1 = json.loads(self.client.get("/game/create/players/", {'q': 'player'}, HTTP_X_REQUESTED_WITH = 'XMLHttpRequest').content)
+        page2 = json.loads(self.client.get("/game/create/players/", {'q': 'player', 'page': 2}, HTTP_X_REQUESTED_WITH = 'XMLHttpRequest').content)
+
+        self.assertEqual([user.id for user in users[:views.PLAYER_SEARCH_PAGE_SIZE]], [player['id'] for player in page1['players']])
+        self.assertTrue(page1['more'])
+        self.assertEqual([users[-1].id], [player['id'] for player in page2['players']])
+        self.assertFalse(page2['more'])
+
     def test_access_select_rules_with_incomplete_session_redirects_to_first_page(self):
         session = self.client.session
         session['ruleset'] = self.ruleset.id
@@ -303,6 +353,98 @@ class GameCreationViewsTest(TestCase):
         self.assertIn("The ruleset is: {0}".format(created_game.ruleset.name), emailAdmin.body)
         self.assertEqual(4, emailAdmin.body.count('- Rule'))
 
+    def test_game_creation_is_polled_until_the_game_is_dealt(self):
+        players = list(self.testUsersNoCreate)[:4]
+        job = self._job(players)
+        session = self.client.session
+        session['players'] = [player.id for player in players]
+        session.save()
+
+        response = self.client.get("/game/create/{0}/".format(job.id), HTTP_X_REQUESTED_WITH = 'XMLHttpRequest')
+        self.assertEqual({'status': 'PENDING', 'progress': 'Waiting to be run', 'error': '', 'url': None}, json.loads(response.content))
+        response = self.client.get("/game/create/{0}/".format(job.id))
+        self.assertTemplateUsed(response, 'game/game_creation.html')
+
+        with self.assertNumQueries(6): # the game, a single insert for all the players, two queries for all the rules, and the savepoint
+            creation._create_game(job)
+        Game.objects.all().delete()
+
+        self.assertEqual(job.id, run_game_creation(job.id).id)
+        self.assertIsNone(run_game_creation(job.id)) # never run twice
+        job = GameCreationJob.objects.get(id = job.id)
+        self.assertEqual('DONE', job.status)
+        self.assertItemsEqual(players, job.game.players.all())
+        self.assertListEqual([1, 2], [rule.id for rule in job.game.rules.all()])
+        self.assertEqual(4, RuleInHand.objects.filter(game = job.game).count() / job.game.ruleset.starting_rules)
+        self.assertEqual(4, StatsScore.objects.filter(game = job.game).count())
+        self.assertIn('http://testserver/game/{0}/'.format(job.game_id), mail.outbox[0].body)
+
+        response = self.client.get("/game/create/{0}/".format(job.id), HTTP_X_REQUESTED_WITH = 'XMLHttpRequest')
+        self.assertEqual('/game/create/{0}/'.format(job.id), json.loads(response.content)['url'])
+        response = self.client.get("/game/create/{0}/".format(job.id))
+        self.assertEqual(302, response.status_code)
+        self.assertTrue(response['Location'].endswith("/game/{0}/".format(job.game_id)))
+        self.assertFalse('players' in self.client.session)
+
+    def test_game_creation_fails_when_the_cards_cannot_be_dealt(self):
+        job = self._job(list(self.testUsersNoCreate)[:4])
+        max_tries = deal.MAX_TRIES
+        try:
+            deal.MAX_TRIES = 0
+            run_game_creation(job.id)
+        finally:
+            deal.MAX_TRIES = max_tries
+
+        job = GameCreationJob.objects.get(id = job.id)
+        self.assertEqual(('FAILED', creation.ERROR_DEAL), (job.status, job.error))
+        self.assertFalse(job.is_dealt())
+        self.assertFalse(Game.objects.filter(master = self.testUserCanCreate).exists())
+        self.assertEqual(0, len(mail.outbox))
+
+        response = self.client.get("/game/create/{0}/".format(job.id))
+        self.assertContains(response, creation.ERROR_DEAL)
+
+    def test_stale_game_creations_are_released_and_run_again(self):
+        players = list(self.testUsersNoCreate)[:4]
+        stale_date = now() - datetime.timedelta(seconds = settings.GAME_CREATION_TIMEOUT + 60)
+
+        # died while dealing the cards: the game is only recorded to be deleted
+        job_dealing = self._job(players)
+        stale_game = creation._create_game(job_dealing)
+        GameCreationJob.objects.filter(id = job_dealing.id).update(status = 'DEALING', game = stale_game, update_date = stale_date)
+        self.assertFalse(GameCreationJob.objects.get(id = job_dealing.id).is_dealt())
+
+        # died while notifying the players: the game can be played anyway
+        job_notifying = run_game_creation(self._job(players).id)
+        GameCreationJob.objects.filter(id = job_notifying.id).update(status = 'NOTIFYING', update_date = stale_date)
+
+        # still running
+        job_creating = self._job(players)
+        GameCreationJob.objects.filter(id = job_creating.id).update(status = 'CREATING')
+
+        call_command('run_game_creations', stdout = StringIO())
+
+        job_dealing = GameCreationJob.objects.get(id = job_dealing.id)
+        self.assertEqual('DONE', job_dealing.status)
+        self.assertNotEqual(stale_game.id, job_dealing.game_id)
+        self.assertFalse(Game.objects.filter(id = stale_game.id).exists())
+
+        job_notifying = GameCreationJob.objects.get(id = job_notifying.id)
+        self.assertEqual(('FAILED', creation.ERROR_UNEXPECTED), (job_notifying.status, job_notifying.error))
+        self.assertTrue(job_notifying.is_dealt())
+
+        self.assertEqual('CREATING', GameCreationJob.objects.get(id = job_creating.id).status)
+        self.assertEqual(0, creation.release_stale_game_creations())
+
+    def test_game_creation_is_only_visible_by_its_master(self):
+        job = self._job(list(self.testUsersNoCreate)[:4], master = get_user_model().objects.get(username = 'test9'))
+        self.assertEqual(404, self.client.get("/game/create/{0}/".format(job.id)).status_code)
+
+    def _job(self, players, master = None):
+        return GameCreationJob.objects.create(master = master or self.testUserCanCreate, ruleset = self.ruleset, start_date = now(),
+                                              end_date = now() + datetime.timedelta(days = 7), players = ",".join(str(player.id) for player in players),
+                                              rules = "1,2", base_url = 'http://testserver')
+
 class GameModelsTest(MystradeTestCase):
 
     def test_game_is_active_if_start_and_end_date_enclose_now(self):
@@ -332,6 +474,27 @@ class GameModelsTest(MystradeTestCase):
         self.assertTrue(self.game.has_super_access(self.admin))
         self.assertFalse(self.game.has_super_access(self.admin_player))
 
+    def test_game_version_is_bumped_by_each_change_of_the_game(self):
+        self.assertEqual(0, Game.objects.get(id = self.game.id).version)
+
+        Game.bump_version(self.game.id)
+        Game.bump_version(self.game.id)
+        self.assertEqual(2, Game.objects.get(id = self.game.id).version)
+
+        self.client.post("/game/{0}/postmessage/".format(self.game.id), {'message': 'Hello'}, HTTP_X_REQUESTED_WITH = 'XMLHttpRequest')
+        self.assertEqual(3, Game.objects.get(id = self.game.id).version)
+
+        self.client.post("/game/{0}/deletemessage/".format(self.game.id), {'event_id': Message.objects.get(game = self.game).id},
+                         HTTP_X_REQUESTED_WITH = 'XMLHttpRequest')
+        self.assertEqual(4, Game.objects.get(id = self.game.id).version)
+
+        trade = mommy.make(Trade, game = self.game, initiator = self.loginUser, responder = self.alternativeUser, status = 'INITIATED',
+                           initiator_offer = mommy.make(Offer))
+        self.assertFalse(trade.transition('REPLIED', 'ACCEPTED'))
+        self.assertEqual(4, Game.objects.get(id = self.game.id).version)
+        self.assertTrue(trade.transition('INITIATED', 'CANCELLED', finalizer = self.loginUser, closing_date = now()))
+        self.assertEqual(5, Game.objects.get(id = self.game.id).version)
+
 class GameBoardMainTest(MystradeTestCase):
 
     def test_game_board_returns_a_404_if_the_game_id_doesnt_exist(self):
@@ -495,6 +658,63 @@ class GameBoardMainTest(MystradeTestCase):
         self.assertTrue(response.cookies.has_key('mystrade-lastVisitedGame-id'))
         self.assertEqual('Thu, 01-Jan-1970 00:00:00 GMT', response.cookies['mystrade-lastVisitedGame-id']['expires'])
 
+    def test_game_board_is_not_modified_until_the_version_of_the_game_changes(self):
+        self.assertFalse(self._assertGetGamePage().has_header('ETag')) # the first visit shows the foreword
+        etag = self._assertGetGamePage()['ETag']
+
+        response = self.client.get(reverse('game', args = [self.game.id]), HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(304, response.status_code)
+
+        # not for another user
+        self.login_as(self.alternativeUser)
+        self._assertGetGamePage()
+        response = self.client.get(reverse('game', args = [self.game.id]), HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(200, response.status_code)
+
+        # nor after a change
+        etag = response['ETag']
+        Game.bump_version(self.game.id)
+        response = self.client.get(reverse('game', args = [self.game.id]), HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(200, response.status_code)
+
+    @override_settings(CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test_game_board'}})
+    def test_game_board_fragments_are_cached_until_the_version_of_the_game_changes(self):
+        get_cache('default').clear()
+        response = self._assertGetGamePage()
+        self.assertTemplateUsed(response, 'game/hand.html')
+        nb_cards = response.content.count('data-commodity-id=')
+        self.assertEqual({'hits': 0, 'misses': 1, 'rate': 0.0}, views.board_fragments_hit_rate())
+
+        # not an ETag revalidation: the page is rendered again, but not the hand
+        response = self._assertGetGamePage()
+        self.assertContains(response, 'data-commodity-id=', count = nb_cards)
+        self.assertTemplateNotUsed(response, 'game/hand.html')
+        self.assertEqual({'hits': 1, 'misses': 1, 'rate': 0.5}, views.board_fragments_hit_rate())
+
+        mommy.make(CommodityInHand, game = self.game, player = self.loginUser, nb_cards = 2,
+                   commodity = Commodity.objects.get(ruleset = 1, name = 'Blue'))
+        response = self._assertGetGamePage()
+        self.assertContains(response, 'data-commodity-id=', count = nb_cards)
+        Game.bump_version(self.game.id)
+        response = self._assertGetGamePage()
+        self.assertContains(response, 'data-commodity-id=', count = nb_cards + 2)
+
+    @skipUnlessDBFeature('can_distinct_on_fields') # known_rules()
+    @override_settings(CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test_game_board'}})
+    def test_game_board_scores_are_cached_until_the_version_of_the_game_changes(self):
+        get_cache('default').clear()
+        self.login_as(self.master)
+
+        self._assertGetGamePage()
+        response = self._assertGetGamePage()
+        self.assertContains(response, 'Current Scores')
+        self.assertTemplateNotUsed(response, 'game/scores.html')
+        self.assertEqual({'hits': 1, 'misses': 1, 'rate': 0.5}, views.board_fragments_hit_rate())
+
+        Game.bump_version(self.game.id)
+        response = self._assertGetGamePage()
+        self.assertTemplateUsed(response, 'game/scores.html')
+
     def _assertGetGamePage(self, game = None, status_code = 200):
         if game is None:
             game = self.game
@@ -586,7 +806,8 @@ class GameBoardZoneHandTest(MystradeTestCase):
         offer1_from_me_as_initiator = mommy.make(Offer, free_information = "I don't need to see that 1")
         offer1_from_other_as_responder = mommy.make(Offer, free_information = "Show me this 1")
         trade1 = mommy.make(Trade, game = self.game, initiator = self.loginUser, responder = self.alternativeUser, status = 'ACCEPTED',
-                            initiator_offer = offer1_from_me_as_initiator, responder_offer = offer1_from_other_as_responder)
+                            initiator_offer = offer1_from_me_as_initiator, responder_offer = offer1_from_other_as_responder,
+                            closing_date = now() - datetime.timedelta(hours = 1))
 
         offer2_from_other_as_initiator = mommy.make(Offer, free_information = "Show me this 2")
         trade2 = mommy.make(Trade, game = self.game, initiator = self.alternativeUser, responder = self.loginUser, status = 'ACCEPTED',
@@ -602,6 +823,8 @@ class GameBoardZoneHandTest(MystradeTestCase):
         self.assertContains(response, "Show me this 2")
         self.assertNotContains(response, "I don't need to see that 1")
         self.assertNotContains(response, "I don't need to see that 3")
+        # the hand is cached: the relative date is computed in the browser from the date of the trade
+        self.assertContains(response, 'data-timestamp="{0}"'.format(dateformat.format(trade1.closing_date, 'U')))
 
     def test_game_board_doesnt_display_free_informations_from_ACCEPTED_trades_of_other_games(self):
         other_game = mommy.make(Game, master = self.master, end_date = now() + datetime.timedelta(days = 7))
@@ -969,6 +1192,46 @@ class GameBoardTabRecentlyTest(MystradeTestCase):
         online_players = ast.literal_eval(response['online_players'])
         self.assertItemsEqual([self.loginUser.id, 5, 6], online_players)
 
+    def test_tab_recently_returns_no_content_in_a_single_lookup_if_the_version_of_the_game_has_not_changed(self):
+        response = self._getTabRecently()
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.has_header('ETag'))
+        querystring = "lastEventsRefreshDate=" + strftime(self.game.start_date, views.FORMAT_EVENT_PERMALINK)
+
+        # the version of the game and the online players (and the middlewares): the events aren't read
+        with self.assertNumQueries(4 + 2):
+            response = self._getTabRecently(querystring, HTTP_IF_NONE_MATCH = response['ETag'])
+        self.assertEqual(204, response.status_code)
+        self.assertEqual("False", response['full_refresh'])
+        self.assertItemsEqual([self.loginUser.id], ast.literal_eval(response['online_players']))
+
+        etag = response['ETag']
+        self._postMessage('Something new')
+        response = self._getTabRecently(querystring, HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, 'Something new')
+        self.assertNotEqual(etag, response['ETag'])
+
+        # the ETag of another player doesn't match
+        etag = response['ETag']
+        self.login_as(self.alternativeUser)
+        self._getTabRecently()
+        response = self._getTabRecently(querystring, HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(200, response.status_code)
+
+    def test_tab_recently_the_refresh_date_is_the_date_of_the_newest_event_read(self):
+        # the events may be read from a lagging replica: the refresh date mustn't skip the events it hasn't received yet
+        message = mommy.make(Message, game = self.game, sender = self.alternativeUser, content = 'Read',
+                             posting_date = now() + datetime.timedelta(seconds = -60))
+
+        response = self._getTabRecently()
+        self.assertEqual(strftime(message.posting_date, views.FORMAT_EVENT_PERMALINK), response.context['lastEventsRefreshDate'])
+
+        mommy.make(Message, game = self.game, sender = self.alternativeUser, content = 'Not yet replicated',
+                   posting_date = now() + datetime.timedelta(seconds = -30))
+        response = self._getTabRecently("lastEventsRefreshDate=" + response.context['lastEventsRefreshDate'])
+        self.assertContains(response, 'Not yet replicated')
+
     def test_tab_recently_post_a_message_works_and_redirect_as_a_GET_request(self):
         self.assertEqual(0, Message.objects.count())
 
@@ -1120,10 +1383,10 @@ class GameBoardTabRecentlyTest(MystradeTestCase):
         response = self._getTabRecently()
         self.assertEqual("False", response.get('full_refresh'))
 
-    def _getTabRecently(self, querystring = None):
+    def _getTabRecently(self, querystring = None, **extra):
         url = "/game/{0}/events".format(self.game.id)
         if querystring: url += "?" + querystring
-        return self.client.get(url, follow = True, HTTP_X_REQUESTED_WITH='XMLHttpRequest') # simulate AJAX
+        return self.client.get(url, follow = True, HTTP_X_REQUESTED_WITH='XMLHttpRequest', **extra) # simulate AJAX
 
     def _postMessage(self, message):
         return self.client.post("/game/{0}/postmessage/".format(self.game.id),
@@ -1535,6 +1798,19 @@ class ControlBoardViewTest(MystradeTestCase):
         self.assertEqual(1, len(sfr2))
         self.assertEqual('HAG04', sfr2[0].rulecard.ref_name)
 
+        # the final scores are frozen by rank
+        scoreboard = load_scoreboard(self.game_ended)
+        self.assertEqual([test6, self.alternativeUser, test7, test8], [scoresheet.gameplayer.player for scoresheet in scoreboard][:4])
+        self.assertEqual([18, 17, 6, 4], [scoresheet.total_score for scoresheet in scoreboard][:4])
+        self.assertEqual(['(4) Since there are 4 white cards (more than three), their value is set to zero.'],
+                         ["({0}) {1}".format(sfr.rulecard.public_name, sfr.detail) for sfr in scoreboard[0].scores_from_rule])
+
+        # and the players are rated
+        changes = RatingChange.objects.filter(game = self.game_ended).order_by('rank')
+        self.assertEqual([test6, self.alternativeUser, test7, test8], [change.player for change in changes][:4])
+        self.assertEqual([1, 2, 3, 4], [change.rank for change in changes][:4])
+        self.assertGreater(PlayerRating.objects.get(player = test6).rating, PlayerRating.objects.get(player = test8).rating)
+
         # notification emails sent
         self.assertEqual(6, len(mail.outbox))
         list_recipients = [msg.to[0] for msg in mail.outbox]
@@ -1643,13 +1919,10 @@ class TransactionalViewsTest(TransactionTestCase):
                    status = 'INITIATED', initiator_offer = mommy.make(Offer), finalizer = None)
 
         def mock_abort(self, whodunit, closing_date):
-            self.status = 'CANCELLED'
-            self.finalizer = whodunit
-            self.closing_date = closing_date
-            self.save()
+            self.update(status = 'CANCELLED', finalizer = whodunit, closing_date = closing_date)
             raise RuntimeError
-        old_abort = Trade.abort
-        Trade.abort = mock_abort
+        old_abort = TradeQuerySet.abort
+        TradeQuerySet.abort = mock_abort
 
         try:
             response = self.client.post("/game/{0}/submithand/".format(self.game.id),
@@ -1669,7 +1942,26 @@ class TransactionalViewsTest(TransactionTestCase):
             self.assertIsNone(trade.finalizer)
             self.assertIsNone(trade.closing_date)
         finally:
-            Trade.abort = old_abort
+            TradeQuerySet.abort = old_abort
+
+    def test_game_creation_run_in_a_thread_closes_its_connection(self):
+        players = get_user_model().objects.exclude(user_permissions__codename = "add_game")[:4]
+        job = GameCreationJob.objects.create(master = self.master, ruleset = self.game.ruleset, start_date = now(),
+                                             end_date = now() + datetime.timedelta(days = 7), players = ",".join(str(player.id) for player in players),
+                                             rules = "1,2", base_url = 'http://testserver')
+        closed = []
+        connection.close = lambda: closed.append(True) # an in-memory database wouldn't survive its connection
+        try:
+            creation._run_in_thread(job.id)
+            self.assertEqual([True], closed)
+            creation._run_in_thread(job.id) # not pending anymore
+            self.assertEqual([True, True], closed)
+        finally:
+            del connection.close
+
+        job = GameCreationJob.objects.get(id = job.id)
+        self.assertEqual('DONE', job.status)
+        self.assertItemsEqual(players, job.game.players.all())
 
     def test_close_game_is_transactional(self):
         def mock_persist(self):
@@ -1831,6 +2123,22 @@ class DealTest(TestCase):
             nb_cards = CommodityInHand.objects.filter(game = self.game, commodity = commodity).aggregate(Sum('nb_cards'))
             self.assertTrue(min_occurence <= nb_cards['nb_cards__sum'] <= min_occurence+1)
 
+    def test_create_hands_with_one_insert_per_table(self):
+        gameplayers = GamePlayer.objects.filter(game = self.game)
+        rules = dict((gameplayer, self.rules[:self.RULES_PER_PLAYER]) for gameplayer in gameplayers)
+        commodities = dispatch_cards(gameplayers, self.COMMODITIES_PER_PLAYER, self.commodities, CommodityCardDealer())
+
+        with self.assertNumQueries(5): # the ledger, the rules and the commodities, within a savepoint
+            create_hands(self.game, rules, commodities)
+
+        for gameplayer, hand in commodities.iteritems():
+            self.assertEqual(Counter(hand), dict((cih.commodity, cih.nb_cards) for cih in
+                                                 CommodityInHand.objects.filter(game = self.game, player = gameplayer.player_id)))
+            self.assertItemsEqual(self.rules[:self.RULES_PER_PLAYER], [rih.rulecard for rih in
+                                                                       RuleInHand.objects.filter(game = self.game, player = gameplayer.player_id)])
+        self.assertEqual(len(gameplayers) * (self.RULES_PER_PLAYER + self.COMMODITIES_PER_PLAYER),
+                         CardMovement.objects.filter(game = self.game).aggregate(Sum('nb_cards'))['nb_cards__sum'])
+
     def test_deal_cards_returns_False_after_too_many_tries(self):
         self.assertFalse(deal_cards(None, MAX_TRIES))
 
@@ -1848,6 +2156,190 @@ class DealTest(TestCase):
         finally:
             deal.prepare_scoresheets = old_prepare_scoresheets
 
+class CardLedgerTest(TestCase):
+    def setUp(self):
+        self.ruleset = mommy.make(Ruleset, starting_rules = 2, starting_commodities = 6)
+        self.game = mommy.make(Game, ruleset = self.ruleset, start_date = now() - datetime.timedelta(days = 2),
+                               end_date = now() + datetime.timedelta(days = 7))
+        self.users = [mommy.make(get_user_model(), username = i) for i in range(4)]
+        for user in self.users:
+            mommy.make(GamePlayer, game = self.game, player = user)
+        self.game.rules.add(*[mommy.make(RuleCard, ruleset = self.ruleset, ref_name = i) for i in range(4)])
+        for i in range(5):
+            mommy.make(Commodity, ruleset = self.ruleset, name = str(i), value = 1)
+        self.assertTrue(deal_cards(self.game))
+
+    def test_the_hands_are_the_current_state_of_the_ledger(self):
+        self.assertEqual(self._hands_in_tables(), self._hands(hands_at(self.game)))
+
+        self._accept_trade(self.users[0], self.users[1])
+        self._accept_trade(self.users[1], self.users[2])
+        self.assertEqual(self._hands_in_tables(), self._hands(hands_at(self.game)))
+
+        gameplayer = GamePlayer.objects.get(game = self.game, player = self.users[0])
+        gameplayer.submit_date = now()
+        gameplayer.save()
+        record_submission(gameplayer, dict((cih, 1) for cih in commodities_in_hand(self.game, self.users[0])))
+        self.assertEqual(self._hands_in_tables(), self._hands(hands_at(self.game)))
+
+    def test_hands_at_a_past_date(self):
+        hands_after_the_deal = self._hands_in_tables()
+        trade = self._accept_trade(self.users[0], self.users[1])
+
+        self.assertEqual(hands_after_the_deal, self._hands(hands_at(self.game, trade.closing_date - datetime.timedelta(seconds = 1))))
+        self.assertNotEqual(hands_after_the_deal, self._hands(hands_at(self.game, trade.closing_date)))
+        self.assertEqual({}, hands_at(self.game, self.game.start_date - datetime.timedelta(seconds = 1)))
+
+    def test_accepting_a_trade_is_a_single_insert_in_the_ledger(self):
+        nb_movements = CardMovement.objects.filter(game = self.game).count()
+        with CaptureQueriesContext(connection) as context:
+            trade = self._accept_trade(self.users[0], self.users[1])
+        self.assertEqual(1, len([query for query in context.captured_queries if CardMovement._meta.db_table in query['sql'] and 'INSERT' in query['sql']]))
+        # given by one player, received by the other: the rule card and the commodities of each offer
+        nb_cards = 2 + TradedCommodities.objects.filter(offer__in = [trade.initiator_offer, trade.responder_offer]).count()
+        self.assertEqual(nb_movements + 2 * nb_cards, CardMovement.objects.filter(game = self.game).count())
+        self.assertEqual(2 * nb_cards, CardMovement.objects.filter(game = self.game, trade = trade, reason = 'TRADE').count())
+
+    def test_backfill_ledger(self):
+        hands_after_the_deal = self._hands_in_tables()
+        trade = self._accept_trade(self.users[0], self.users[1])
+        self._accept_trade(self.users[2], self.users[0])
+        gameplayer = GamePlayer.objects.get(game = self.game, player = self.users[1])
+        gameplayer.submit_date = now()
+        gameplayer.save()
+        record_submission(gameplayer, dict((cih, cih.nb_cards) for cih in commodities_in_hand(self.game, self.users[1])))
+        hands = self._hands(hands_at(self.game))
+
+        self.assertFalse(backfill_ledger(self.game))
+        CardMovement.objects.filter(game = self.game).delete()
+        self.assertTrue(backfill_ledger(self.game))
+
+        self.assertEqual(hands, self._hands(hands_at(self.game)))
+        self.assertEqual(hands_after_the_deal, self._hands(hands_at(self.game, trade.closing_date - datetime.timedelta(seconds = 1))))
+
+    def _accept_trade(self, initiator, responder):
+        """ Two commodity cards and a rule card on each side, exchanged as accept_trade() does """
+        offers = []
+        for player in [initiator, responder]:
+            rih = rules_in_hand(self.game, player)[0]
+            offer = mommy.make(Offer, rules = [rih])
+            for cih in commodities_in_hand(self.game, player)[:2]:
+                mommy.make(TradedCommodities, offer = offer, commodityinhand = cih, nb_traded_cards = 1)
+            offers.append(offer)
+        trade = mommy.make(Trade, game = self.game, initiator = initiator, responder = responder, status = 'ACCEPTED', finalizer = initiator,
+                           initiator_offer = offers[0], responder_offer = offers[1], closing_date = now())
+        record_trade(trade)
+        return trade
+
+    def _hands_in_tables(self):
+        hands = {}
+        for cih in CommodityInHand.objects.filter(game = self.game):
+            hand = hands.setdefault(cih.player_id, Hand())
+            hand.apply(cih.commodity_id, None, cih.nb_cards, 'DEAL')
+            hand.apply(cih.commodity_id, None, cih.nb_submitted_cards or 0, 'SUBMIT')
+        for rih in RuleInHand.objects.filter(game = self.game, abandon_date__isnull = True):
+            hands.setdefault(rih.player_id, Hand()).apply(None, rih.rulecard_id, 1, 'DEAL')
+        return self._hands(hands)
+
+    def _hands(self, hands):
+        return dict((player_id, (hand.commodities, hand.submitted_commodities, hand.rulecards)) for player_id, hand in hands.iteritems())
+
+class GameArchiveTest(MystradeTestCase):
+
+    def setUp(self):
+        super(GameArchiveTest, self).setUp()
+        self.game.end_date = self.game.closing_date = now() + datetime.timedelta(days = -1)
+        self.game.save()
+
+        yellow = Commodity.objects.get(name = 'Yellow', ruleset__id = 1)
+        cih = mommy.make(CommodityInHand, game = self.game, player = self.loginUser, commodity = yellow, nb_cards = 3, nb_submitted_cards = 3)
+        rih = mommy.make(RuleInHand, game = self.game, player = self.loginUser, rulecard = RuleCard.objects.get(ref_name = 'HAG05'),
+                         ownership_date = self.game.start_date)
+        initiator_offer = mommy.make(Offer, comment = "a deal", nb_rulecards = 1, nb_commodity_cards = 2)
+        mommy.make(TradedCommodities, offer = initiator_offer, commodityinhand = cih, nb_traded_cards = 2)
+        initiator_offer.rules.add(rih)
+        self.trade = mommy.make(Trade, game = self.game, initiator = self.loginUser, responder = self.alternativeUser, status = 'ACCEPTED',
+                                initiator_offer = initiator_offer, responder_offer = mommy.make(Offer, free_information = "a secret"),
+                                finalizer = self.loginUser, creation_date = self.game.end_date + datetime.timedelta(days = -2),
+                                closing_date = self.game.end_date + datetime.timedelta(days = -1))
+        mommy.make(Trade, game = self.game, initiator = self.alternativeUser, responder = self.master, status = 'ACCEPTED',
+                   initiator_offer = mommy.make(Offer), responder_offer = mommy.make(Offer), finalizer = self.alternativeUser,
+                   creation_date = self.game.end_date + datetime.timedelta(days = -3), closing_date = self.game.end_date + datetime.timedelta(days = -2))
+        mommy.make(Message, game = self.game, sender = self.alternativeUser, content = "Hello",
+                   posting_date = self.game.end_date + datetime.timedelta(days = -4))
+        mommy.make(StatsScore, game = self.game, player = self.loginUser, trade = self.trade, score = 12, date_score = self.trade.closing_date)
+
+    def test_archive_game_moves_the_rows_of_the_game_into_its_archive(self):
+        other_game = mommy.make(Game, end_date = now())
+        mommy.make(Message, game = other_game, sender = self.loginUser)
+
+        self.assertIsNotNone(archive_game(self.game))
+
+        self.assertTrue(GameArchive.objects.filter(game = self.game).exists())
+        for model in [CommodityInHand, RuleInHand, Trade, Message, StatsScore, StatsSnapshot]:
+            self.assertEqual(0, model.objects.filter(game = self.game).count())
+        self.assertEqual(0, Offer.objects.count())
+        self.assertEqual(0, TradedCommodities.objects.count())
+        self.assertEqual(0, Offer.rules.through.objects.count())
+        self.assertEqual(1, Message.objects.filter(game = other_game).count())
+
+        self.assertIsNone(archive_game(self.game))
+
+    def test_archive_game_only_archives_closed_games(self):
+        self.game.closing_date = None
+        self.game.save()
+
+        self.assertIsNone(archive_game(self.game))
+
+        self.assertFalse(GameArchive.objects.filter(game = self.game).exists())
+        self.assertEqual(2, Trade.objects.filter(game = self.game).count())
+
+    def test_load_archive_rebuilds_the_rows_with_their_related_objects(self):
+        archive_game(self.game)
+
+        ruleset_catalog(self.game.ruleset_id) # loaded once per process
+
+        with self.assertNumQueries(2):
+            archive = load_archive(self.game)
+            trade = archive.trade(self.trade.id)
+            stats_scores = archive.stats_scores()
+
+        self.assertEqual(self.loginUser, trade.initiator)
+        self.assertEqual(self.alternativeUser, trade.responder)
+        self.assertEqual(self.trade.closing_date, trade.closing_date)
+        self.assertEqual("a deal", trade.initiator_offer.comment)
+        self.assertEqual(["Yellow"], [tc.commodityinhand.commodity.name for tc in trade.initiator_offer.tradedcommodities])
+        self.assertEqual([2], [tc.nb_traded_cards for tc in trade.initiator_offer.tradedcommodities])
+        self.assertEqual(["HAG05"], [rih.rulecard.ref_name for rih in trade.initiator_offer.rulecards])
+        self.assertEqual("a secret", trade.responder_offer.free_information)
+        self.assertEqual([(self.loginUser, 12, self.trade.id)], [(stats.player, stats.score, stats.trade_id) for stats in stats_scores])
+        self.assertIsNone(load_archive(mommy.make(Game, end_date = now())))
+
+    def test_the_history_of_an_archived_game_is_displayed_as_before_its_archival(self):
+        events_before, trade_list_before, trade_before = self._get_history()
+
+        archive_game(self.game)
+        mommy.make(Message, game = self.game, sender = self.loginUser, content = "Still there?")
+
+        events_after, trade_list_after, trade_after = self._get_history()
+        self.assertEqual((events_before + [('message', self.loginUser)])[-views.EVENTS_PAGINATION:], events_after)
+        self.assertEqual(trade_list_before, trade_list_after)
+        self.assertEqual(trade_before, trade_after)
+
+        response = self.client.get("/game/{0}/trade/{1}/".format(self.game.id, self.trade.id))
+        self.assertEqual(self.trade.id, response.context['trade_id'])
+
+        self.login_as(self.master)
+        response = self.client.get("/utils/stats/{0}/".format(self.game.id))
+        self.assertEqual(200, response.status_code)
+
+    def _get_history(self):
+        response = self.client.get("/game/{0}/events/".format(self.game.id), HTTP_X_REQUESTED_WITH = 'XMLHttpRequest')
+        events = [(event.event_type, event.sender) for event in reversed(response.context['events'])]
+        trade_list = self.client.get("/trade/{0}/list/".format(self.game.id), HTTP_X_REQUESTED_WITH = 'XMLHttpRequest').content
+        trade = self.client.get("/trade/{0}/{1}/".format(self.game.id, self.trade.id), HTTP_X_REQUESTED_WITH = 'XMLHttpRequest').content
+        return events, trade_list, trade
+
 class HelpersTest(MystradeTestCase):
 
     def test_rules_currently_in_hand(self):
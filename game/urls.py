@@ -10,6 +10,8 @@ urlpatterns = patterns('game.views',
     url(r'^(\d+)/submithand/$',          'submit_hand',         name = 'submit_hand'),
     url(r'^(\d+)/close/$',               'close_game',          name = 'close_game'),
     url(r'^create/$',                    'create_game',         name = 'create_game'),
+    url(r'^create/players/$',            'search_players',      name = 'search_players'),
     url(r'^selectrules/$',               'select_rules',        name = 'select_rules'),
+    url(r'^create/(\d+)/$',              'game_creation',       name = 'game_creation'),
 )
 
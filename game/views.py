@@ -1,26 +1,41 @@
+import hashlib
 import logging
 import datetime
+import json
 
 import bleach
 from django.contrib.auth import get_user_model
 from django.http import HttpResponse, Http404
 import markdown
 from django.conf import settings
+from django.core.cache import get_cache
 from django.contrib.auth.decorators import permission_required, login_required
 from django.core.exceptions import ValidationError, PermissionDenied
 from django.core.urlresolvers import reverse
 from django.db import transaction
 from django.db.models import Q, F
 from django.shortcuts import render, get_object_or_404, redirect
+from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.utils.http import parse_etags, quote_etag
+from django.utils.safestring import mark_safe
 from django.utils.timezone import now, utc, make_naive
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
-from game.deal import deal_cards
+from game.archive import load_archive
+from game.creation import start_game_creation
 from game.forms import CreateGameForm, validate_number_of_players, validate_dates, MessageForm
-from game.helpers import rules_in_hand, rules_formerly_in_hand, commodities_in_hand, known_rules, free_informations_until_now, _check_game_access_or_PermissionDenied
-from game.models import Game, CommodityInHand, GamePlayer, Message
+from game.helpers import rules_in_hand, rules_formerly_in_hand, commodities_in_hand, known_rules, free_informations_until_now, _check_game_access_or_PermissionDenied, \
+                         game_etag, game_freshness
+from game.ledger import record_submission
+from game.models import Game, CommodityInHand, GameCreationJob, GamePlayer, Message
+from mystrade.routers import read_from_replica
+from ruleset.catalog import resolve
 from ruleset.models import RuleCard, Ruleset
-from scoring.card_scoring import tally_scores, Scoresheet
-from scoring.models import ScoreFromCommodity, ScoreFromRule
+from scoring.card_scoring import tally_scores
+from scoring.rating import rate_game
+from scoring.scoreboard import freeze_scoreboard, load_scoreboard
 from trade.forms import ERROR_EMPTY_OFFER
 from trade.models import Trade
 from profile.helpers import UserNameCache
@@ -69,8 +84,14 @@ def rules(request, lang = 'en'):
 SECONDS_BEFORE_OFFLINE = 10 * 60
 COOKIE_LAST_VISITED_GAME_KEY = "mystrade-lastVisitedGame-id"
 COOKIE_LAST_VISITED_GAME_DURATION = 7 * 24 * 60 * 60 # in seconds
+BOARD_FRAGMENTS_CACHE_TIMEOUT = 24 * 60 * 60 # in seconds; a later version of the game makes them obsolete anyway
+BOARD_FRAGMENTS_HITS = 'game_board:hits'
+BOARD_FRAGMENTS_MISSES = 'game_board:misses'
 
+@read_from_replica
 @login_required
+@cache_control(private = True, max_age = 0, must_revalidate = True)
+@condition(etag_func = lambda request, game_id, trade_id = None: _game_board_etag(request, game_id))
 def game_board(request, game_id, trade_id = None):
     game = get_object_or_404(Game, id = game_id)
 
@@ -81,70 +102,33 @@ def game_board(request, game_id, trade_id = None):
     verified_trade_id = None
     if trade_id:
         try:
-            if super_access:
+            archive = load_archive(game)
+            if archive:
+                trade = archive.trade(trade_id)
+                if super_access or request.user.id in (trade.initiator_id, trade.responder_id):
+                    verified_trade_id = trade.id
+            elif super_access:
                 verified_trade_id = Trade.objects.get(id = trade_id, game = game).id
             else:
                 verified_trade_id = Trade.objects.get((Q(initiator = request.user) | Q(responder = request.user)), id = trade_id, game = game).id
         except Trade.DoesNotExist:
             pass
 
-    context = {'game': game, 'players': players, 'online_players': _online_players(game, players),
+    context = {'game': game, 'players': players, 'online_players': _online_players(game),
                'message_form': MessageForm(), 'maxMessageLength': Message.MAX_LENGTH,
                'trade_id': verified_trade_id, 'events_refresh_delay': EVENTS_REFRESH_DELAY}
 
     if request.user in players and not game.is_closed():
         hand_submitted = request.user.gameplayer_set.get(game = game).submit_date is not None
-        if hand_submitted:
-            commodities = CommodityInHand.objects.filter(game = game, player = request.user, nb_submitted_cards__gt = 0).order_by('commodity__name')
-            commodities_not_submitted = CommodityInHand.objects.filter(game = game, player = request.user,
-                                                                       nb_cards__gt = F('nb_submitted_cards')).order_by('commodity__name')
-            for cih in commodities:
-                cih.nb_cards = cih.nb_submitted_cards # in 'commodities', feature only the submitted cards
-            for cih in commodities_not_submitted:
-                cih.nb_cards -= cih.nb_submitted_cards
-        else:
-            commodities = commodities_in_hand(game, request.user)
-            commodities_not_submitted = CommodityInHand.objects.none()
-
-        rulecards = rules_in_hand(game, request.user)
-        former_rulecards = rules_formerly_in_hand(game, request.user)
-
-        free_informations = free_informations_until_now(game, request.user)
+        hand = _cached_board_fragment('hand', game, request.user, lambda: _render_hand(request, game, hand_submitted))
 
         display_foreword = hasattr(request, 'first_visit')
 
-        context.update({'commodities': commodities, 'rulecards': rulecards, 'former_rulecards': former_rulecards,
-                        'hand_submitted': hand_submitted, 'commodities_not_submitted': commodities_not_submitted,
-                        'free_informations': free_informations, 'show_control_board': False,
-                        'display_foreword': display_foreword})
+        context.update({'hand': hand, 'hand_submitted': hand_submitted, 'show_control_board': False, 'display_foreword': display_foreword})
     else:
-        # Scores for the game master and the admins that are NOT players in this game, and for the players after the game is closed
-        scoresheets = None
-        random_scoring = False # True if at least one line of score for one player can earn a different amount of points each time we calculate the score
-        rank = -1
-
-        if game.has_started():
-            if game.is_closed():
-                scoresheets = _fetch_scoresheets(game)
-            else:
-                scoresheets = tally_scores(game) # but don't persist them
-                scoresheets.sort(key = lambda scoresheet: scoresheet.total_score, reverse = True)
-
-            # enrich scoresheets
-            for index, scoresheet in enumerate(scoresheets, start = 1):
-                player = scoresheet.gameplayer.player
-                if game.is_closed() and request.user == player:
-                    rank = index
-                else:
-                    if len([sfr for sfr in scoresheet.scores_from_rule if getattr(sfr, 'is_random', False)]) > 0:
-                        scoresheet.is_random = True
-                        random_scoring = True
-
-                if request.user not in players or game.is_closed():
-                    scoresheet.known_rules = known_rules(game, player)
+        scores = _cached_board_fragment('scores', game, request.user, lambda: _render_scores(request, game, players))
 
-        context.update({'show_control_board': True, 'super_access': super_access,
-                        'scoresheets': scoresheets, 'random_scoring': random_scoring, 'rank': rank})
+        context.update({'show_control_board': True, 'super_access': super_access, 'scores': scores})
 
     response = render(request, 'game/board.html', context)
 
@@ -152,24 +136,94 @@ def game_board(request, game_id, trade_id = None):
 
     return response
 
-def _fetch_scoresheets(game):
-    scoresheets = []
-    for gameplayer in GamePlayer.objects.filter(game=game):
-        scoresheets.append(Scoresheet(gameplayer,
-                                      ScoreFromCommodity.objects.filter(game=game, player=gameplayer.player).order_by('commodity'),
-                                      ScoreFromRule.objects.filter(game=game, player=gameplayer.player).order_by('rulecard__step', 'rulecard__public_name')))
-    scoresheets.sort(key = lambda scoresheet: scoresheet.total_score, reverse = True)
-    return scoresheets
-
-def _online_players(game, players):
-    list_of_online_players_id = []
-    date_now = now()
-    for player in players:
-        last_seen = player.gameplayer_set.get(game = game).last_seen
-        if last_seen and date_now - last_seen <= datetime.timedelta(seconds = SECONDS_BEFORE_OFFLINE):
-            list_of_online_players_id.append(str(player.id) )
-
-    return "[" + ", ".join(list_of_online_players_id) + "]"
+def _render_hand(request, game, hand_submitted):
+    if hand_submitted:
+        commodities = CommodityInHand.objects.filter(game = game, player = request.user, nb_submitted_cards__gt = 0).order_by('commodity__name')
+        commodities_not_submitted = CommodityInHand.objects.filter(game = game, player = request.user,
+                                                                   nb_cards__gt = F('nb_submitted_cards')).order_by('commodity__name')
+        for cih in commodities:
+            cih.nb_cards = cih.nb_submitted_cards # in 'commodities', feature only the submitted cards
+        for cih in commodities_not_submitted:
+            cih.nb_cards -= cih.nb_submitted_cards
+    else:
+        commodities = commodities_in_hand(game, request.user)
+        commodities_not_submitted = CommodityInHand.objects.none()
+
+    # the cards themselves are read from the catalog of the ruleset, instead of a query per card
+    return render_to_string('game/hand.html',
+                            {'game': game, 'hand_submitted': hand_submitted,
+                             'commodities': resolve(commodities, 'commodity'), 'commodities_not_submitted': resolve(commodities_not_submitted, 'commodity'),
+                             'rulecards': resolve(rules_in_hand(game, request.user), 'rulecard'),
+                             'former_rulecards': resolve(rules_formerly_in_hand(game, request.user), 'rulecard'),
+                             'free_informations': free_informations_until_now(game, request.user)},
+                            context_instance = RequestContext(request))
+
+def _render_scores(request, game, players):
+    """ Scores for the game master and the admins that are NOT players in this game, and for the players after the game is closed """
+    scoresheets = None
+    random_scoring = False # True if at least one line of score for one player can earn a different amount of points each time we calculate the score
+    rank = -1
+
+    if game.has_started():
+        if game.is_closed():
+            scoresheets = load_scoreboard(game) # the known rules included
+        else:
+            scoresheets = tally_scores(game) # but don't persist them
+            scoresheets.sort(key = lambda scoresheet: scoresheet.total_score, reverse = True)
+
+        # enrich scoresheets
+        for index, scoresheet in enumerate(scoresheets, start = 1):
+            player = scoresheet.gameplayer.player
+            if game.is_closed() and request.user == player:
+                rank = index
+            else:
+                if len([sfr for sfr in scoresheet.scores_from_rule if getattr(sfr, 'is_random', False)]) > 0:
+                    scoresheet.is_random = True
+                    random_scoring = True
+
+            if request.user not in players and not game.is_closed():
+                scoresheet.known_rules = known_rules(game, player)
+
+    return render_to_string('game/scores.html', {'game': game, 'scoresheets': scoresheets, 'random_scoring': random_scoring, 'rank': rank},
+                            context_instance = RequestContext(request))
+
+def _cached_board_fragment(name, game, user, render_fragment):
+    """ The sections of the game board that are the most expensive to build, the hand of a player and the scores, are cached by
+         game, user and version of the game (see game.helpers.game_freshness()), so that they are only rebuilt after a change.
+        The hits and misses are counted, see board_fragments_hit_rate(). """
+    board_cache = get_cache('default') # resolved at each call, so that the setting can be overridden in the tests
+    key = "game_board:{0}:{1}:{2}".format(name, game.id, hashlib.md5(game_freshness(user, game.version, game.start_date, game.end_date,
+                                                                                    game.closing_date).encode('utf-8')).hexdigest())
+    fragment = board_cache.get(key)
+    if fragment is None:
+        _count_in_cache(board_cache, BOARD_FRAGMENTS_MISSES)
+        fragment = render_fragment()
+        board_cache.set(key, fragment, BOARD_FRAGMENTS_CACHE_TIMEOUT)
+    else:
+        _count_in_cache(board_cache, BOARD_FRAGMENTS_HITS)
+    return mark_safe(fragment)
+
+def _count_in_cache(board_cache, key):
+    if not board_cache.add(key, 1, None):
+        try:
+            board_cache.incr(key)
+        except ValueError: # evicted between add() and incr()
+            board_cache.add(key, 1, None)
+
+def board_fragments_hit_rate():
+    """ The number of hits and misses of the cache of the game board fragments since the cache was started (i.e. per process with
+         the local-memory cache), and the ratio of hits """
+    board_cache = get_cache('default')
+    hits, misses = board_cache.get(BOARD_FRAGMENTS_HITS, 0), board_cache.get(BOARD_FRAGMENTS_MISSES, 0)
+    return {'hits': hits, 'misses': misses, 'rate': float(hits) / (hits + misses) if hits + misses else None}
+
+def _game_board_etag(request, game_id):
+    # the foreword displayed at the first visit (see OnlineStatusMiddleware) must not be cached
+    return None if hasattr(request, 'first_visit') else game_etag(request, game_id)
+
+def _online_players(game):
+    online_players = GamePlayer.objects.filter(game = game, last_seen__gte = now() - datetime.timedelta(seconds = SECONDS_BEFORE_OFFLINE))
+    return "[" + ", ".join(str(player_id) for player_id in online_players.order_by('player').values_list('player_id', flat = True)) + "]"
 
 def _set_lastVisitedGame_cookie_if_needed(request, response, game):
     if game.has_started() and not game.is_closed():
@@ -198,15 +252,41 @@ class Event(object):
         return self.date <= now()
 
 # noinspection PyTypeChecker
+@read_from_replica
 @login_required
 def events(request, game_id):
+    # is it the first fetch of the events since the game board has loaded? -- otherwise it's a later periodic refresh
+    first_load = 'lastEventsRefreshDate' not in request.GET
+    page_requested = bool(request.GET.get('last_event') or request.GET.get('first_event'))
+
+    # a periodic refresh sends back the ETag of the last events it has received: if nothing has changed since, don't go further
+    etag = game_etag(request, game_id)
+    if request.is_ajax() and not first_load and not page_requested and etag and etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponse(status = 204) # 204 = No Content
+        response['ETag'] = quote_etag(etag)
+        response['full_refresh'] = "False"
+        response['online_players'] = _online_players(game_id)
+        return response
+
     game = get_object_or_404(Game, id = game_id)
 
     _check_game_access_or_PermissionDenied(game, request.user)
 
     if request.is_ajax():
         # Make a list of all events to display
-        events = list(Message.objects.filter(game = game))
+        events = list(Message.objects.filter(game = game).select_related('sender')) # in an archived game, the messages posted after the archival
+
+        archive = load_archive(game)
+        if archive:
+            events.extend(archive.messages())
+            own_trades = [trade for trade in archive.trades() if request.user.id in (trade.initiator_id, trade.responder_id)]
+            others_accepted_trades = [trade for trade in archive.trades()
+                                      if trade.status == 'ACCEPTED' and request.user.id not in (trade.initiator_id, trade.responder_id)]
+        else:
+            own_trades = Trade.objects.filter(Q(initiator = request.user) | Q(responder = request.user), game = game)\
+                                      .select_related('initiator', 'responder', 'finalizer', 'responder_offer')
+            others_accepted_trades = Trade.objects.filter(game = game, status = 'ACCEPTED').exclude(initiator = request.user).exclude(responder = request.user)\
+                                                  .select_related('initiator')
 
         events.append(Event('game_start', game.start_date, game.master))
         if game.has_ended():
@@ -214,17 +294,17 @@ def events(request, game_id):
             if game.is_closed():
                 events.append(Event('game_close', game.closing_date, game.master))
 
-        for trade in Trade.objects.filter(Q(initiator = request.user) | Q(responder = request.user), game = game):
+        for trade in own_trades:
             events.append(Event('create_trade', trade.creation_date, trade.initiator, trade))
             if trade.responder_offer:
                 events.append(Event('reply_trade', trade.responder_offer.creation_date, trade.responder, trade))
             if trade.finalizer:
                 events.append(Event('finalize_trade', trade.closing_date, trade.finalizer, trade))
 
-        for trade in Trade.objects.filter(game = game, status = 'ACCEPTED').exclude(initiator = request.user).exclude(responder = request.user):
+        for trade in others_accepted_trades:
             events.append(Event('accept_trade', trade.closing_date, trade.initiator, trade))
 
-        for gameplayer in game.gameplayer_set.filter(submit_date__isnull = False):
+        for gameplayer in game.gameplayer_set.filter(submit_date__isnull = False).select_related('player'):
             events.append(Event('submit_hand', gameplayer.submit_date, gameplayer.player))
 
         # The events are sorted by chronological order, and all manipulation will be done in this order.
@@ -236,7 +316,6 @@ def events(request, game_id):
 
         # Display only a page of events
         if request.GET.get('last_event'):
-            page_requested = True
             last_event_to_display = int(request.GET.get('last_event'))
             events_in_the_range = events[last_event_to_display:]
             if len(events_in_the_range) >= EVENTS_PAGINATION:
@@ -244,12 +323,10 @@ def events(request, game_id):
             else: # if there are less than EVENTS_PAGINATION events to display, a full page is displayed anyway
                 displayed_events = events[-EVENTS_PAGINATION:]
         elif request.GET.get('first_event'):
-            page_requested = True
             first_event_to_display = int(request.GET.get('first_event'))
             events_in_the_range = events[:first_event_to_display + 1]
             displayed_events = events_in_the_range[-EVENTS_PAGINATION:] # take the *last* EVENTS_PAGINATION events
         else:
-            page_requested = False
             events_in_the_range = events
             displayed_events = events_in_the_range[-EVENTS_PAGINATION:] # take the *last* EVENTS_PAGINATION events
 
@@ -264,9 +341,6 @@ def events(request, game_id):
         else:
             first_event = None
 
-        # is it the first fetch of the events since the game board has loaded? -- otherwise it's a later periodic refresh
-        first_load = 'lastEventsRefreshDate' not in request.GET
-
         new_events = []
         if not first_load:
             lastEventsRefreshDate = datetime.datetime.strptime(request.GET.get('lastEventsRefreshDate'), FORMAT_EVENT_PERMALINK)
@@ -279,14 +353,20 @@ def events(request, game_id):
         displayed_events.reverse()
 
         if first_load or page_requested or new_events:
+            # the date of the newest event read rather than now(): the replica may lag, and the events it hasn't received yet
+            #  must still be newer than this date at the next refresh
+            past_dates = [event.date for event in events if event.has_happened()]
+            refresh_date = max(past_dates) if past_dates else game.creation_date
             response = render(request, 'game/events.html',
                           {'game': game, 'events': displayed_events, 'first_event': first_event, 'last_event': last_event,
-                           'lastEventsRefreshDate': datetime.datetime.strftime(now(), FORMAT_EVENT_PERMALINK)})
+                           'lastEventsRefreshDate': datetime.datetime.strftime(make_naive(refresh_date, utc), FORMAT_EVENT_PERMALINK)})
         else:
             response = HttpResponse(status = 204) # 204 = No Content
 
+        if etag:
+            response['ETag'] = quote_etag(etag)
         response['full_refresh'] = _full_refresh_needed(game, first_load, new_events, request.user)
-        response['online_players'] = _online_players(game, game.players.all())
+        response['online_players'] = _online_players(game)
         return response
 
     raise PermissionDenied
@@ -329,7 +409,9 @@ def post_message(request, game_id):
             if len(message_form.cleaned_data['message']) > 0:
                 # bleach allowed tags : 'a','abbr','acronym','b','blockquote','code','em','i','li','ol','strong', 'ul'
                 secure_message = bleach.clean(markdown.markdown(message_form.cleaned_data['message']), strip = True)
-                Message.objects.create(game = game, sender = request.user, content = secure_message)
+                with transaction.atomic():
+                    Message.objects.create(game = game, sender = request.user, content = secure_message)
+                    Game.bump_version(game.id)
             return HttpResponse()
         else:
             return HttpResponse(message_form.errors['message'], status = 422)
@@ -344,7 +426,9 @@ def delete_message(request, game_id):
         message = get_object_or_404(Message, game = game, id = request.POST['event_id'])
 
         if message.sender == request.user and message.deletable:
-            message.delete()
+            with transaction.atomic():
+                message.delete()
+                Game.bump_version(game.id)
             return HttpResponse()
 
     raise PermissionDenied
@@ -372,13 +456,12 @@ def submit_hand(request, game_id):
                 gameplayer.submit_date = now()
                 gameplayer.save()
 
-                for commodity, nb_selected_cards in selected_commodities.iteritems():
-                    commodity.nb_submitted_cards = nb_selected_cards
-                    commodity.save()
+                record_submission(gameplayer, selected_commodities)
 
                 # abort pending trades
-                for trade in Trade.objects.filter(Q(initiator = request.user) | Q(responder = request.user), game = game, finalizer__isnull = True):
-                    trade.abort(request.user, gameplayer.submit_date)
+                Trade.objects.filter(Q(initiator = request.user) | Q(responder = request.user), game = game).abort(request.user, gameplayer.submit_date)
+
+                Game.bump_version(game.id)
 
                 return HttpResponse()
         except FormInvalidException as ex:
@@ -425,6 +508,32 @@ def create_game(request):
         form = CreateGameForm(request.user)
     return render(request, 'game/create.html', {'form': form, 'rulesets': Ruleset.objects.all()})
 
+PLAYER_SEARCH_PAGE_SIZE = 20
+
+@permission_required('game.add_game')
+def search_players(request):
+    """ The players whose name or username starts with the query, but the game master, one page at a time, for the player picker of
+         the creation of a game: {"players": [{"id": 12, "name": "Luke Skywalker"}, ...], "more": true}. The prefixes are
+         searched in the indexed columns name_sort and username. """
+    if not request.is_ajax():
+        raise PermissionDenied
+
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    players = get_user_model().objects.exclude(id = request.user.id)
+    if query:
+        players = players.filter(Q(name_sort__startswith = query.lower()) | Q(username__startswith = query))
+    start = (page - 1) * PLAYER_SEARCH_PAGE_SIZE
+    players = list(players.order_by_full_name().only('id', 'username', 'first_name', 'last_name')[start:start + PLAYER_SEARCH_PAGE_SIZE + 1])
+
+    return HttpResponse(json.dumps({'players': [{'id': player.id, 'name': player.name} for player in players[:PLAYER_SEARCH_PAGE_SIZE]],
+                                    'more': len(players) > PLAYER_SEARCH_PAGE_SIZE}),
+                        content_type = 'application/json')
+
 @permission_required('game.add_game')
 def select_rules(request):
     if 'ruleset' not in request.session or 'start_date' not in request.session\
@@ -468,59 +577,40 @@ def select_rules(request):
                                                               'start_date': start_date, 'end_date': end_date, 'players': players,
                                                               'nb_max_rulecards': nb_max_rulecards, 'error': error})
 
-        game = Game.objects.create(ruleset    = ruleset,
-                                   master     =  request.user,
-                                   start_date = start_date,
-                                   end_date   = end_date)
-        for player in players:
-            GamePlayer.objects.create(game = game, player = player)
-        for rule in selected_rules:
-            game.rules.add(rule)
-
-        # deal starting cards
-        if not deal_cards(game):
-            game.delete()
-            error = "We failed to deal cards without the difference of starting scores being too large. Please try again."
+        job = GameCreationJob.objects.create(master = request.user, ruleset = ruleset, start_date = start_date, end_date = end_date,
+                                             players = ",".join(str(player.id) for player in players),
+                                             rules = ",".join(str(rule.id) for rule in selected_rules),
+                                             base_url = request.build_absolute_uri('/').rstrip('/'))
+        job = start_game_creation(job)
+        if job.status == 'FAILED' and not job.is_dealt():
             return render(request, 'game/select_rules.html', {'rulecards': rulecards, 'session': request.session, 'ruleset': ruleset,
                                                               'start_date': start_date, 'end_date': end_date, 'players': players,
-                                                              'nb_max_rulecards': nb_max_rulecards, 'error': error})
-
-        del request.session['ruleset']
-        del request.session['start_date']
-        del request.session['end_date']
-        del request.session['players']
-
-        # record score stats at the game creation
-        stats.record(game)
-
-        # email notification
-        all_players = {}
-        for player in game.players.all():
-             all_players[player] = {'name': player.name,
-                                    'url': request.build_absolute_uri(reverse('otherprofile', args=[player.id]))}
-
-        for player in all_players.iterkeys():
-             opponents = dict(all_players) # make a copy
-             del opponents[player]
-             list_opponents = sorted(opponents.itervalues(), key = lambda opponent: opponent['name'])
-             rules = rules_in_hand(game, player)
-             commodities = commodities_in_hand(game, player)
-             utils.send_notification_email('game_create', player,
-                                           {'game': game, 'opponents': list_opponents, 'rules': rules, 'commodities': commodities,
-                                            'player_timezone': player.timezone,
-                                            'url': request.build_absolute_uri(reverse('game', args=[game.id]))})
-
-        # email notification for the admins
-        utils.send_notification_email('game_create_admin', [admin[1] for admin in settings.ADMINS],
-                                       {'game': game, 'players': sorted(all_players.itervalues(), key = lambda player: player['name']),
-                                        'rules': selected_rules})
-
-        return redirect('game', game.id)
+                                                              'nb_max_rulecards': nb_max_rulecards, 'error': job.error})
+        if job.is_dealt(): # run within the request
+            return game_creation(request, job.id)
+        return redirect('game_creation', job.id)
     else:
         return render(request, 'game/select_rules.html', {'rulecards': rulecards, 'ruleset': ruleset,
                                                           'start_date': start_date, 'end_date': end_date, 'players': players,
                                                           'nb_max_rulecards': nb_max_rulecards})
 
+@permission_required('game.add_game')
+def game_creation(request, job_id):
+    """ The progress of the creation of a game (see game.creation): the game master is redirected to the game as soon as its cards
+         have been dealt, until then the page polls this view in AJAX """
+    job = get_object_or_404(GameCreationJob, id = job_id, master = request.user)
+
+    if request.is_ajax():
+        return HttpResponse(json.dumps({'status': job.status, 'progress': job.get_status_display(), 'error': job.error,
+                                        'url': reverse('game_creation', args = [job.id]) if job.is_dealt() else None}),
+                            content_type = 'application/json')
+
+    if job.is_dealt():
+        for key in ['ruleset', 'start_date', 'end_date', 'players']:
+            request.session.pop(key, None)
+        return redirect('game', job.game_id)
+    return render(request, 'game/game_creation.html', {'job': job})
+
 #############################################################################
 ##                            Close Game                                   ##
 #############################################################################
@@ -533,19 +623,17 @@ def close_game(request, game_id):
             try:
                 with transaction.atomic():
                     game.closing_date = now()
-                    game.save()
+                    game.save(update_fields = ['closing_date']) # not the version, which may have been bumped since the game was loaded
+                    Game.bump_version(game.id)
 
                     # abort pending trades
-                    for trade in Trade.objects.filter(game = game, finalizer__isnull = True):
-                        trade.abort(request.user, game.closing_date)
+                    Trade.objects.filter(game = game).abort(request.user, game.closing_date)
 
                     # automatically submit all commodity cards of players who haven't manually submitted their hand
                     for gameplayer in GamePlayer.objects.filter(game = game, submit_date__isnull = True):
-                        for cih in commodities_in_hand(game, gameplayer.player):
-                            cih.nb_submitted_cards = cih.nb_cards
-                            cih.save()
                         gameplayer.submit_date = game.closing_date
                         gameplayer.save()
+                        record_submission(gameplayer, dict((cih, cih.nb_cards) for cih in commodities_in_hand(game, gameplayer.player)))
 
                     # calculate and save scores
                     scoresheets = tally_scores(game)
@@ -555,8 +643,14 @@ def close_game(request, game_id):
                     # record score stats when game is closed
                     stats.record(game, scoresheets = scoresheets)
 
-                    # email notification
+                    # freeze the final scores, by rank, for the later displays of the game
                     scoresheets.sort(key = lambda scoresheet: scoresheet.total_score, reverse = True)
+                    freeze_scoreboard(game, scoresheets)
+
+                    # update the ratings of the players across the games
+                    rate_game(game, scoresheets)
+
+                    # email notification
                     for rank, scoresheet in enumerate(scoresheets, 1):
                         utils.send_notification_email('game_close', scoresheet.gameplayer.player,
                                                       {'game': game, 'rank': rank, 'nb_players': len(scoresheets), 'scoresheet': scoresheet,
@@ -1,7 +1,12 @@
+import random
 import re
+import time
+from django.conf import settings
 from django.utils import timezone
 from django.utils.timezone import now
 from game.models import GamePlayer
+from mystrade.routers import replica_alias, start_replica_reads, stop_replica_reads
+from utils.profiling import RequestProfile, write_profile
 
 
 class TimezoneMiddleware(object):
@@ -32,3 +37,50 @@ class OnlineStatusMiddleware(object):
                     gp.save()
                 except GamePlayer.DoesNotExist:
                     pass
+
+
+class SamplingProfilerMiddleware(object):
+    """ Profiles a random fraction settings.REQUEST_PROFILING_RATE of the requests (see utils.profiling).
+        It should come first in MIDDLEWARE_CLASSES, so that the other middlewares are profiled too.
+        An unsampled request costs one call to random(). """
+    def process_request(self, request):
+        if settings.REQUEST_PROFILING_RATE and random.random() < settings.REQUEST_PROFILING_RATE:
+            request.profile = RequestProfile(request)
+            request.profile.start()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, 'profile'):
+            request.profile.view_name = "{0}.{1}".format(view_func.__module__, view_func.__name__)
+
+    def process_response(self, request, response):
+        if hasattr(request, 'profile'):
+            write_profile(request.profile.stop(response))
+            del request.profile
+        return response
+
+
+class ReplicaPinningMiddleware(object):
+    """ Sends the GET requests of the views decorated with @read_from_replica to the replica of the database, if any (see
+         mystrade.routers), except for a browser that has posted something in the last settings.REPLICA_PINNING_DURATION seconds:
+         the replica may not have received its writes yet. The end of this window is kept in a cookie. """
+    COOKIE_KEY = 'pinnedToPrimaryUntil'
+
+    def process_request(self, request):
+        stop_replica_reads() # the thread may have served a request that failed before process_response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'read_from_replica', False) and request.method in ('GET', 'HEAD') and not self._is_pinned(request):
+            start_replica_reads()
+
+    def process_response(self, request, response):
+        stop_replica_reads()
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') and replica_alias():
+            response.set_cookie(self.COOKIE_KEY, int(time.time()) + settings.REPLICA_PINNING_DURATION,
+                                max_age = settings.REPLICA_PINNING_DURATION)
+        return response
+
+    def _is_pinned(self, request):
+        try:
+            return int(request.COOKIES.get(self.COOKIE_KEY, 0)) > time.time()
+        except ValueError:
+            return False
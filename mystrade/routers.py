@@ -0,0 +1,53 @@
+"""
+    Routing of the reads of some views to a read-only replica of the database.
+
+    Almost all the traffic is made of reads: the game boards, the periodic polls of the events, the lists of trades and the charts
+     of the scores. The views decorated with @read_from_replica read from the database settings.REPLICA_DATABASE, when it is
+     declared in settings.DATABASES; everything else, and all the writes, go to the 'default' database. Without a replica, nothing
+     changes.
+
+    A replica lags behind the primary database. So that a player reads their own writes, mystrade.middlewares.ReplicaPinningMiddleware
+     sends all the requests of a browser to the primary for settings.REPLICA_PINNING_DURATION seconds after it has posted something,
+     and ReplicaRouter stops reading from the replica for the rest of a request as soon as it has written anything.
+"""
+import threading
+from django.conf import settings
+
+PRIMARY_DATABASE = 'default'
+
+_state = threading.local()
+
+def read_from_replica(view_func):
+    """ Mark a read-only view: its GET requests may read from the replica """
+    view_func.read_from_replica = True
+    return view_func
+
+def replica_alias():
+    """ The alias of the replica, or None if no replica is declared """
+    alias = getattr(settings, 'REPLICA_DATABASE', None)
+    return alias if alias in settings.DATABASES else None
+
+def start_replica_reads():
+    _state.replica = replica_alias()
+
+def stop_replica_reads():
+    _state.replica = None
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'replica', None)
+
+    def db_for_write(self, model, **hints):
+        stop_replica_reads() # the next reads may depend on this write, which the replica may not have received yet
+        return PRIMARY_DATABASE # even for an instance read from the replica
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        if set([obj1._state.db, obj2._state.db]) <= set([PRIMARY_DATABASE, replica_alias()]):
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        if db == replica_alias():
+            return False # its tables are replicated from the primary
+        return None
@@ -39,6 +39,36 @@ EMAIL_MYSTRADE = secrets['EMAIL_MYSTRADE']
 
 ACCOUNT_ACTIVATION_DAYS = 2
 
+# Record the wall time, SQL queries and lines registered of each rule card in tally_scores() (see scoring.models.RuleScoringProfile):
+#  one write per rule at each tally, so only to be turned on while investigating the cost of the rules
+SCORING_RULES_PROFILING = False
+
+# Minimum number of seconds between two snapshots of the scores taken after a trade (see utils.stats.record), 0 for one after each trade
+STATS_MIN_INTERVAL = 0
+
+# How the snapshots of the scores are stored (see utils.stats): 'rows' for a StatsScore per player, 'snapshots' for a single StatsSnapshot
+#  with the scores of all the players packed (the command compact_stats converts the rows already recorded)
+STATS_STORAGE = 'rows'
+# Maximum number of dates in the evolution of the scores of a game (see utils.stats.timeline), evenly spread over the game
+STATS_MAX_POINTS = 500
+
+# Elo rating of the players over the closed games (see scoring.rating): rating of a new player, maximum change per game,
+#  and number of players on the leaderboard page
+RATING_INITIAL = 1500
+RATING_K_FACTOR = 32
+LEADERBOARD_SIZE = 50
+
+# Run the creation of the games in a thread of the web server, the game master polling its progress (see game.creation), rather than
+#  within the request. The jobs left pending, e.g. by a restart, are run by the command run_game_creations
+GAME_CREATION_IN_BACKGROUND = True
+# Seconds without any progress after which a running creation is considered dead with its thread, and released by run_game_creations:
+#  far beyond the duration of the slowest deal
+GAME_CREATION_TIMEOUT = 900
+
+# Fraction of the requests profiled by mystrade.middlewares.SamplingProfilerMiddleware (0 to disable), and where the samples go
+REQUEST_PROFILING_RATE = 0
+REQUEST_PROFILING_LOG = os.path.join(SITE_ROOT, "..", "profiling.log")
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2', # Add 'postgresql_psycopg2', 'mysql', 'sqlite3' or 'oracle'.
@@ -52,6 +82,25 @@ DATABASES = {
 
 CONN_MAX_AGE = 60 # seconds
 
+# An optional read-only replica of the database, for the views decorated with @read_from_replica (see mystrade.routers).
+# To try it locally, copy the SQLite database of the development (or create a second Postgres database) and declare it here:
+#   DATABASES['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(SITE_ROOT, '..', 'replica.db')}
+if secrets.get('REPLICA_DB_HOST'):
+    DATABASES['replica'] = dict(DATABASES['default'], HOST = secrets['REPLICA_DB_HOST'],
+                                TEST_MIRROR = 'default') # the tests read from the test database of 'default'
+
+DATABASE_ROUTERS = ['mystrade.routers.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+REPLICA_PINNING_DURATION = 10 # seconds during which a browser reads from the primary database after having posted something
+
+# Local memory: no external service needed, but one cache per process (see the fragments of game.views.game_board)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'mystrade',
+    }
+}
+
 # For django-debug-toolbar
 INTERNAL_IPS = ('127.0.0.1',)
 DEBUG_TOOLBAR_CONFIG = {
@@ -126,6 +175,7 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'mystrade.middlewares.SamplingProfilerMiddleware', # first, to profile the other middlewares too
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.BrokenLinkEmailsMiddleware',
@@ -134,6 +184,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'mystrade.middlewares.TimezoneMiddleware', # after AuthenticationMiddleware !
     'mystrade.middlewares.OnlineStatusMiddleware', # after AuthenticationMiddleware !
+    'mystrade.middlewares.ReplicaPinningMiddleware', # after OnlineStatusMiddleware, which writes in the primary database
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     # Uncomment the next line for simple clickjacking protection:
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -174,6 +225,7 @@ INSTALLED_APPS = (
     'django_extensions',
     'debug_toolbar',
     'south',
+    'benchmark',
 ) + MYSTRADE_APPS
 
 AUTH_USER_MODEL = 'profile.MystradeUser'
@@ -192,6 +244,9 @@ LOGGING = {
         'simple': {
             'format': '%(levelname)s %(asctime)s %(name)s %(message)s'
         },
+        'raw': {
+            'format': '%(message)s'
+        },
     },
     'filters': {
         'require_debug_false': {
@@ -208,6 +263,20 @@ LOGGING = {
             'level': 'ERROR',
             'class': 'logging.StreamHandler',
             'formatter': 'simple'
+        },
+        'console_info':{
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple'
+        },
+        'profiling':{
+            'level': 'INFO',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': REQUEST_PROFILING_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+            'formatter': 'raw'
         }
     },
     'loggers': {
@@ -224,8 +293,18 @@ LOGGING = {
             'handlers': ['console'],
             'level': 'ERROR',
         },
+        'scoring.card_scoring': { # the per-rule profiling lines of tally_scores()
+            'handlers': ['console_info'],
+            'level': 'INFO',
+        },
+        'mystrade.profiling': { # the samples of SamplingProfilerMiddleware, one JSON per line
+            'handlers': ['profiling'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     }
 }
 
 if len(sys.argv) > 1 and sys.argv[1] == 'test':
-    logging.disable(logging.CRITICAL)
\ No newline at end of file
+    logging.disable(logging.CRITICAL)
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}} # no state shared between the tests
\ No newline at end of file
@@ -37,10 +37,15 @@ DATABASES = {
         'HOST': 'postgresql1.alwaysdata.com',
     }
 }
+if secrets.get('REPLICA_DB_HOST'): # the read-only replica of the views decorated with @read_from_replica (see mystrade.routers)
+    DATABASES['replica'] = dict(DATABASES['default'], HOST = secrets['REPLICA_DB_HOST'])
 
 STATIC_ROOT = os.path.join(SITE_ROOT, "..", "public", "static")
 
+REQUEST_PROFILING_RATE = 0.01
+
 MIDDLEWARE_CLASSES = (
+    'mystrade.middlewares.SamplingProfilerMiddleware', # first, to profile the other middlewares too
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.BrokenLinkEmailsMiddleware',
@@ -49,6 +54,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'mystrade.middlewares.TimezoneMiddleware', # after AuthenticationMiddleware !
     'mystrade.middlewares.OnlineStatusMiddleware', # after AuthenticationMiddleware !
+    'mystrade.middlewares.ReplicaPinningMiddleware', # after OnlineStatusMiddleware, which writes in the primary database
     #'debug_toolbar.middleware.DebugToolbarMiddleware',
     # Uncomment the next line for simple clickjacking protection:
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -68,6 +74,7 @@ INSTALLED_APPS = (
      'django_extensions',
      #'debug_toolbar',
      'south',
+     'benchmark',
 ) + MYSTRADE_APPS
 
 LOGGING = {
@@ -77,6 +84,9 @@ LOGGING = {
         'simple': {
             'format': '%(levelname)s %(asctime)s %(name)s %(message)s'
         },
+        'raw': {
+            'format': '%(message)s'
+        },
     },
     'filters': {
         'require_debug_false': {
@@ -93,6 +103,20 @@ LOGGING = {
             'level': 'ERROR',
             'class': 'logging.StreamHandler',
             'formatter': 'simple'
+        },
+        'console_info':{
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple'
+        },
+        'profiling':{
+            'level': 'INFO',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': REQUEST_PROFILING_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+            'formatter': 'raw'
         }
     },
     'loggers': {
@@ -109,5 +133,14 @@ LOGGING = {
             'handlers': ['mail_admins'],
             'level': 'ERROR',
         },
+        'scoring.card_scoring': { # the per-rule profiling lines of tally_scores()
+            'handlers': ['console_info'],
+            'level': 'INFO',
+        },
+        'mystrade.profiling': { # the samples of SamplingProfilerMiddleware, one JSON per line
+            'handlers': ['profiling'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     }
 }
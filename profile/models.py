@@ -1,6 +1,7 @@
 import pytz
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
+from django.db.models.signals import pre_save
 from django.db.models.query import QuerySet
 
 class MystradeUserManager(BaseUserManager):
@@ -26,6 +27,9 @@ class MystradeUser(AbstractUser):
     DEFAULT_PALETTE = PALETTES[0]['key']
     palette = models.CharField(max_length = 50, choices = PALETTE_CHOICES, default = DEFAULT_PALETTE)
 
+    # the name below in lower case, maintained at each save for the indexed sort of the players (see order_by_full_name())
+    name_sort = models.CharField(max_length = 75, db_index = True, editable = False, default = '')
+
     @property
     def name(self):
         if self.first_name and self.last_name:
@@ -43,18 +47,16 @@ class MystradeUser(AbstractUser):
     objects = MystradeUserManager()
 
 class MystradeUserQuerySet(QuerySet):
-    """ There is no easy way a queryset can be sorted by a field not present in the database, such as the name @property above.
-    The only (and inelegant) way seems to inject SQL code thanks to the extra() modifier, and "order by" the calculated SQL column.
-    It violates the DRY principle as the algorithm is duplicated in the name @property above and in the SQL below, but again
-    there seems not to be another way in Django 1.5.
-    (see http://stackoverflow.com/questions/1652577/django-ordering-queryset-by-a-calculated-field)
-    """
     def order_by_full_name(self):
-        return self.extra(select = {'name_sort': "lower(CASE WHEN (first_name <> '' AND last_name <> '') THEN first_name || ' ' || last_name "
-                                                 "           WHEN last_name <> '' THEN last_name "
-                                                 "           WHEN first_name <> '' THEN first_name "
-                                                 "           ELSE username"
-                                                 "      END)"}).extra(order_by = ['name_sort'])
+        """ Sorted by their name @property, case insensitive, through the indexed column name_sort """
+        return self.order_by('name_sort')
+
+def update_name_sort(sender, instance, **kwargs):
+    """ Keep name_sort in sync with the name @property before each save, including the users loaded from the fixtures. A save()
+         limited by update_fields to the names must list name_sort too. """
+    instance.name_sort = u"{0}".format(instance.name).lower()[:MystradeUser._meta.get_field('name_sort').max_length]
+
+pre_save.connect(update_name_sort, MystradeUser, dispatch_uid = 'profile.models.update_name_sort')
 
 # def create_user_profile(sender, instance, created, **kwargs):
 #     # "and not kwargs.get('raw', False)" added to let the test fixtures insert userprofiles without trying to recreate the users
@@ -10,6 +10,7 @@ from model_mommy import mommy
 from game.models import Message, Game, GamePlayer
 from profile.models import MystradeUser
 from profile.views import _generate_activation_key
+from scoring.models import PlayerRating, RatingChange
 from utils.tests import MystradeTestCase
 
 
@@ -30,6 +31,22 @@ class MystradeUserNameTest(TestCase):
         user = MystradeUser.objects.create(username = "username", first_name = "", last_name="")
         self.assertEqual("username", user.name)
 
+    def test_name_sort_follows_the_name(self):
+        user = MystradeUser.objects.create(username = "username", first_name = "", last_name = "")
+        self.assertEqual("username", MystradeUser.objects.get(id = user.id).name_sort)
+
+        user.first_name, user.last_name = "Luke", "Skywalker"
+        user.save()
+        self.assertEqual("luke skywalker", MystradeUser.objects.get(id = user.id).name_sort)
+
+    def test_order_by_full_name(self):
+        for username, first_name, last_name in [("zorro", "", "abel"), ("anna", "Zoe", "Bell"), ("bob", "", ""), ("x", "Carl", "")]:
+            MystradeUser.objects.create(username = username, first_name = first_name, last_name = last_name)
+
+        users = MystradeUser.objects.filter(username__in = ["zorro", "anna", "bob", "x"]).order_by_full_name()
+        self.assertEqual(["zorro", "bob", "x", "anna"], [user.username for user in users])
+        self.assertIn("name_sort", str(users.query))
+
 class ViewsTest(TestCase):
     def setUp(self):
         self.testUser = mommy.make(get_user_model(), username = 'test', email = 'test@aaa.com', bio = 'line\r\njump',
@@ -68,6 +85,36 @@ class ViewsTest(TestCase):
         self.assertContains(response, "call me maybe")
         self.assertTemplateUsed(response, 'profile/otherprofile.html')
 
+    def test_profiles_show_the_rating_and_its_history(self):
+        otherUser = mommy.make(get_user_model(), username = 'someone')
+        game = mommy.make(Game, end_date = now(), closing_date = now())
+        mommy.make(PlayerRating, player = self.testUser, rating = 1516, nb_games = 1)
+        mommy.make(PlayerRating, player = otherUser, rating = 1484, nb_games = 1)
+        mommy.make(RatingChange, game = game, player = self.testUser, rank = 1, nb_players = 2, rating_before = 1500, rating_after = 1516)
+
+        response = self.client.get(reverse("profile"))
+        self.assertEqual((1516, 1), (response.context['rating'].rating, response.context['rank']))
+        self.assertEqual([game.id], [change.game_id for change in response.context['rating_history']])
+        self.assertContains(response, "game #{0}".format(game.id))
+
+        response = self.client.get(reverse("otherprofile", args = [otherUser.id]))
+        self.assertEqual((1484, 2), (response.context['rating'].rating, response.context['rank']))
+
+        response = self.client.get(reverse("otherprofile", args = [mommy.make(get_user_model()).id]))
+        self.assertIsNone(response.context['rating'])
+        self.assertContains(response, "Not rated yet")
+
+    def test_leaderboard(self):
+        otherUser = mommy.make(get_user_model(), username = 'someone')
+        mommy.make(PlayerRating, player = otherUser, rating = 1600, nb_games = 3)
+        mommy.make(PlayerRating, player = self.testUser, rating = 1450, nb_games = 2)
+
+        response = self.client.get(reverse("leaderboard"))
+
+        self.assertEqual([otherUser, self.testUser], [rating.player for rating in response.context['ratings']])
+        self.assertEqual(2, response.context['rank'])
+        self.assertTemplateUsed(response, 'profile/leaderboard.html')
+
     def test_editprofile_change_user_fields_and_password(self):
         response = self.client.post(reverse("editprofile"),
                                     {'username': 'test', 'first_name': 'Leia', 'last_name': 'Organa',
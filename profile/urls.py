@@ -6,6 +6,7 @@ urlpatterns = patterns('profile.views',
     url(r'^$',                          'profile',                  name = 'profile'),
     url(r'^(\d+)/$',                    'profile',                  name = 'otherprofile'),
     url(r'^edit/$',                     'editprofile',              name = 'editprofile'),
+    url(r'^leaderboard/$',              'leaderboard',              name = 'leaderboard'),
     url(r'^signup/$',                   'sign_up',                  name = 'signup'),
     url(r'^activation/(\d+)/(.+)/$',    'activation',               name = 'activation'),
 
@@ -12,18 +12,31 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.utils.timezone import now
 from mystrade import settings
 from profile.forms import MystradeUserForm
+from scoring.rating import leaderboard as leaderboard_ratings, rating_and_rank, rating_history
 from utils import utils
 
 
+RATING_HISTORY_SIZE = 10
+
 @login_required
 def profile(request, user_id = None):
     if user_id:
         if int(user_id) == request.user.id:
             return redirect('profile') # without our own's user_id
         else:
-            return render(request, 'profile/otherprofile.html', {'user_displayed': get_object_or_404(get_user_model(), pk = user_id)})
+            user_displayed = get_object_or_404(get_user_model(), pk = user_id)
+            return render(request, 'profile/otherprofile.html', dict(_rating_context(user_displayed), user_displayed = user_displayed))
     else:
-        return render(request, 'profile/profile.html')
+        return render(request, 'profile/profile.html', _rating_context(request.user))
+
+@login_required
+def leaderboard(request):
+    rating, rank = rating_and_rank(request.user)
+    return render(request, 'profile/leaderboard.html', {'ratings': leaderboard_ratings(settings.LEADERBOARD_SIZE), 'rating': rating, 'rank': rank})
+
+def _rating_context(user):
+    rating, rank = rating_and_rank(user)
+    return {'rating': rating, 'rank': rank, 'rating_history': rating_history(user, RATING_HISTORY_SIZE) if rating else []}
 
 @login_required
 def editprofile(request):
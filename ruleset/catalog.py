@@ -0,0 +1,88 @@
+"""
+    An in-process catalog of the rulesets, their rule cards and their commodities.
+
+    Those rows are reference data: they are written by the fixtures and the migrations, not by the games. Yet they are read
+     again and again through the foreign keys of the hands and of the scores (cih.commodity, sfr.rulecard, the ruleset of each
+     rule card to bind its scoring method, etc.). The catalog loads each ruleset once per process, with its commodities and its
+     rule cards, in three queries, after which they are resolved by id without any SQL.
+
+    The objects of the catalog are shared by all the requests of the process: they must be treated as read-only. The whole
+     catalog is dropped when a ruleset, a rule card or a commodity is saved or deleted in this process (e.g. from the admin site
+     or by loaddata); the other processes only see changes made elsewhere after a restart.
+    There is no lock: two threads missing the same ruleset at the same time both load it, and the last one wins.
+"""
+from django.db.models.signals import post_save, post_delete
+from ruleset.models import Ruleset, RuleCard, Commodity
+
+_rulesets = {}     # id -> Ruleset
+_catalogs = {}     # ruleset id -> RulesetCatalog
+_commodities = {}  # id -> Commodity, for the loaded catalogs
+_rulecards = {}    # id -> RuleCard, for the loaded catalogs
+
+class RulesetCatalog(object):
+    def __init__(self, ruleset, commodities, rulecards):
+        self.ruleset = ruleset
+        self.commodities = tuple(commodities) # by id
+        self.rulecards = tuple(rulecards)     # by id
+
+def get_ruleset(ruleset_id):
+    try:
+        return _rulesets[ruleset_id]
+    except KeyError:
+        ruleset = Ruleset.objects.get(id = ruleset_id)
+        _rulesets[ruleset.id] = ruleset
+        return ruleset
+
+def ruleset_catalog(ruleset_id):
+    try:
+        return _catalogs[ruleset_id]
+    except KeyError:
+        ruleset = get_ruleset(ruleset_id) # first, since the rule cards look up the module of their ruleset when built
+        catalog = RulesetCatalog(ruleset, Commodity.objects.filter(ruleset__id = ruleset_id).order_by('id'),
+                                          RuleCard.objects.filter(ruleset__id = ruleset_id).order_by('id'))
+        for commodity in catalog.commodities:
+            commodity._ruleset_cache = ruleset
+            _commodities[commodity.id] = commodity
+        for rulecard in catalog.rulecards:
+            rulecard._ruleset_cache = ruleset
+            _rulecards[rulecard.id] = rulecard
+        _catalogs[ruleset_id] = catalog
+        return catalog
+
+def get_commodity(commodity_id):
+    return _get(Commodity, _commodities, commodity_id)
+
+def get_rulecard(rulecard_id):
+    return _get(RuleCard, _rulecards, rulecard_id)
+
+def _get(model, index, object_id):
+    if object_id not in index:
+        try:
+            ruleset_catalog(model.objects.values_list('ruleset', flat = True).get(id = object_id))
+        except model.DoesNotExist:
+            pass
+        if object_id not in index:
+            raise model.DoesNotExist
+    return index[object_id]
+
+def resolve(instances, field_name):
+    """ Set the commodity or the rule card (field_name) of each instance from the catalog, so that reading it costs no query.
+         Returns the instances as a list. """
+    instances = list(instances)
+    if instances:
+        field = instances[0]._meta.get_field(field_name)
+        get_object = get_commodity if field.rel.to == Commodity else get_rulecard
+        for instance in instances:
+            if getattr(instance, field.attname) is not None:
+                setattr(instance, field.get_cache_name(), get_object(getattr(instance, field.attname)))
+    return instances
+
+def clear_catalog(**kwargs):
+    _rulesets.clear()
+    _catalogs.clear()
+    _commodities.clear()
+    _rulecards.clear()
+
+for model in [Ruleset, RuleCard, Commodity]:
+    post_save.connect(clear_catalog, model, dispatch_uid = 'ruleset.catalog.{0}.post_save'.format(model.__name__))
+    post_delete.connect(clear_catalog, model, dispatch_uid = 'ruleset.catalog.{0}.post_delete'.format(model.__name__))
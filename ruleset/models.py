@@ -43,10 +43,14 @@ class RuleCard(models.Model):
 
 def bind_the_resolution_method_to_the_rulecard(**kwargs):
     """ The name of the module is found in the ruleset ; the name of the method in this module is the ref_name of the rule card """
+    from ruleset.catalog import get_ruleset # not at the top: the catalog imports the models
+
     instance = kwargs.get('instance')
     if instance.ref_name:
         try:
-            module = importlib.import_module('scoring.' + instance.ruleset.module)
+            # the ruleset of a rule card read from the database is found in the catalog, instead of a query per rule card
+            ruleset = instance.ruleset if instance.ruleset_id is None or hasattr(instance, '_ruleset_cache') else get_ruleset(instance.ruleset_id)
+            module = importlib.import_module('scoring.' + ruleset.module)
             if hasattr(module, instance.ref_name):
                 instance.perform = types.MethodType(getattr(module, instance.ref_name), instance)
         except (ImportError, ValueError):
@@ -0,0 +1,66 @@
+from django.test import TestCase
+from model_mommy import mommy
+from ruleset.catalog import clear_catalog, get_commodity, get_rulecard, get_ruleset, resolve, ruleset_catalog
+from ruleset.models import Commodity, RuleCard, Ruleset
+from game.models import CommodityInHand, Game
+
+class RulesetCatalogTest(TestCase):
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        clear_catalog()
+
+    def test_a_ruleset_is_loaded_once_with_its_cards(self):
+        with self.assertNumQueries(3):
+            catalog = ruleset_catalog(1)
+        self.assertEqual(list(Commodity.objects.filter(ruleset__id = 1).order_by('id')), list(catalog.commodities))
+        self.assertEqual(list(RuleCard.objects.filter(ruleset__id = 1).order_by('id')), list(catalog.rulecards))
+
+        with self.assertNumQueries(0):
+            self.assertIs(catalog, ruleset_catalog(1))
+            self.assertEqual('haggle', get_ruleset(1).module)
+            commodity = get_commodity(catalog.commodities[0].id)
+            self.assertEqual(get_ruleset(1), commodity.ruleset)
+            rulecard = get_rulecard(catalog.rulecards[0].id)
+            self.assertEqual('haggle', rulecard.ruleset.module)
+
+    def test_a_card_of_an_unloaded_ruleset_loads_it(self):
+        commodity = Commodity.objects.filter(ruleset__id = 2)[0]
+        with self.assertNumQueries(4):
+            self.assertEqual(commodity, get_commodity(commodity.id))
+        with self.assertNumQueries(0):
+            self.assertEqual(commodity, get_commodity(commodity.id))
+
+        with self.assertRaises(RuleCard.DoesNotExist):
+            get_rulecard(RuleCard.objects.order_by('-id')[0].id + 1)
+
+    def test_the_rule_cards_read_from_the_database_find_their_ruleset_in_the_catalog(self):
+        get_ruleset(1)
+        with self.assertNumQueries(1):
+            rulecards = list(RuleCard.objects.filter(ruleset__id = 1))
+        self.assertTrue(all(hasattr(rulecard, 'perform') for rulecard in rulecards))
+
+    def test_the_catalog_is_dropped_when_a_card_is_saved(self):
+        commodity = ruleset_catalog(1).commodities[0]
+        Commodity.objects.filter(id = commodity.id).update(name = 'Renamed') # without signal
+        self.assertNotEqual('Renamed', get_commodity(commodity.id).name)
+
+        renamed = Commodity.objects.get(id = commodity.id)
+        renamed.save()
+        self.assertEqual('Renamed', get_commodity(commodity.id).name)
+
+        ruleset = Ruleset.objects.get(id = 1)
+        ruleset.starting_rules = 4
+        ruleset.save()
+        self.assertEqual(4, get_ruleset(1).starting_rules)
+
+    def test_resolve(self):
+        game = mommy.make(Game, ruleset = Ruleset.objects.get(id = 1))
+        for commodity in Commodity.objects.filter(ruleset__id = 1):
+            mommy.make(CommodityInHand, game = game, commodity = commodity, nb_cards = 1)
+        ruleset_catalog(1)
+
+        with self.assertNumQueries(1):
+            hand = resolve(CommodityInHand.objects.filter(game = game).order_by('id'), 'commodity')
+            self.assertEqual([cih.commodity_id for cih in hand], [cih.commodity.id for cih in hand])
+        self.assertEqual([], resolve(CommodityInHand.objects.none(), 'commodity'))
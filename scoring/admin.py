@@ -0,0 +1,96 @@
+from django.contrib import admin
+from django.db.models import Count, Max, Sum
+
+from scoring.models import RuleCardAnalytics, RuleScoringProfile
+
+RECENT_GAMES_IN_PROFILE = 20
+
+class RuleScoringProfileAdmin(admin.ModelAdmin):
+    list_display = ('game', 'ref_name', 'nb_calls', 'average_duration_ms', 'average_queries', 'average_lines', 'last_call_date')
+    list_filter = ('rulecard__ruleset',)
+    ordering = ('-last_call_date',)
+    readonly_fields = ('game', 'rulecard', 'nb_calls', 'total_duration', 'total_queries', 'total_lines', 'last_call_date')
+
+    def ref_name(self, profile):
+        return profile.rulecard.ref_name
+
+    def average_duration_ms(self, profile):
+        return "{0:.1f}".format(1000 * profile.total_duration / profile.nb_calls) if profile.nb_calls else '-'
+
+    def average_queries(self, profile):
+        return "{0:.1f}".format(float(profile.total_queries) / profile.nb_calls) if profile.nb_calls else '-'
+
+    def average_lines(self, profile):
+        return "{0:.1f}".format(float(profile.total_lines) / profile.nb_calls) if profile.nb_calls else '-'
+
+    def has_add_permission(self, request):
+        return False
+
+    def changelist_view(self, request, extra_context = None):
+        """ On top of the list of profiles per game, display the figures of each rule card aggregated over the recent games,
+             the most expensive rules first. """
+        recent_games = [profile['game'] for profile in RuleScoringProfile.objects.values('game').annotate(last_call = Max('last_call_date'))
+                                                                                 .order_by('-last_call')[:RECENT_GAMES_IN_PROFILE]]
+        summary = []
+        for rule in (RuleScoringProfile.objects.filter(game__in = recent_games).values('rulecard__ref_name')
+                                               .annotate(nb_calls = Sum('nb_calls'), total_duration = Sum('total_duration'),
+                                                         total_queries = Sum('total_queries'), total_lines = Sum('total_lines'))):
+            nb_calls = rule['nb_calls'] or 1
+            summary.append({'ref_name':        rule['rulecard__ref_name'],
+                            'nb_calls':        rule['nb_calls'],
+                            'average_duration_ms': 1000 * rule['total_duration'] / nb_calls,
+                            'average_queries': float(rule['total_queries']) / nb_calls,
+                            'average_lines':   float(rule['total_lines']) / nb_calls})
+        summary.sort(key = lambda rule: rule['average_duration_ms'], reverse = True)
+
+        extra_context = extra_context or {}
+        extra_context.update({'summary': summary, 'nb_recent_games': len(recent_games)})
+        return super(RuleScoringProfileAdmin, self).changelist_view(request, extra_context = extra_context)
+
+admin.site.register(RuleScoringProfile, RuleScoringProfileAdmin)
+
+class RuleCardAnalyticsAdmin(admin.ModelAdmin):
+    """ The analytics computed by the command compute_rule_analytics: only these aggregates are read, not the scores of the games """
+    list_display = ('ref_name', 'ruleset', 'nb_games', 'nb_scoresheets', 'hit_rate_percent', 'mean_score_rounded', 'rank_correlation_rounded')
+    list_filter = ('rulecard__ruleset',)
+    list_select_related = ('rulecard__ruleset',)
+    ordering = ('rulecard__ruleset', 'rulecard__ref_name')
+    readonly_fields = ('rulecard', 'nb_games', 'nb_scoresheets', 'nb_hits', 'hit_rate', 'mean_score', 'rank_correlation', 'computation_date')
+
+    def ref_name(self, analytics):
+        return analytics.rulecard.ref_name
+
+    def ruleset(self, analytics):
+        return analytics.rulecard.ruleset.name
+
+    def hit_rate_percent(self, analytics):
+        return "{0:.1f}".format(100 * analytics.hit_rate)
+    hit_rate_percent.admin_order_field = 'hit_rate'
+
+    def mean_score_rounded(self, analytics):
+        return "{0:.1f}".format(analytics.mean_score) if analytics.mean_score is not None else '-'
+    mean_score_rounded.admin_order_field = 'mean_score'
+
+    def rank_correlation_rounded(self, analytics):
+        return "{0:.2f}".format(analytics.rank_correlation) if analytics.rank_correlation is not None else '-'
+    rank_correlation_rounded.admin_order_field = 'rank_correlation'
+
+    def has_add_permission(self, request):
+        return False
+
+    def changelist_view(self, request, extra_context = None):
+        """ On top of the list of rule cards, how often the rules of each ruleset register a line """
+        summary = []
+        for ruleset in (RuleCardAnalytics.objects.values('rulecard__ruleset__name').order_by('rulecard__ruleset__name')
+                                                 .annotate(nb_rulecards = Count('id'), nb_scoresheets = Sum('nb_scoresheets'), nb_hits = Sum('nb_hits'),
+                                                           computation_date = Max('computation_date'))):
+            summary.append({'name':             ruleset['rulecard__ruleset__name'],
+                            'nb_rulecards':     ruleset['nb_rulecards'],
+                            'hit_rate_percent': 100.0 * ruleset['nb_hits'] / ruleset['nb_scoresheets'] if ruleset['nb_scoresheets'] else 0,
+                            'computation_date': ruleset['computation_date']})
+
+        extra_context = extra_context or {}
+        extra_context.update({'summary': summary})
+        return super(RuleCardAnalyticsAdmin, self).changelist_view(request, extra_context = extra_context)
+
+admin.site.register(RuleCardAnalytics, RuleCardAnalyticsAdmin)
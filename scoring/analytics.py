@@ -0,0 +1,90 @@
+"""
+    The analytics of the rule cards over all the closed games (see scoring.models.RuleCardAnalytics).
+
+    compute_analytics() fetches the scores of the closed games in bulk - the scoresheets (one per GamePlayer), the lines registered
+     for the commodities and for the rules, and the rules in play in each game - as NumPy arrays, and computes the figures of all the
+     rule cards with array operations instead of walking the scores row by row. For each rule card, over the scoresheets of the games
+     where it was in play:
+        - the hit rate is the fraction of the scoresheets where it registered at least one line,
+        - the mean score is the mean of its score on the scoresheets where it registered a line,
+        - the rank correlation is the Pearson correlation between its score on each scoresheet (0 without any line) and the final
+           rank of the player, normalized from 0 for the winner to 1 for the last one: the more negative, the more the rule helps to win.
+"""
+import numpy
+from django.db import transaction
+from django.utils.timezone import now
+from game.models import Game, GamePlayer
+from scoring.models import RuleCardAnalytics, ScoreFromCommodity, ScoreFromRule
+
+def compute_analytics():
+    """ Replace the analytics of all the rule cards by those computed from the games closed so far. Returns the number of games. """
+    games = Game.objects.filter(closing_date__isnull = False)
+    gameplayers = _array(GamePlayer.objects.filter(game__in = games).values_list('game', 'player'), 2)
+    stride = gameplayers[:, 1].max() + 1 if len(gameplayers) else 1
+    keys = numpy.sort(gameplayers[:, 0] * stride + gameplayers[:, 1]) # one per scoresheet, in the order of the arrays below
+    scoresheet_games = keys // stride
+
+    commodity_lines = _array(ScoreFromCommodity.objects.filter(game__in = games).values_list('game', 'player', 'score'), 3)
+    rule_lines = _array([(game_id, player_id, rulecard_id, score or 0) for game_id, player_id, rulecard_id, score in
+                         ScoreFromRule.objects.filter(game__in = games).values_list('game', 'player', 'rulecard', 'score')], 4)
+    commodity_scoresheets = _scoresheet_index(keys, commodity_lines[:, 0] * stride + commodity_lines[:, 1])
+    rule_scoresheets = _scoresheet_index(keys, rule_lines[:, 0] * stride + rule_lines[:, 1])
+
+    totals = numpy.bincount(commodity_scoresheets, weights = commodity_lines[:, 2], minlength = len(keys))[:len(keys)]\
+           + numpy.bincount(rule_scoresheets, weights = rule_lines[:, 3], minlength = len(keys))[:len(keys)]
+    ranks = _normalized_ranks(scoresheet_games, totals)
+
+    rules_in_play = _array(Game.rules.through.objects.filter(game__in = games).values_list('game', 'rulecard'), 2)
+    analytics, date_now = [], now()
+    for rulecard_id in numpy.unique(rules_in_play[:, 1]):
+        in_play = numpy.in1d(scoresheet_games, rules_in_play[rules_in_play[:, 1] == rulecard_id, 0])
+        lines = rule_lines[:, 2] == rulecard_id
+        scores = numpy.bincount(rule_scoresheets[lines], weights = rule_lines[lines, 3], minlength = len(keys))[:len(keys)]
+        hits = in_play & (numpy.bincount(rule_scoresheets[lines], minlength = len(keys))[:len(keys)] > 0)
+
+        nb_scoresheets, nb_hits = int(in_play.sum()), int(hits.sum())
+        analytics.append(RuleCardAnalytics(rulecard_id = int(rulecard_id),
+                                           nb_games = len(numpy.unique(scoresheet_games[in_play])),
+                                           nb_scoresheets = nb_scoresheets, nb_hits = nb_hits,
+                                           hit_rate = float(nb_hits) / nb_scoresheets if nb_scoresheets else 0,
+                                           mean_score = float(scores[hits].mean()) if nb_hits else None,
+                                           rank_correlation = _correlation(scores[in_play], ranks[in_play]), computation_date = date_now))
+
+    with transaction.atomic():
+        RuleCardAnalytics.objects.all().delete()
+        RuleCardAnalytics.objects.bulk_create(analytics)
+    return len(numpy.unique(scoresheet_games))
+
+def _array(rows, nb_columns):
+    return numpy.array(list(rows), dtype = numpy.int64).reshape(-1, nb_columns)
+
+def _scoresheet_index(keys, line_keys):
+    """ The index in keys (sorted) of the scoresheet of each line, len(keys) for the lines of a player no longer in the game, which
+         numpy.bincount() then counts apart """
+    indexes = numpy.searchsorted(keys, line_keys)
+    found = indexes < len(keys)
+    found[found] = keys[indexes[found]] == line_keys[found]
+    return numpy.where(found, indexes, len(keys))
+
+def _normalized_ranks(games, totals):
+    """ The rank of each scoresheet in its game, the players with the same score sharing the best rank, from 0 for the winner to 1
+         for the last one """
+    if not len(games):
+        return numpy.zeros(0)
+    order = numpy.lexsort((-totals, games)) # by game, then by decreasing score
+    positions = numpy.arange(len(games))
+    sorted_games, sorted_totals = games[order], totals[order]
+    first_of_game = numpy.r_[True, sorted_games[1:] != sorted_games[:-1]]
+    first_of_score = first_of_game | numpy.r_[True, sorted_totals[1:] != sorted_totals[:-1]]
+    game_starts = numpy.maximum.accumulate(numpy.where(first_of_game, positions, 0))
+    ranks = numpy.maximum.accumulate(numpy.where(first_of_score, positions, 0)) - game_starts
+    game_sizes = numpy.bincount(numpy.cumsum(first_of_game) - 1)[numpy.cumsum(first_of_game) - 1]
+
+    normalized_ranks = numpy.empty(len(games))
+    normalized_ranks[order] = ranks / numpy.maximum(game_sizes - 1, 1).astype(float)
+    return normalized_ranks
+
+def _correlation(x, y):
+    if len(x) < 2 or not x.std() or not y.std():
+        return None
+    return float(numpy.corrcoef(x, y)[0, 1])
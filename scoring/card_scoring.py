@@ -1,25 +1,74 @@
+import logging
+import time
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.timezone import now
 from game.models import GamePlayer, CommodityInHand
+from ruleset.catalog import get_commodity
 from ruleset.models import Commodity
-from scoring.models import ScoreFromRule, ScoreFromCommodity
+from scoring.models import ScoreFromRule, ScoreFromCommodity, RuleScoringProfile
+from utils.utils import QueryCounter
+
+logger = logging.getLogger(__name__)
 
 def tally_scores(game, scoresheets = None):
     if scoresheets is None:
         scoresheets = [Scoresheet(gameplayer) for gameplayer in GamePlayer.objects.filter(game = game)]
 
+    profiling = getattr(settings, 'SCORING_RULES_PROFILING', False)
+
     for rule in game.rules.filter(step__isnull = False).order_by('step', 'ref_name'):
-        if rule.glob:
-            rule.perform(scoresheets)
+        if profiling:
+            nb_lines_before = _count_lines(scoresheets)
+            start = time.time()
+            with QueryCounter() as counter:
+                _perform(rule, scoresheets)
+            _record_rule_profile(game, rule, time.time() - start, counter.count, _count_lines(scoresheets) - nb_lines_before)
         else:
-            for scoresheet in scoresheets:
-                rule.perform(scoresheet)
+            _perform(rule, scoresheets)
 
     return scoresheets
 
+def _perform(rule, scoresheets):
+    if rule.glob:
+        rule.perform(scoresheets)
+    else:
+        for scoresheet in scoresheets:
+            rule.perform(scoresheet)
+
+def _count_lines(scoresheets):
+    return sum(len(scoresheet.scores_from_rule) for scoresheet in scoresheets)
+
+def _record_rule_profile(game, rule, duration, nb_queries, nb_lines):
+    """ One structured log line per rule and per tally, plus the cumulated figures for this game and this rule in the
+         RuleScoringProfile table, which is displayed in the admin site aggregated over the recent games.
+    """
+    logger.info("tally_scores game={0} rule={1} duration_ms={2:.1f} queries={3} lines={4}".format(game.id, rule.ref_name, duration * 1000, nb_queries, nb_lines))
+
+    if not _add_to_rule_profile(game, rule, duration, nb_queries, nb_lines):
+        try:
+            with transaction.atomic(): # a savepoint: a concurrent tally may have created the row since the update
+                RuleScoringProfile.objects.create(game = game, rulecard = rule, nb_calls = 1, total_duration = duration,
+                                                  total_queries = nb_queries, total_lines = nb_lines)
+        except IntegrityError:
+            _add_to_rule_profile(game, rule, duration, nb_queries, nb_lines)
+
+def _add_to_rule_profile(game, rule, duration, nb_queries, nb_lines):
+    """ The number of rows updated: 0 if there is no profile yet for this game and this rule """
+    return RuleScoringProfile.objects.filter(game = game, rulecard = rule).update(nb_calls       = F('nb_calls') + 1,
+                                                                                  total_duration = F('total_duration') + duration,
+                                                                                  total_queries  = F('total_queries') + nb_queries,
+                                                                                  total_lines    = F('total_lines') + nb_lines,
+                                                                                  last_call_date = now())
+
 class Scoresheet(object):
+    scoring_date = None # the date of the scores, when they are not the current ones (see scoring.replay)
+
     def __init__(self, gameplayer, scores_from_commodity = None, scores_from_rule = None):
         self.gameplayer = gameplayer
 
-        if scores_from_commodity:
+        if scores_from_commodity is not None:
             self._scores_from_commodity = scores_from_commodity
         else:
             self._prepare_scores_from_commodities(gameplayer)
@@ -90,9 +139,10 @@ class Scoresheet(object):
         self._scores_from_commodity = []
         for cih in commodities:
             nb_scored_cards = cih.nb_submitted_cards if gameplayer.submit_date else cih.nb_cards
-            sfc = ScoreFromCommodity(game = gameplayer.game, player = gameplayer.player, commodity = cih.commodity,
+            commodity = get_commodity(cih.commodity_id)
+            sfc = ScoreFromCommodity(game = gameplayer.game, player = gameplayer.player, commodity = commodity,
                                      nb_submitted_cards = nb_scored_cards, nb_scored_cards = nb_scored_cards,
-                                     actual_value = cih.commodity.value, score = 0)
+                                     actual_value = commodity.value, score = 0)
             self._scores_from_commodity.append(sfc)
 
     def _print_scoresheet(self):
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from scoring.analytics import compute_analytics
+
+class Command(BaseCommand):
+    help = ("Compute the hit rate, the mean score and the correlation with the final rank of each rule card over all the closed games "
+            "(see scoring.analytics), displayed on the admin site. Meant to be run periodically, e.g. every night.")
+
+    def handle(self, *args, **options):
+        nb_games = compute_analytics()
+        self.stdout.write("Rule cards analysed over {0} closed game{1}".format(nb_games, 's' if nb_games > 1 else ''))
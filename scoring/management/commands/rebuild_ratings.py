@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from game.models import Game
+from scoring.rating import rebuild_ratings
+
+class Command(BaseCommand):
+    help = ("Rebuild the Elo ratings of the players and their history (see scoring.rating) by rating again all the closed games, "
+            "in the order of their closing, from their frozen scoreboards. The games closed from now on are rated as they are closed.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            nb_games = rebuild_ratings(Game.objects.all())
+        self.stdout.write("{0} game{1} rated".format(nb_games, 's' if nb_games > 1 else ''))
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils.timezone import now
 from game.models import Game
 from mystrade import settings
 from ruleset.models import RuleCard, Commodity
@@ -19,4 +20,66 @@ class ScoreFromCommodity(models.Model):
     nb_submitted_cards = models.PositiveSmallIntegerField()
     nb_scored_cards = models.PositiveSmallIntegerField()
     actual_value = models.IntegerField()
-    score = models.IntegerField()
\ No newline at end of file
+    score = models.IntegerField()
+
+class RuleScoringProfile(models.Model):
+    """ Cumulated cost of the resolution of a rule card in all the calls to tally_scores() for a game
+         (see scoring.card_scoring and the SCORING_RULES_PROFILING setting). """
+    game = models.ForeignKey(Game)
+    rulecard = models.ForeignKey(RuleCard)
+
+    nb_calls = models.PositiveIntegerField(default = 0)
+    total_duration = models.FloatField("Cumulated wall time (in seconds)", default = 0)
+    total_queries = models.PositiveIntegerField("Cumulated number of SQL queries issued", default = 0)
+    total_lines = models.PositiveIntegerField("Cumulated number of scoresheet lines registered", default = 0)
+
+    last_call_date = models.DateTimeField(default = now)
+
+    class Meta:
+        unique_together = ('game', 'rulecard')
+
+class Scoreboard(models.Model):
+    """ The final scores of a closed game, frozen when it is closed since they never change afterwards: the scoresheets of all the
+         players by rank, with the rules known by each of them, serialized in JSON (see scoring.scoreboard). """
+    game = models.OneToOneField(Game)
+    content = models.TextField()
+    creation_date = models.DateTimeField(default = now)
+
+class RuleCardAnalytics(models.Model):
+    """ How a rule card has scored over all the closed games where it was in play, computed by scoring.analytics.compute_analytics()
+         (see the command compute_rule_analytics): the admin site reads only these aggregates, not the scores of each game. """
+    rulecard = models.OneToOneField(RuleCard)
+
+    nb_games = models.PositiveIntegerField("Closed games where the rule was in play", default = 0)
+    nb_scoresheets = models.PositiveIntegerField("Scoresheets of these games", default = 0)
+    nb_hits = models.PositiveIntegerField("Scoresheets where the rule registered a line", default = 0)
+    hit_rate = models.FloatField(default = 0)
+    mean_score = models.FloatField("Mean score of the rule when it registered a line", null = True)
+    rank_correlation = models.FloatField("Correlation between the score of the rule and the final rank (0 for the winner, 1 for the last)", null = True)
+
+    computation_date = models.DateTimeField(default = now)
+
+class PlayerRating(models.Model):
+    """ The current Elo rating of a player over the closed games (see scoring.rating), indexed for the leaderboard """
+    player = models.OneToOneField(settings.AUTH_USER_MODEL, related_name = 'rating')
+
+    rating = models.FloatField(db_index = True)
+    nb_games = models.PositiveIntegerField(default = 0)
+
+    update_date = models.DateTimeField(default = now)
+
+class RatingChange(models.Model):
+    """ The change of the rating of a player at the closing of a game, for the history shown on the profiles """
+    game = models.ForeignKey(Game)
+    player = models.ForeignKey(settings.AUTH_USER_MODEL, related_name = '+')
+
+    rank = models.PositiveSmallIntegerField()
+    nb_players = models.PositiveSmallIntegerField()
+    rating_before = models.FloatField()
+    rating_after = models.FloatField()
+
+    date = models.DateTimeField(default = now)
+
+    class Meta:
+        unique_together = ('game', 'player')
+        index_together = [('player', 'date')] # the history of a player
@@ -5,6 +5,15 @@ from math import ceil
 from django.db.models import Q
 from trade.models import Trade
 
+# the rules below that read the history of the trades, and not only the hands (see scoring.replay)
+RULES_READING_THE_TRADES = ['PIZ13', 'PIZ14', 'PIZ15']
+
+def _accepted_trades(scoresheet):
+    """ The trades accepted in the game until the date of the scores (scoresheet.scoring_date), now by default """
+    trades = Trade.objects.filter(game = scoresheet.gameplayer.game, status = 'ACCEPTED')
+    if scoresheet.scoring_date:
+        trades = trades.filter(closing_date__lte = scoresheet.scoring_date)
+    return trades
 
 def PIZ04(rulecard, scoresheet):
     """ If your pizza contains no Cheese, Don Peppino will curse you but his wife will arrange so
@@ -108,7 +117,7 @@ def PIZ13(rulecard, scoresheets):
     #  In such a case, we want that the MESSAGE_DETAIL display the earliest closing_date from the tied trades.
     #  Thus we use a list below: it is guaranteed to keep the "order by closing_date" for the later iteration -- a dict would not.
     cards_count = []
-    for trade in Trade.objects.filter(game = scoresheets[0].gameplayer.game, status = 'ACCEPTED').order_by('closing_date'):
+    for trade in _accepted_trades(scoresheets[0]).order_by('closing_date'):
         cards_count.append((trade, trade.initiator_offer.total_traded_cards + trade.responder_offer.total_traded_cards))
 
     if len(cards_count) == 0:
@@ -143,8 +152,7 @@ def PIZ14(rulecard, scoresheets):
     rulecards_count = {}
     for scoresheet in scoresheets:
         nb_traded_rulecards= 0
-        for trade in Trade.objects.filter(Q(initiator = scoresheet.gameplayer.player) | Q(responder = scoresheet.gameplayer.player),
-                                          game = scoresheet.gameplayer.game, status = 'ACCEPTED'):
+        for trade in _accepted_trades(scoresheet).filter(Q(initiator = scoresheet.gameplayer.player) | Q(responder = scoresheet.gameplayer.player)):
             nb_traded_rulecards += len(trade.initiator_offer.rules.all()) + len(trade.responder_offer.rules.all())
         rulecards_count[scoresheet] = nb_traded_rulecards
 
@@ -162,10 +170,10 @@ def PIZ15(rulecard, scoresheet):
     """ The cooks who will not have performed a trade with at least 7 different players during the game will
          lose 20 points. Only accepted trades with at least one card (rule or topping) given by each player count. """
     traders = set()
-    for trade in Trade.objects.filter(game = scoresheet.gameplayer.game, status = 'ACCEPTED', initiator = scoresheet.gameplayer.player):
+    for trade in _accepted_trades(scoresheet).filter(initiator = scoresheet.gameplayer.player):
         if trade.initiator_offer.total_traded_cards > 0 and trade.responder_offer.total_traded_cards > 0:
             traders.add(trade.responder)
-    for trade in Trade.objects.filter(game = scoresheet.gameplayer.game, status = 'ACCEPTED', responder = scoresheet.gameplayer.player):
+    for trade in _accepted_trades(scoresheet).filter(responder = scoresheet.gameplayer.player):
         if trade.initiator_offer.total_traded_cards > 0 and trade.responder_offer.total_traded_cards > 0:
             traders.add(trade.initiator)
 
@@ -0,0 +1,97 @@
+"""
+    The Elo rating of the players over the closed games (see scoring.models.PlayerRating).
+
+    A game is rated once, when it is closed (see game.views.close_game), from its final scores: each player is matched against each
+     other player of the game, winning against those with a lower score, drawing with those with the same score and losing against
+     the others. The rating of a player moves by settings.RATING_K_FACTOR / (number of opponents) times the sum over these matches of
+     the result minus the expected result, 1 / (1 + 10 ^ ((rating of the opponent - own rating) / 400)). A new player starts at
+     settings.RATING_INITIAL.
+
+    Only the ratings of the players of the game are read and written, locked until the end of the closing: the missing ones are
+     created first, so that the games closed at the same time are rated one after the other. Each change is kept as a RatingChange
+     for the history shown on the profiles. The leaderboard and the rank of a player are read from the index on PlayerRating.rating. The ratings of
+     the games closed before they existed are rebuilt from their scoreboards by the command rebuild_ratings.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from scoring.models import PlayerRating, RatingChange
+from scoring.scoreboard import load_scoreboard
+
+def rate_game(game, scoresheets):
+    """ Update the ratings of the players of the game from their final scoresheets. Returns False if the game has already been
+         rated, or has less than two players. """
+    if len(scoresheets) < 2 or RatingChange.objects.filter(game = game).exists():
+        return False
+
+    scores = dict((scoresheet.gameplayer.player_id, scoresheet.total_score) for scoresheet in scoresheets)
+    _create_missing_ratings(list(scores), game.closing_date)
+    ratings = dict((rating.player_id, rating) for rating in PlayerRating.objects.select_for_update().filter(player__in = list(scores)))
+    before = dict((player_id, ratings[player_id].rating) for player_id in scores)
+    k_factor = float(settings.RATING_K_FACTOR) / (len(scores) - 1)
+
+    changes = []
+    for player_id, score in scores.iteritems():
+        rating_after = before[player_id] + k_factor * sum(_result(score, other_score) - _expected_result(before[player_id], before[other_id])
+                                                          for other_id, other_score in scores.iteritems() if other_id != player_id)
+        changes.append(RatingChange(game = game, player_id = player_id, rank = 1 + len([other for other in scores.itervalues() if other > score]),
+                                    nb_players = len(scores), rating_before = before[player_id], rating_after = rating_after,
+                                    date = game.closing_date))
+        PlayerRating.objects.filter(id = ratings[player_id].id).update(rating = rating_after, nb_games = ratings[player_id].nb_games + 1,
+                                                                       update_date = game.closing_date)
+    RatingChange.objects.bulk_create(changes)
+    return True
+
+def _create_missing_ratings(player_ids, date):
+    """ The ratings, at settings.RATING_INITIAL, of the players who have none yet, so that they can be locked like the others. A game
+         closed at the same time may create some of them first: the inserts are done in savepoints, so that the closing goes on
+         with the rows of the other game. """
+    rated = set(_rated_players(player_ids))
+    missing = [PlayerRating(player_id = player_id, rating = settings.RATING_INITIAL, nb_games = 0, update_date = date)
+               for player_id in player_ids if player_id not in rated]
+    if not missing:
+        return
+    try:
+        with transaction.atomic():
+            PlayerRating.objects.bulk_create(missing)
+    except IntegrityError: # one row at a time then, skipping those already created
+        for rating in missing:
+            try:
+                with transaction.atomic():
+                    rating.save(force_insert = True)
+            except IntegrityError:
+                pass
+
+def _rated_players(player_ids):
+    return PlayerRating.objects.filter(player__in = player_ids).values_list('player', flat = True)
+
+def rebuild_ratings(games):
+    """ Rate again all the games, in the order of their closing, from their frozen scoreboards. Returns the number of games rated. """
+    RatingChange.objects.all().delete()
+    PlayerRating.objects.all().delete()
+    nb_games = 0
+    for game in games.filter(closing_date__isnull = False).order_by('closing_date', 'id'):
+        if rate_game(game, load_scoreboard(game)):
+            nb_games += 1
+    return nb_games
+
+def leaderboard(limit, offset = 0):
+    """ The best rated players, with their user """
+    return PlayerRating.objects.select_related('player').order_by('-rating', 'player')[offset:offset + limit]
+
+def rating_and_rank(player):
+    """ (rating, rank in the leaderboard) of the player, or (None, None) if they haven't played any closed game """
+    try:
+        rating = PlayerRating.objects.get(player = player)
+    except PlayerRating.DoesNotExist:
+        return None, None
+    return rating, 1 + PlayerRating.objects.filter(rating__gt = rating.rating).count()
+
+def rating_history(player, limit):
+    """ The latest changes of the rating of the player """
+    return RatingChange.objects.filter(player = player).order_by('-date', '-id')[:limit]
+
+def _result(score, other_score):
+    return 1.0 if score > other_score else 0.5 if score == other_score else 0.0
+
+def _expected_result(rating, other_rating):
+    return 1.0 / (1 + 10 ** ((other_rating - rating) / 400.0))
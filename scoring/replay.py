@@ -0,0 +1,91 @@
+"""
+    Replay of the scores of a game at any point of its history.
+
+    The hands of the players are rebuilt from the ledger of the cards (see game.ledger) in a single streaming pass, in chronological
+     order, and the rule cards of the game are applied to them at each point where the scores are wanted: after each accepted trade,
+     or at given dates. The rule cards, the commodities and the players are read once for the whole replay.
+
+    The scoring is incremental when it can be: if none of the rules of the game is global (i.e. needs the hands of all the players)
+     nor reads the history of the trades, the score of a player only depends on their own hand, and only the players whose hand has
+     changed since the previous point are scored again. The rules reading the history of the trades see only the trades accepted
+     before the point being scored (see scoring.pizzaz._accepted_trades).
+"""
+import importlib
+from game.models import CardMovement, GamePlayer
+from game.ledger import Hand
+from ruleset.catalog import get_commodity, get_ruleset
+from scoring.card_scoring import Scoresheet, _perform
+from scoring.models import ScoreFromCommodity
+
+def replay_scores(game, dates = None):
+    """ Yields (date, trade id, scoresheets) after each trade accepted in the game, or at each of the dates if given (the trade
+         id being then None). The scoresheets are in the order of the players in the game. """
+    gameplayers = list(GamePlayer.objects.filter(game = game).select_related('game', 'player').order_by('id'))
+    rules = list(game.rules.filter(step__isnull = False).order_by('step', 'ref_name'))
+    incremental = _is_incremental(game, rules)
+
+    hands = dict((gameplayer.player_id, Hand()) for gameplayer in gameplayers)
+    scoresheets = {} # by player id, kept from a point to the next one for the players whose hand hasn't changed if incremental
+    changed = set(hands)
+
+    def score(date):
+        if not incremental:
+            changed.update(hands)
+        players = [gameplayer for gameplayer in gameplayers if gameplayer.player_id in changed]
+        for gameplayer in players:
+            scoresheets[gameplayer.player_id] = _scoresheet(gameplayer, hands[gameplayer.player_id], date)
+        for rule in rules:
+            _perform(rule, [scoresheets[gameplayer.player_id] for gameplayer in players] if incremental
+                           else [scoresheets[gameplayer.player_id] for gameplayer in gameplayers])
+        changed.clear()
+        return [scoresheets[gameplayer.player_id] for gameplayer in gameplayers]
+
+    pending_dates = sorted(dates) if dates is not None else None
+    current_trade, current_date = None, None
+    movements = CardMovement.objects.filter(game = game).order_by('date', 'id')\
+                                    .values_list('player', 'commodity', 'rulecard', 'nb_cards', 'reason', 'trade', 'date')
+    for player_id, commodity_id, rulecard_id, nb_cards, reason, trade_id, date in movements.iterator():
+        if pending_dates is None:
+            if current_trade is not None and trade_id != current_trade:
+                yield current_date, current_trade, score(current_date)
+        else:
+            while pending_dates and pending_dates[0] < date:
+                yield pending_dates[0], None, score(pending_dates[0])
+                pending_dates.pop(0)
+        if player_id in hands: # not a player who has left the game
+            hands[player_id].apply(commodity_id, rulecard_id, nb_cards, reason)
+            changed.add(player_id)
+        current_trade, current_date = trade_id, date
+
+    if pending_dates is None:
+        if current_trade is not None:
+            yield current_date, current_trade, score(current_date)
+    else:
+        for date in pending_dates:
+            yield date, None, score(date)
+
+def scores_at(game, date):
+    """ The scoresheets of the players of the game at the date """
+    for _date, _trade_id, scoresheets in replay_scores(game, [date]):
+        return scoresheets
+
+def _is_incremental(game, rules):
+    try:
+        rules_reading_the_trades = getattr(importlib.import_module('scoring.' + get_ruleset(game.ruleset_id).module), 'RULES_READING_THE_TRADES', [])
+    except (ImportError, ValueError):
+        rules_reading_the_trades = []
+    return not any(rule.glob or rule.ref_name in rules_reading_the_trades for rule in rules)
+
+def _scoresheet(gameplayer, hand, date):
+    """ The scoresheet of the hand of the player at the date, before the rules are applied, as Scoresheet reads it from the database """
+    submitted = gameplayer.submit_date is not None and gameplayer.submit_date <= date
+    scores_from_commodity = []
+    for commodity_id, nb_cards in (hand.submitted_commodities if submitted else hand.commodities).iteritems():
+        commodity = get_commodity(commodity_id)
+        scores_from_commodity.append(ScoreFromCommodity(game = gameplayer.game, player = gameplayer.player, commodity = commodity,
+                                                        nb_submitted_cards = nb_cards, nb_scored_cards = nb_cards,
+                                                        actual_value = commodity.value, score = 0))
+    scores_from_commodity.sort(key = lambda sfc: sfc.commodity.name)
+    scoresheet = Scoresheet(gameplayer, scores_from_commodity = scores_from_commodity)
+    scoresheet.scoring_date = date
+    return scoresheet
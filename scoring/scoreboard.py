@@ -0,0 +1,112 @@
+"""
+    The frozen scoreboard of a closed game (see scoring.models.Scoreboard).
+
+    close_game() freezes the scoresheets it has just persisted with freeze_scoreboard(), and the closed game is then displayed from
+     this single row by load_scoreboard(). The games closed before the scoreboards existed are frozen lazily, from their persisted
+     scores, the first time they are displayed.
+
+    The JSON document is a list of scoresheets by rank:
+        [{"player": {"id": 1, "username": ..., "first_name": ..., "last_name": ...}, "total_score": 42,
+          "commodities": [{"commodity": {"id": 1, "name": ..., "color": ..., "symbol": ..., "category": ...},
+                           "nb_submitted_cards": 3, "nb_scored_cards": 2, "actual_value": 4, "score": 8}, ...],
+          "rules": [{"public_name": ..., "detail": ..., "score": 10}, ...],
+          "known_rules": [{"public_name": ..., "description": ...}, ...]}, ...]
+    The players, commodities and rule cards are copied as they were at the time of the closing: a frozen scoreboard never changes.
+"""
+import json
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from game.models import GamePlayer, RuleInHand
+from ruleset.models import Commodity, RuleCard
+from scoring.models import Scoreboard, ScoreFromCommodity, ScoreFromRule
+
+PLAYER_FIELDS = ['id', 'username', 'first_name', 'last_name']
+COMMODITY_FIELDS = ['id', 'name', 'color', 'symbol', 'category']
+
+class FrozenScoresheet(object):
+    """ A scoresheet read from a frozen scoreboard, with the same attributes as a scoring.card_scoring.Scoresheet for the templates """
+    is_random = False
+
+    def __init__(self, game, data):
+        self.gameplayer = GamePlayer(game = game, player = get_user_model()(**data['player']))
+        self.total_score = data['total_score']
+        self.scores_from_commodity = [ScoreFromCommodity(game = game, player = self.gameplayer.player, commodity = Commodity(**sfc['commodity']),
+                                                         nb_submitted_cards = sfc['nb_submitted_cards'], nb_scored_cards = sfc['nb_scored_cards'],
+                                                         actual_value = sfc['actual_value'], score = sfc['score'])
+                                      for sfc in data['commodities']]
+        self.scores_from_rule = [ScoreFromRule(game = game, player = self.gameplayer.player, rulecard = RuleCard(public_name = sfr['public_name']),
+                                               detail = sfr['detail'], score = sfr['score'])
+                                 for sfr in data['rules']]
+        self.known_rules = [RuleInHand(game = game, player = self.gameplayer.player, rulecard = RuleCard(**rule)) for rule in data['known_rules']]
+
+    @property
+    def player_name(self):
+        return self.gameplayer.player.name
+
+def freeze_scoreboard(game, scoresheets):
+    """ Save the scoresheets, sorted by rank, as the scoreboard of the game, in place of a former one """
+    known_rules = _known_rules_per_player(game)
+    content = [{'player':      _as_dict(scoresheet.gameplayer.player, PLAYER_FIELDS),
+                'total_score': scoresheet.total_score,
+                'commodities': [{'commodity': _as_dict(sfc.commodity, COMMODITY_FIELDS), 'nb_submitted_cards': sfc.nb_submitted_cards,
+                                 'nb_scored_cards': sfc.nb_scored_cards, 'actual_value': sfc.actual_value, 'score': sfc.score}
+                                for sfc in scoresheet.scores_from_commodity],
+                'rules':       [{'public_name': sfr.rulecard.public_name, 'detail': sfr.detail, 'score': sfr.score}
+                                for sfr in scoresheet.scores_from_rule],
+                'known_rules': known_rules.get(scoresheet.gameplayer.player_id, [])}
+               for scoresheet in scoresheets]
+    Scoreboard.objects.filter(game = game).delete() # if the closing of the game has been reverted by an admin
+    return Scoreboard.objects.create(game = game, content = json.dumps(content, separators = (',', ':')))
+
+def load_scoreboard(game):
+    """ The scoresheets of a closed game, sorted by rank, read from its frozen scoreboard, which is created on the fly if needed """
+    try:
+        scoreboard = Scoreboard.objects.get(game = game)
+    except Scoreboard.DoesNotExist:
+        try:
+            with transaction.atomic():
+                scoreboard = Scoreboard.objects.create(game = game, content = json.dumps(_scoreboard_from_persisted_scores(game), separators = (',', ':')))
+        except IntegrityError: # frozen meanwhile by a concurrent request
+            scoreboard = Scoreboard.objects.get(game = game)
+    return [FrozenScoresheet(game, data) for data in json.loads(scoreboard.content)]
+
+def _scoreboard_from_persisted_scores(game):
+    """ The content of the scoreboard of a game closed before the scoreboards existed, from the ScoreFromCommodity and ScoreFromRule
+         saved at the time, in a fixed number of queries """
+    content = [{'player': player, 'total_score': 0, 'commodities': [], 'rules': [], 'known_rules': []}
+               for player in get_user_model().objects.filter(gameplayer__game = game).order_by('gameplayer__id').values(*PLAYER_FIELDS)]
+    scoresheets = dict((scoresheet['player']['id'], scoresheet) for scoresheet in content)
+
+    for sfc in (ScoreFromCommodity.objects.filter(game = game).order_by('commodity')
+                                          .values('player', 'nb_submitted_cards', 'nb_scored_cards', 'actual_value', 'score',
+                                                  *['commodity__' + field for field in COMMODITY_FIELDS])):
+        scoresheet = scoresheets[sfc.pop('player')]
+        scoresheet['total_score'] += sfc['score']
+        sfc['commodity'] = dict((field, sfc.pop('commodity__' + field)) for field in COMMODITY_FIELDS)
+        scoresheet['commodities'].append(sfc)
+
+    for sfr in (ScoreFromRule.objects.filter(game = game).order_by('rulecard__step', 'rulecard__public_name')
+                                     .values('player', 'rulecard__public_name', 'detail', 'score')):
+        scoresheet = scoresheets[sfr['player']]
+        scoresheet['total_score'] += sfr['score'] or 0
+        scoresheet['rules'].append({'public_name': sfr['rulecard__public_name'], 'detail': sfr['detail'], 'score': sfr['score']})
+
+    for player_id, rules in _known_rules_per_player(game).iteritems():
+        scoresheets[player_id]['known_rules'] = rules
+
+    content.sort(key = lambda scoresheet: scoresheet['total_score'], reverse = True)
+    return content
+
+def _known_rules_per_player(game):
+    """ The rules known by each player, i.e. that they have ever had in hand, without duplicates and by ref_name, in a single query
+         (the values, so that no RuleCard is instantiated, see ruleset.models.bind_the_resolution_method_to_the_rulecard) """
+    known_rules, last_ref_names = {}, {}
+    for player_id, ref_name, public_name, description in (RuleInHand.objects.filter(game = game).order_by('player', 'rulecard__ref_name')
+                                                           .values_list('player', 'rulecard__ref_name', 'rulecard__public_name', 'rulecard__description')):
+        if last_ref_names.get(player_id) != ref_name:
+            known_rules.setdefault(player_id, []).append({'public_name': public_name, 'description': description})
+            last_ref_names[player_id] = ref_name
+    return known_rules
+
+def _as_dict(instance, fields):
+    return dict((field, getattr(instance, field)) for field in fields)
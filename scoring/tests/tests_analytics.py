@@ -0,0 +1,74 @@
+import numpy
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils.timezone import now
+from model_mommy import mommy
+from game.models import Game, GamePlayer
+from ruleset.models import Commodity, RuleCard, Ruleset
+from scoring.analytics import compute_analytics
+from scoring.models import RuleCardAnalytics, ScoreFromCommodity, ScoreFromRule
+
+class RuleCardAnalyticsTest(TestCase):
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        ruleset = Ruleset.objects.get(id = 1)
+        self.r1, self.r2 = RuleCard.objects.filter(ruleset = ruleset).order_by('id')[:2]
+        self.p1, self.p2, self.p3 = [mommy.make(get_user_model()) for _i in range(3)]
+
+        # game A: p1 20, p2 5, p3 5 => ranks 0, 0.5, 0.5
+        game_a = self._game(ruleset, [self.r1, self.r2], {self.p1: 10, self.p2: 5, self.p3: 5})
+        mommy.make(ScoreFromRule, game = game_a, player = self.p1, rulecard = self.r1, score = 10)
+        mommy.make(ScoreFromRule, game = game_a, player = self.p3, rulecard = self.r1, score = None) # a line without score is a hit
+        # game B: p1 3, p2 12 => ranks 1, 0
+        game_b = self._game(ruleset, [self.r1], {self.p1: 3, self.p2: 8})
+        mommy.make(ScoreFromRule, game = game_b, player = self.p2, rulecard = self.r1, score = 4)
+        # a game in progress is left out
+        game_c = self._game(ruleset, [self.r1, self.r2], {self.p1: 1, self.p2: 1}, closing_date = None)
+        mommy.make(ScoreFromRule, game = game_c, player = self.p1, rulecard = self.r2, score = 100)
+
+    def test_compute_analytics(self):
+        self.assertEqual(2, compute_analytics())
+
+        analytics = RuleCardAnalytics.objects.get(rulecard = self.r1)
+        self.assertEqual((2, 5, 3), (analytics.nb_games, analytics.nb_scoresheets, analytics.nb_hits))
+        self.assertAlmostEqual(0.6, analytics.hit_rate)
+        self.assertAlmostEqual(14.0 / 3, analytics.mean_score)
+        self.assertAlmostEqual(numpy.corrcoef([10, 0, 0, 0, 4], [0, 0.5, 0.5, 1, 0])[0, 1], analytics.rank_correlation)
+
+        analytics = RuleCardAnalytics.objects.get(rulecard = self.r2)
+        self.assertEqual((1, 3, 0), (analytics.nb_games, analytics.nb_scoresheets, analytics.nb_hits))
+        self.assertEqual(0, analytics.hit_rate)
+        self.assertIsNone(analytics.mean_score)
+        self.assertIsNone(analytics.rank_correlation)
+
+        self.assertEqual(2, compute_analytics()) # the former analytics are replaced
+        self.assertEqual(2, RuleCardAnalytics.objects.count())
+
+    def test_compute_analytics_without_closed_games(self):
+        Game.objects.update(closing_date = None)
+        self.assertEqual(0, compute_analytics())
+        self.assertFalse(RuleCardAnalytics.objects.exists())
+
+    def test_the_admin_site_reads_the_analytics(self):
+        compute_analytics()
+        admin = mommy.make(get_user_model(), username = 'admin_analytics', is_staff = True, is_superuser = True)
+        admin.set_password('pwd')
+        admin.save()
+        self.client.login(username = 'admin_analytics', password = 'pwd')
+
+        response = self.client.get(reverse('admin:scoring_rulecardanalytics_changelist'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{'name': self.r1.ruleset.name, 'nb_rulecards': 2, 'hit_rate_percent': 37.5,
+                           'computation_date': RuleCardAnalytics.objects.get(rulecard = self.r1).computation_date}], response.context['summary'])
+        self.assertContains(response, self.r1.ref_name)
+
+    def _game(self, ruleset, rules, commodity_scores, closing_date = now()):
+        game = mommy.make(Game, ruleset = ruleset, end_date = now(), closing_date = closing_date)
+        game.rules.add(*rules)
+        commodity = Commodity.objects.filter(ruleset = ruleset)[0]
+        for player, score in commodity_scores.iteritems():
+            mommy.make(GamePlayer, game = game, player = player)
+            mommy.make(ScoreFromCommodity, game = game, player = player, commodity = commodity, score = score)
+        return game
@@ -1,9 +1,13 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.test import TestCase
+from django.test.utils import override_settings
 from model_mommy import mommy
 from game.models import Game, GamePlayer, CommodityInHand
 from ruleset.models import RuleCard, Ruleset
+from scoring import card_scoring
 from scoring.card_scoring import tally_scores, Scoresheet
+from scoring.models import RuleScoringProfile
 from scoring.tests.commons import _prepare_hand, _prepare_scoresheet
 
 class ScoringTest(TestCase):
@@ -62,6 +66,53 @@ class ScoringTest(TestCase):
         self.assertListEqual(['HAG10', 'HAG10', 'HAG13', 'HAG13', 'HAG08'], [sfr.rulecard.ref_name for sfr in scoresheets[0].scores_from_rule])
         self.assertListEqual([10,      10,      5,       5,       16     ], [sfr.score for sfr in scoresheets[0].scores_from_rule])
 
+    @override_settings(SCORING_RULES_PROFILING = True)
+    def test_tally_scores_records_the_profile_of_each_rule(self):
+        for rule in RuleCard.objects.filter(ruleset__id = 1, public_name__in = ['4', '8', '10', '12', '13']):
+            self.game.rules.add(rule)
+        _prepare_hand(self.game, player = "p1", yellow = 4, blue = 2, red = 2, orange = 3, white = 2)
+        _prepare_hand(self.game, player = "p2", yellow = 2, blue = 5, white = 5)
+
+        scoresheets = tally_scores(self.game)
+        tally_scores(self.game)
+
+        profiles = RuleScoringProfile.objects.filter(game = self.game)
+        self.assertEqual(self.game.rules.filter(step__isnull = False).count(), profiles.count())
+        for profile in profiles:
+            self.assertEqual(2, profile.nb_calls)
+            self.assertGreaterEqual(profile.total_duration, 0)
+            nb_lines = len([sfr for scoresheet in scoresheets for sfr in scoresheet.scores_from_rule if sfr.rulecard == profile.rulecard])
+            self.assertEqual(2 * nb_lines, profile.total_lines)
+
+    @override_settings(SCORING_RULES_PROFILING = True)
+    def test_a_profile_created_concurrently_is_updated_without_breaking_the_transaction(self):
+        rule = RuleCard.objects.get(ruleset__id = 1, ref_name = 'HAG10')
+        mommy.make(RuleScoringProfile, game = self.game, rulecard = rule, nb_calls = 1)
+        add_to_rule_profile = card_scoring._add_to_rule_profile
+        calls = []
+        def add_to_rule_profile_after_a_concurrent_creation(*args):
+            calls.append(args)
+            return 0 if len(calls) == 1 else add_to_rule_profile(*args) # the first update misses the row created in between
+        card_scoring._add_to_rule_profile = add_to_rule_profile_after_a_concurrent_creation
+
+        try:
+            with transaction.atomic():
+                card_scoring._record_rule_profile(self.game, rule, 0.5, 3, 2)
+                self.assertEqual(2, RuleScoringProfile.objects.get(game = self.game, rulecard = rule).nb_calls)
+        finally:
+            card_scoring._add_to_rule_profile = add_to_rule_profile
+        self.assertEqual(2, len(calls))
+
+    @override_settings(SCORING_RULES_PROFILING = False)
+    def test_tally_scores_records_no_profile_when_disabled(self):
+        for rule in RuleCard.objects.filter(ruleset__id = 1):
+            self.game.rules.add(rule)
+        _prepare_hand(self.game, player = "p1", yellow = 4, blue = 2, red = 2, orange = 3, white = 2)
+
+        tally_scores(self.game)
+
+        self.assertEqual(0, RuleScoringProfile.objects.count())
+
     def test_calculate_commodity_scores(self):
         player = mommy.make(get_user_model(), username = 'test')
         mommy.make(CommodityInHand, game = self.game, player = player, commodity__name = 'Blue', commodity__value = 2,
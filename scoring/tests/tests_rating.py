@@ -0,0 +1,101 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+from model_mommy import mommy
+from game.models import Game, GamePlayer
+from ruleset.models import Ruleset
+from scoring.models import PlayerRating, RatingChange
+from scoring import rating
+from scoring.rating import _rated_players, leaderboard, rate_game, rating_and_rank, rating_history, rebuild_ratings
+from scoring.scoreboard import freeze_scoreboard
+
+class FinalScore(object):
+    def __init__(self, game, player, total_score):
+        self.gameplayer = GamePlayer(game = game, player = player)
+        self.total_score = total_score
+        self.scores_from_commodity, self.scores_from_rule = [], []
+
+@override_settings(RATING_INITIAL = 1500, RATING_K_FACTOR = 32)
+class PlayerRatingTest(TestCase):
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        self.p1, self.p2, self.p3 = [mommy.make(get_user_model()) for _i in range(3)]
+
+    def test_rate_game_matches_each_player_against_the_others(self):
+        game = self._game()
+        self.assertTrue(rate_game(game, self._scores(game, {self.p1: 30, self.p2: 20, self.p3: 20})))
+
+        # all at 1500: the expected result of each match is 0.5, and K = 32 / 2 opponents
+        self.assertEqual([(self.p1, 1516.0, 1), (self.p2, 1492.0, 2), (self.p3, 1492.0, 2)],
+                         [(rating.player, rating.rating, rating_and_rank(rating.player)[1]) for rating in leaderboard(10)])
+        self.assertEqual([(1, 3, 1500.0, 1516.0, game.closing_date)],
+                         [(change.rank, change.nb_players, change.rating_before, change.rating_after, change.date) for change in rating_history(self.p1, 10)])
+
+        self.assertFalse(rate_game(game, self._scores(game, {self.p1: 0, self.p2: 20, self.p3: 20}))) # already rated
+        self.assertEqual(1516.0, PlayerRating.objects.get(player = self.p1).rating)
+
+    def test_only_the_players_of_the_game_are_updated(self):
+        game1 = self._game()
+        rate_game(game1, self._scores(game1, {self.p1: 10, self.p2: 0}))
+        game2 = self._game()
+        scoresheets = self._scores(game2, {self.p1: 0, self.p3: 10})
+
+        # already rated?, the players rated, insert of p3 in a savepoint, locked ratings, update of p1 and p3, insert of the changes
+        with self.assertNumQueries(9):
+            rate_game(game2, scoresheets)
+
+        p1 = PlayerRating.objects.get(player = self.p1)
+        self.assertEqual(2, p1.nb_games)
+        self.assertAlmostEqual(1516 - 32 * (1 / (1 + 10 ** (-16 / 400.0))), p1.rating)
+        self.assertEqual(1484.0, PlayerRating.objects.get(player = self.p2).rating)
+        self.assertEqual((None, None), rating_and_rank(mommy.make(get_user_model())))
+
+    def test_a_rating_created_by_a_game_closed_at_the_same_time_does_not_break_the_closing(self):
+        game1 = self._game()
+        rate_game(game1, self._scores(game1, {self.p1: 10, self.p2: 0}))
+        game2 = self._game()
+        scoresheets = self._scores(game2, {self.p1: 0, self.p3: 10})
+
+        try:
+            rating._rated_players = lambda player_ids: [] # p1 was rated by the other game since the lookup
+            with transaction.atomic(): # like in close_game
+                self.assertTrue(rate_game(game2, scoresheets))
+        finally:
+            rating._rated_players = _rated_players
+
+        self.assertEqual([(self.p1.id, 2), (self.p2.id, 1), (self.p3.id, 1)],
+                         list(PlayerRating.objects.order_by('player').values_list('player', 'nb_games')))
+        self.assertAlmostEqual(1516 - 32 * (1 / (1 + 10 ** (-16 / 400.0))), PlayerRating.objects.get(player = self.p1).rating)
+
+    def test_a_game_without_opponents_is_not_rated(self):
+        game = self._game()
+        self.assertFalse(rate_game(game, self._scores(game, {self.p1: 10})))
+        self.assertFalse(PlayerRating.objects.exists())
+
+    def test_rebuild_ratings_from_the_scoreboards(self):
+        for scores in [{self.p1: 10, self.p2: 0}, {self.p2: 10, self.p3: 5, self.p1: 0}]:
+            game = self._game()
+            scoresheets = self._scores(game, scores)
+            freeze_scoreboard(game, scoresheets)
+            rate_game(game, scoresheets)
+        self._game(closing_date = None) # in progress
+        ratings = list(PlayerRating.objects.order_by('player').values_list('player', 'rating', 'nb_games'))
+        changes = list(RatingChange.objects.order_by('game', 'player').values_list('game', 'player', 'rank', 'rating_after'))
+
+        PlayerRating.objects.filter(player = self.p1).update(rating = 0)
+        self.assertEqual(2, rebuild_ratings(Game.objects.all()))
+
+        self.assertEqual(ratings, list(PlayerRating.objects.order_by('player').values_list('player', 'rating', 'nb_games')))
+        self.assertEqual(changes, list(RatingChange.objects.order_by('game', 'player').values_list('game', 'player', 'rank', 'rating_after')))
+
+    def _game(self, closing_date = now()):
+        return mommy.make(Game, ruleset = Ruleset.objects.get(id = 1), end_date = now(), closing_date = closing_date)
+
+    def _scores(self, game, scores):
+        for player in scores:
+            mommy.make(GamePlayer, game = game, player = player)
+        return sorted([FinalScore(game, player, total_score) for player, total_score in scores.iteritems()],
+                      key = lambda scoresheet: scoresheet.total_score, reverse = True)
@@ -0,0 +1,86 @@
+import datetime
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils.timezone import now
+from model_mommy import mommy
+from game.ledger import backfill_ledger, record_trade
+from game.models import Game, CommodityInHand
+from ruleset.catalog import ruleset_catalog
+from ruleset.models import RuleCard, Ruleset
+from scoring.card_scoring import tally_scores
+from scoring.replay import replay_scores, scores_at
+from scoring.tests.commons import _prepare_hand
+from trade.models import Offer, Trade, TradedCommodities
+
+class ScoreReplayTest(TestCase):
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        self.game = mommy.make(Game, ruleset = Ruleset.objects.get(id = 1), start_date = now() - datetime.timedelta(days = 2),
+                               end_date = now() + datetime.timedelta(days = 1))
+        _prepare_hand(self.game, player = "p1", yellow = 4, blue = 2, red = 2, orange = 3, white = 2)
+        _prepare_hand(self.game, player = "p2", yellow = 2, blue = 5, white = 5)
+        _prepare_hand(self.game, player = "p3", yellow = 1, blue = 1, red = 1, orange = 7)
+        self.p1, self.p2, self.p3 = [get_user_model().objects.get(username = username) for username in ['p1', 'p2', 'p3']]
+        backfill_ledger(self.game) # the hands above are the deal
+
+    def test_the_scores_are_replayed_after_each_trade(self):
+        self._add_rules('4', '8', '10', '12', '13') # global rules included
+        scores_after_the_deal = self._totals(tally_scores(self.game))
+        trade1 = self._accept_trade(self.p1, 'Orange', self.p2, 'Blue', days_ago = 1)
+        scores_after_trade1 = self._totals(tally_scores(self.game))
+        trade2 = self._accept_trade(self.p3, 'Orange', self.p1, 'Yellow', days_ago = 0)
+
+        replay = list(replay_scores(self.game))
+
+        self.assertEqual([(trade1.closing_date, trade1.id), (trade2.closing_date, trade2.id)], [(date, trade_id) for date, trade_id, _scoresheets in replay])
+        self.assertEqual(scores_after_trade1, self._totals(replay[0][2]))
+        self.assertEqual(self._totals(tally_scores(self.game)), self._totals(replay[1][2]))
+        self.assertNotEqual(scores_after_the_deal, self._totals(replay[0][2]))
+        self.assertEqual(scores_after_the_deal, self._totals(scores_at(self.game, trade1.closing_date - datetime.timedelta(hours = 1))))
+        self.assertEqual(scores_after_trade1, self._totals(scores_at(self.game, trade2.closing_date - datetime.timedelta(hours = 1))))
+
+    def test_incremental_replay_in_a_fixed_number_of_queries(self):
+        self._add_rules('4', '10', '13') # only rules on a single hand: a player is scored again only when their hand changes
+        for days_ago in range(5, 0, -1):
+            self._accept_trade(self.p1, 'Yellow', self.p2, 'White', days_ago = days_ago)
+            self._accept_trade(self.p2, 'Yellow', self.p1, 'White', days_ago = days_ago - 0.5)
+        ruleset_catalog(1)
+
+        with self.assertNumQueries(3): # the players, the rules, the ledger
+            replay = list(replay_scores(self.game))
+
+        self.assertEqual(10, len(replay))
+        self.assertEqual(self._totals(tally_scores(self.game)), self._totals(replay[-1][2]))
+
+    def test_the_scores_of_a_submitted_hand_are_those_of_the_submitted_cards(self):
+        self._add_rules('10')
+        gameplayer = self.p1.gameplayer_set.get(game = self.game)
+        gameplayer.submit_date = now() - datetime.timedelta(hours = 1)
+        gameplayer.save()
+        CommodityInHand.objects.filter(game = self.game, player = self.p1, commodity__name = 'White').update(nb_submitted_cards = 0)
+        self.game.cardmovement_set.all().delete()
+        backfill_ledger(self.game)
+
+        self.assertEqual(self._totals(tally_scores(self.game)), self._totals(scores_at(self.game, now())))
+        self.assertNotEqual(self._totals(tally_scores(self.game)), self._totals(scores_at(self.game, now() - datetime.timedelta(hours = 2))))
+
+    def _add_rules(self, *public_names):
+        for rule in RuleCard.objects.filter(ruleset__id = 1, public_name__in = public_names):
+            self.game.rules.add(rule)
+
+    def _accept_trade(self, initiator, initiator_commodity, responder, responder_commodity, days_ago):
+        """ A card of a commodity given by each player, accepted days_ago days ago """
+        offers = []
+        for player, name in [(initiator, initiator_commodity), (responder, responder_commodity)]:
+            offer = mommy.make(Offer)
+            mommy.make(TradedCommodities, offer = offer, nb_traded_cards = 1,
+                       commodityinhand = CommodityInHand.objects.get(game = self.game, player = player, commodity__name = name))
+            offers.append(offer)
+        trade = mommy.make(Trade, game = self.game, initiator = initiator, responder = responder, status = 'ACCEPTED', finalizer = initiator,
+                           initiator_offer = offers[0], responder_offer = offers[1], closing_date = now() - datetime.timedelta(days = days_ago))
+        record_trade(trade)
+        return trade
+
+    def _totals(self, scoresheets):
+        return dict((scoresheet.gameplayer.player_id, scoresheet.total_score) for scoresheet in scoresheets)
@@ -0,0 +1,62 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from model_mommy import mommy
+from game.models import Game, RuleInHand
+from ruleset.models import RuleCard, Ruleset
+from scoring.card_scoring import tally_scores
+from scoring.models import Scoreboard
+from scoring.scoreboard import freeze_scoreboard, load_scoreboard
+from scoring.tests.commons import _prepare_hand
+
+class ScoreboardTest(TestCase):
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        self.game = mommy.make(Game, ruleset = Ruleset.objects.get(id = 1))
+        for rule in RuleCard.objects.filter(ruleset__id = 1, public_name__in = ['4', '8', '10', '12', '13']):
+            self.game.rules.add(rule)
+        _prepare_hand(self.game, player = "p1", yellow = 4, blue = 2, red = 2, orange = 3, white = 2)
+        _prepare_hand(self.game, player = "p2", yellow = 2, blue = 5, white = 5)
+        _prepare_hand(self.game, player = "p3", yellow = 1, blue = 1, red = 1, orange = 7)
+        self.p1 = get_user_model().objects.get(username = 'p1')
+        mommy.make(RuleInHand, game = self.game, player = self.p1, rulecard = RuleCard.objects.get(ref_name = 'HAG10'))
+        mommy.make(RuleInHand, game = self.game, player = self.p1, rulecard = RuleCard.objects.get(ref_name = 'HAG08'))
+        mommy.make(RuleInHand, game = self.game, player = self.p1, rulecard = RuleCard.objects.get(ref_name = 'HAG10')) # got it back
+
+        self.scoresheets = tally_scores(self.game)
+        for scoresheet in self.scoresheets:
+            scoresheet.persist()
+        self.scoresheets.sort(key = lambda scoresheet: scoresheet.total_score, reverse = True)
+
+    def test_freeze_and_load_scoreboard(self):
+        freeze_scoreboard(self.game, self.scoresheets)
+
+        with self.assertNumQueries(1):
+            scoreboard = load_scoreboard(self.game)
+
+        self.assertEqual([scoresheet.gameplayer.player for scoresheet in self.scoresheets], [scoresheet.gameplayer.player for scoresheet in scoreboard])
+        self.assertEqual([88, 34, 12], [scoresheet.total_score for scoresheet in scoreboard])
+        self.assertEqual(['p1', 'p3', 'p2'], [scoresheet.player_name for scoresheet in scoreboard])
+        self.assertEqual([(sfc.commodity.name, sfc.nb_submitted_cards, sfc.nb_scored_cards, sfc.actual_value, sfc.score)
+                          for sfc in self.scoresheets[0].scores_from_commodity],
+                         [(sfc.commodity.name, sfc.nb_submitted_cards, sfc.nb_scored_cards, sfc.actual_value, sfc.score)
+                          for sfc in scoreboard[0].scores_from_commodity])
+        self.assertEqual([(sfr.rulecard.public_name, sfr.detail, sfr.score) for sfr in self.scoresheets[0].scores_from_rule],
+                         [(sfr.rulecard.public_name, sfr.detail, sfr.score) for sfr in scoreboard[0].scores_from_rule])
+        self.assertEqual(['8', '10'], [rih.rulecard.public_name for rih in scoreboard[0].known_rules])
+        self.assertEqual([], scoreboard[1].known_rules)
+
+    def test_scoreboard_frozen_on_the_fly_from_the_persisted_scores(self):
+        self.assertEqual(0, Scoreboard.objects.count())
+
+        scoreboard = load_scoreboard(self.game)
+
+        self.assertEqual(1, Scoreboard.objects.filter(game = self.game).count())
+        self.assertEqual(['p1', 'p3', 'p2'], [scoresheet.player_name for scoresheet in scoreboard])
+        self.assertEqual([88, 34, 12], [scoresheet.total_score for scoresheet in scoreboard])
+        self.assertItemsEqual([(sfr.rulecard.public_name, sfr.detail, sfr.score) for sfr in self.scoresheets[0].scores_from_rule],
+                              [(sfr.rulecard.public_name, sfr.detail, sfr.score) for sfr in scoreboard[0].scores_from_rule])
+        self.assertEqual(['8', '10'], [rih.rulecard.public_name for rih in scoreboard[0].known_rules])
+
+        with self.assertNumQueries(1):
+            self.assertEqual([88, 34, 12], [scoresheet.total_score for scoresheet in load_scoreboard(self.game)])
@@ -1,8 +1,16 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
+from django.db.models.query import QuerySet
 from django.utils.timezone import now
 from game.models import Game, RuleInHand, CommodityInHand
 from mystrade import settings
 
+class TradeManager(models.Manager):
+    def get_queryset(self):
+        return TradeQuerySet(self.model, using=self._db)
+
+    def with_offers(self):
+        return self.get_queryset().with_offers()
 
 class Trade(models.Model):
     """
@@ -36,26 +44,50 @@ class Trade(models.Model):
     creation_date = models.DateTimeField(default = now)
     closing_date = models.DateTimeField(null = True)
 
-    def abort(self, whodunit, closing_date):
-        if whodunit == self.initiator:
-            if self.status == 'INITIATED':
-                self.status = 'CANCELLED'
-            elif self.status == 'REPLIED':
-                self.status = 'DECLINED'
-        elif whodunit == self.responder:
-            if self.status == 'INITIATED':
-                self.status = 'DECLINED'
-            elif self.status == 'REPLIED':
-                self.status = 'CANCELLED'
-        else:
-            self.status = 'CANCELLED' # when the game is closed by the game master or an admin
-        self.finalizer = whodunit
-        self.closing_date = closing_date
-        self.save()
+    objects = TradeManager()
+
+    class Meta:
+        index_together = [('game', 'status')] # the pending trades to abort, the accepted trades of the events and the scoring
+
+    def transition(self, from_status, to_status, **fields):
+        """ Move the trade from from_status to to_status, with a single UPDATE ... WHERE id = ? AND status = ? that only writes
+             the status and the given fields. Returns False, and changes nothing, if the trade was not (anymore) in from_status,
+             typically because a concurrent request has moved it first: only one of two concurrent transitions can win.
+            The version of the game is bumped by a winning transition. """
+        fields['status'] = to_status
+        with transaction.atomic():
+            if Trade.objects.filter(id = self.id, status = from_status).update(**fields) == 0:
+                return False
+            Game.bump_version(self.game_id)
+        for name, value in fields.iteritems():
+            setattr(self, name, value)
+        return True
 
     def is_pending(self):
         return self.status == 'INITIATED' or self.status == 'REPLIED'
 
+class TradeQuerySet(QuerySet):
+    def abort(self, whodunit, closing_date):
+        """ Move all the pending trades of the queryset to their final status, as if whodunit had aborted each of them:
+             - for the initiator, an INITIATED trade is CANCELLED and a REPLIED one DECLINED,
+             - for the responder, an INITIATED trade is DECLINED and a REPLIED one CANCELLED,
+             - when the game is closed by the game master or an admin, they are all CANCELLED.
+            Two conditional UPDATEs whatever the number of trades; returns the number of trades aborted. """
+        pending = self.filter(status__in = ['INITIATED', 'REPLIED'])
+        by_initiator, by_responder = Q(initiator = whodunit), ~Q(initiator = whodunit) & Q(responder = whodunit)
+        by_a_third_party = ~Q(initiator = whodunit) & ~Q(responder = whodunit)
+        nb_cancelled = pending.filter((by_initiator & Q(status = 'INITIATED')) | (by_responder & Q(status = 'REPLIED')) | by_a_third_party)\
+                              .update(status = 'CANCELLED', finalizer = whodunit, closing_date = closing_date)
+        nb_declined = pending.filter((by_initiator & Q(status = 'REPLIED')) | (by_responder & Q(status = 'INITIATED')))\
+                             .update(status = 'DECLINED', finalizer = whodunit, closing_date = closing_date)
+        return nb_cancelled + nb_declined
+
+    def with_offers(self):
+        """ Load the game, the players and both offers with their cards along with the trades, in a fixed number of queries """
+        offer_cards = ['tradedcommodities_set__commodityinhand__commodity', 'rules__rulecard']
+        return self.select_related('game', 'initiator', 'responder', 'finalizer', 'initiator_offer', 'responder_offer')\
+                   .prefetch_related(*["{0}__{1}".format(offer, cards) for offer in ['initiator_offer', 'responder_offer'] for cards in offer_cards])
+
 class Offer(models.Model):
     rules = models.ManyToManyField(RuleInHand)
     commodities = models.ManyToManyField(CommodityInHand, through = 'TradedCommodities')
@@ -65,19 +97,38 @@ class Offer(models.Model):
 
     creation_date = models.DateTimeField(default = now)
 
+    # offers never change once created: their number of cards is stored along with them (see set_card_counts()),
+    #  and only computed on the fly for the offers created without it
+    nb_rulecards = models.PositiveSmallIntegerField(null = True)
+    nb_commodity_cards = models.PositiveSmallIntegerField(null = True)
+
+    def set_card_counts(self, selected_commodities, selected_rules):
+        """ selected_commodities: {commodityinhand: nb_traded_cards}, selected_rules: list of ruleinhand, as in the offer form """
+        self.nb_rulecards = len(selected_rules)
+        self.nb_commodity_cards = sum(nb_traded_cards for nb_traded_cards in selected_commodities.itervalues() if nb_traded_cards > 0)
+
     @property
     def total_traded_cards(self):
-        return len(self.rules.all()) + sum([t.nb_traded_cards for t in self.tradedcommodities_set.all()])
+        if self.nb_rulecards is None or self.nb_commodity_cards is None:
+            return len(self.rules.all()) + sum([t.nb_traded_cards for t in self.tradedcommodities_set.all()])
+        return self.nb_rulecards + self.nb_commodity_cards
 
     @property
     def tradedcommodities(self):
         """ return the traded commodities in the canonical order ; essential in templates, avoids duplication anywhere else """
-        return self.tradedcommodities_set.all().order_by('commodityinhand__commodity__name')
+        if self._is_prefetched('tradedcommodities'): # see TradeQuerySet.with_offers()
+            return sorted(self.tradedcommodities_set.all(), key = lambda tc: tc.commodityinhand.commodity.name)
+        return self.tradedcommodities_set.select_related('commodityinhand__commodity').order_by('commodityinhand__commodity__name')
 
     @property
     def rulecards(self):
         """ return the traded rulecards in the canonical order ; essential in templates, avoids duplication anywhere else """
-        return self.rules.all().order_by('rulecard__ref_name')
+        if self._is_prefetched('rules'):
+            return sorted(self.rules.all(), key = lambda rih: rih.rulecard.ref_name)
+        return self.rules.select_related('rulecard').order_by('rulecard__ref_name')
+
+    def _is_prefetched(self, relation):
+        return relation in getattr(self, '_prefetched_objects_cache', {})
 
 class TradedCommodities(models.Model):
     offer = models.ForeignKey(Offer)
@@ -1,14 +1,19 @@
 import datetime
+import functools
+import threading
 from django.contrib.auth import get_user_model
 from django.core import mail
-from django.test import RequestFactory, Client, TransactionTestCase
+from django.db import connection
+from django.db.models import Q, Sum
+from django.test import RequestFactory, Client, TransactionTestCase, skipUnlessDBFeature
 from django.utils.timezone import now
 from model_mommy import mommy
-from game.models import Game, RuleInHand, CommodityInHand, GamePlayer
+from game.archive import archive_game
+from game.models import Game, RuleInHand, CommodityInHand, GamePlayer, CardMovement
 from ruleset.models import Ruleset, RuleCard, Commodity
 from trade.forms import TradeForm, OfferForm
 from trade.models import Offer, Trade, TradedCommodities
-from trade.views import _prepare_offer_form, _parse_offer_form, FormInvalidException
+from trade.views import _prepare_offer_form, _parse_offer_form, FormInvalidException, TRADE_PAGINATION
 from utils.tests import MystradeTestCase
 
 class CreateTradeViewTest(MystradeTestCase):
@@ -114,6 +119,8 @@ class CreateTradeViewTest(MystradeTestCase):
         self.assertEqual([rule_in_hand], list(trade.initiator_offer.rulecards))
         self.assertEqual([commodity_in_hand], list(trade.initiator_offer.commodities.all()))
         self.assertEqual(1, trade.initiator_offer.tradedcommodities[0].nb_traded_cards)
+        self.assertEqual(1, trade.initiator_offer.nb_rulecards)
+        self.assertEqual(1, trade.initiator_offer.nb_commodity_cards)
 
         # notification email sent
         self.assertEqual(1, len(mail.outbox))
@@ -177,6 +184,69 @@ class ShowTradeViewTest(MystradeTestCase):
         self._assert_in_trade_list(trade_declined, trade_list[3])
         self._assert_in_trade_list(trade_cancelled, trade_list[4])
 
+    def test_trade_list_pagination_by_key(self):
+        right_now = now()
+        statuses = ['ACCEPTED', 'INITIATED', 'DECLINED', 'REPLIED', 'CANCELLED']
+        for index in range(3 * TRADE_PAGINATION):
+            # every two trades share the same creation date, to check the tie-break by id
+            mommy.make(Trade, game = self.game, initiator = self.loginUser, responder = self.alternativeUser, finalizer = self.loginUser,
+                       status = statuses[index % len(statuses)], initiator_offer = mommy.make(Offer), creation_date = right_now - datetime.timedelta(hours = index / 2))
+        expected = sorted(Trade.objects.filter(game = self.game), key = lambda trade: (trade.creation_date, trade.id), reverse = True)
+        expected.sort(key = Trade.is_pending, reverse = True)
+
+        self._assert_trade_list_pages(expected)
+
+    def test_trade_list_pagination_by_key_of_an_archived_game(self):
+        right_now = now()
+        for index in range(3 * TRADE_PAGINATION):
+            mommy.make(Trade, game = self.game, initiator = self.loginUser, responder = self.alternativeUser, finalizer = self.loginUser,
+                       status = 'CANCELLED', initiator_offer = mommy.make(Offer), creation_date = right_now - datetime.timedelta(hours = index / 2))
+        expected = sorted(Trade.objects.filter(game = self.game), key = lambda trade: (trade.creation_date, trade.id), reverse = True)
+        self.game.end_date = self.game.closing_date = right_now - datetime.timedelta(minutes = 1)
+        self.game.save()
+        archive_game(self.game)
+        self.assertFalse(Trade.objects.filter(game = self.game).exists())
+
+        self._assert_trade_list_pages(expected)
+
+    def _assert_trade_list_pages(self, expected):
+        pages = [self._get_trade_list_page()]
+        while pages[-1].has_next:
+            self.assertEqual(TRADE_PAGINATION, len(pages[-1]))
+            pages.append(self._get_trade_list_page(after = pages[-1].next_key()))
+        self.assertEqual(expected, [trade for page in pages for trade in page])
+        self.assertFalse(pages[0].has_previous)
+
+        for page_index in range(len(pages) - 1, 0, -1):
+            self.assertTrue(pages[page_index].has_previous)
+            previous_page = self._get_trade_list_page(before = pages[page_index].previous_key())
+            self.assertEqual(list(pages[page_index - 1]), list(previous_page))
+        self.assertFalse(previous_page.has_previous)
+
+        # an invalid key shows the first page
+        self.assertEqual(list(pages[0]), list(self._get_trade_list_page(after = 'abc')))
+
+    def test_trade_list_is_not_modified_until_the_version_of_the_game_changes(self):
+        trade = mommy.make(Trade, game = self.game, initiator = self.loginUser, responder = self.alternativeUser, status = 'INITIATED',
+                           initiator_offer = mommy.make(Offer))
+        response = self.client.get("/trade/{0}/list/".format(self.game.id), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(200, response.status_code)
+
+        response = self.client.get("/trade/{0}/list/".format(self.game.id), HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                                   HTTP_IF_NONE_MATCH = response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+        trade.transition('INITIATED', 'CANCELLED', finalizer = self.loginUser, closing_date = now())
+        response = self.client.get("/trade/{0}/list/".format(self.game.id), HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+                                   HTTP_IF_NONE_MATCH = response['ETag'])
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, "cancelled by")
+
+    def _get_trade_list_page(self, **params):
+        response = self.client.get("/trade/{0}/list/".format(self.game.id), params, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(200, response.status_code)
+        return response.context['trade_list']
+
     def test_trade_list_content_of_a_line(self):
         rulecard1, rulecard2, rulecard3 = mommy.make(RuleCard, _quantity = 3)
         commodity1, commodity2 = mommy.make(Commodity, _quantity = 2)
@@ -582,6 +652,8 @@ class ModifyTradeViewsTest(MystradeTestCase):
         self.assertEqual([rule_in_hand], list(trade.responder_offer.rules.all()))
         self.assertEqual([commodity_in_hand], list(trade.responder_offer.commodities.all()))
         self.assertEqual(2, trade.responder_offer.tradedcommodities[0].nb_traded_cards)
+        self.assertEqual(1, trade.responder_offer.nb_rulecards)
+        self.assertEqual(2, trade.responder_offer.nb_commodity_cards)
 
         # notification email sent
         self.assertEqual(1, len(mail.outbox))
@@ -702,6 +774,11 @@ class ModifyTradeViewsTest(MystradeTestCase):
         self.assertEqual(1, CommodityInHand.objects.get(game = self.game, player = self.alternativeUser, commodity = commodity2).nb_cards)
         self.assertEqual(0, CommodityInHand.objects.get(game = self.game, player = self.alternativeUser, commodity = commodity3).nb_cards)
 
+        # ledger : each card given by one player and received by the other
+        self.assertEqual(2 * 6, CardMovement.objects.filter(game = self.game, trade = trade, reason = 'TRADE').count())
+        self.assertEqual(-2, CardMovement.objects.get(trade = trade, player = self.loginUser, commodity = commodity1, nb_cards__lt = 0).nb_cards)
+        self.assertEqual(1, CardMovement.objects.get(trade = trade, player = self.loginUser, rulecard = rulecard2).nb_cards)
+
         # notification email sent
         self.assertEqual(1, len(mail.outbox))
         email = mail.outbox[0]
@@ -958,6 +1035,75 @@ class TransactionalViewsTest(TransactionTestCase):
         self.assertEqual(0, CommodityInHand.objects.get(game = self.game, player = self.alternativeUser, commodity = cih.commodity).nb_cards)
         self.assertEqual(0, CommodityInHand.objects.filter(game = self.game, player = self.loginUser).count())
 
+class ConcurrentTradeTransitionsTest(TransactionTestCase):
+    fixtures = ['initial_data.json',
+                'test_users.json', # from profile app
+                'test_games.json']
+
+    NB_ROUNDS = 10
+    NB_THREADS = 8
+
+    def setUp(self):
+        self.game =             Game.objects.get(id = 1)
+        self.loginUser =        get_user_model().objects.get(username = "test2")
+        self.alternativeUser =  get_user_model().objects.get(username = 'test5')
+
+    @skipUnlessDBFeature('test_db_allows_multiple_connections') # not with SQLite's in-memory test database
+    def test_only_one_of_concurrent_transitions_wins(self):
+        for _round in range(self.NB_ROUNDS):
+            trade = mommy.make(Trade, game = self.game, initiator = self.loginUser, responder = self.alternativeUser,
+                               status = 'REPLIED', initiator_offer = mommy.make(Offer), responder_offer = mommy.make(Offer))
+
+            def transition(to_status):
+                return Trade.objects.get(id = trade.id).transition('REPLIED', to_status, closing_date = now())
+            results = self._run_concurrently([functools.partial(transition, ['ACCEPTED', 'CANCELLED'][index % 2]) for index in range(self.NB_THREADS)])
+
+            self.assertEqual(1, results.count(True))
+            self.assertIn(Trade.objects.get(id = trade.id).status, ['ACCEPTED', 'CANCELLED'])
+
+    @skipUnlessDBFeature('test_db_allows_multiple_connections')
+    def test_concurrent_accept_and_cancel_exchange_the_cards_at_most_once(self):
+        commodity = mommy.make(Commodity)
+        cih_initiator = mommy.make(CommodityInHand, game = self.game, player = self.loginUser, commodity = commodity, nb_cards = 100)
+        for _round in range(self.NB_ROUNDS):
+            offer_initiator = mommy.make(Offer)
+            mommy.make(TradedCommodities, offer = offer_initiator, commodityinhand = cih_initiator, nb_traded_cards = 1)
+            trade = mommy.make(Trade, game = self.game, initiator = self.loginUser, responder = self.alternativeUser, status = 'REPLIED',
+                               initiator_offer = offer_initiator, responder_offer = mommy.make(Offer, free_information = 'secret'))
+
+            # the initiator clicks several times on accept, while the responder cancels
+            requests = [lambda: self._post(self.loginUser, "/trade/{0}/{1}/accept/".format(self.game.id, trade.id))] * (self.NB_THREADS - 1)
+            requests.append(lambda: self._post(self.alternativeUser, "/trade/{0}/{1}/cancel/".format(self.game.id, trade.id)))
+            self._run_concurrently(requests)
+
+            self.assertIn(Trade.objects.get(id = trade.id).status, ['ACCEPTED', 'CANCELLED'])
+            nb_accepted = Trade.objects.filter(game = self.game, status = 'ACCEPTED').count()
+            self.assertEqual(100 - nb_accepted, CommodityInHand.objects.get(id = cih_initiator.id).nb_cards)
+            self.assertEqual(nb_accepted, CommodityInHand.objects.filter(game = self.game, player = self.alternativeUser, commodity = commodity)
+                                                         .aggregate(Sum('nb_cards'))['nb_cards__sum'] or 0)
+
+    def _post(self, user, url):
+        client = Client()
+        client.login(username = user.username, password = 'test')
+        return client.post(url, {'finalize_reason': ''}, HTTP_X_REQUESTED_WITH = 'XMLHttpRequest').status_code
+
+    def _run_concurrently(self, functions):
+        """ Run each function in its own thread (thus its own database connection), all starting at the same time """
+        start, results = threading.Event(), [None] * len(functions)
+        def run(index):
+            try:
+                start.wait()
+                results[index] = functions[index]()
+            finally:
+                connection.close()
+        threads = [threading.Thread(target = run, args = (index,)) for index in range(len(functions))]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        return results
+
 class FormsTest(MystradeTestCase):
 
     def test_prepare_offer_form_sets_up_the_correct_cards_excluding_those_in_pending_trades(self):
@@ -1113,17 +1259,70 @@ class TradeModelsTest(MystradeTestCase):
         self.assertFalse(Trade(status = 'DECLINED').is_pending())
         self.assertFalse(Trade(status = 'CANCELLED').is_pending())
 
+    def test_trade_transition(self):
+        trade = mommy.make(Trade, game = self.game, initiator = self.loginUser, responder = self.alternativeUser, status = 'INITIATED',
+                           finalize_reason = 'unchanged')
+        trade.finalize_reason = 'not saved'
+        closing_date = now()
+
+        self.assertFalse(trade.transition('REPLIED', 'ACCEPTED', finalizer = self.loginUser, closing_date = closing_date))
+        self.assertEqual('INITIATED', trade.status)
+        self.assertEqual('INITIATED', Trade.objects.get(id = trade.id).status)
+
+        with self.assertNumQueries(2 + 2): # the UPDATE of the trade and the bump of the game version, in a savepoint
+            self.assertTrue(trade.transition('INITIATED', 'CANCELLED', finalizer = self.loginUser, closing_date = closing_date))
+        self.assertEqual('CANCELLED', trade.status)
+        self.assertEqual(1, Game.objects.get(id = self.game.id).version)
+        trade_db = Trade.objects.get(id = trade.id)
+        self.assertEqual('CANCELLED', trade_db.status)
+        self.assertEqual(self.loginUser, trade_db.finalizer)
+        self.assertEqual(closing_date, trade_db.closing_date)
+        self.assertEqual('unchanged', trade_db.finalize_reason) # only the given fields are written
+
+        self.assertFalse(trade.transition('INITIATED', 'DECLINED')) # already moved
+        self.assertEqual('CANCELLED', Trade.objects.get(id = trade.id).status)
+
     def test_trade_abort(self):
         self._test_trade_abort_for_status_and_finalizer("INITIATED", "CANCELLED", self.loginUser)
         self._test_trade_abort_for_status_and_finalizer("REPLIED", "DECLINED", self.loginUser)
         self._test_trade_abort_for_status_and_finalizer("INITIATED", "DECLINED", self.alternativeUser)
         self._test_trade_abort_for_status_and_finalizer("REPLIED", "CANCELLED", self.alternativeUser)
 
+    def test_trade_abort_in_bulk(self):
+        other_player = get_user_model().objects.get(username = 'test3')
+        def make_trade(initiator, responder, status):
+            return mommy.make(Trade, game = self.game, initiator = initiator, responder = responder, status = status)
+        trades = {make_trade(self.loginUser, self.alternativeUser, 'INITIATED'):  'CANCELLED',
+                  make_trade(self.loginUser, self.alternativeUser, 'REPLIED'):    'DECLINED',
+                  make_trade(self.alternativeUser, self.loginUser, 'INITIATED'):  'DECLINED',
+                  make_trade(self.alternativeUser, self.loginUser, 'REPLIED'):    'CANCELLED',
+                  make_trade(self.alternativeUser, self.loginUser, 'ACCEPTED'):   'ACCEPTED',
+                  make_trade(self.loginUser, self.alternativeUser, 'DECLINED'):   'DECLINED'}
+        untouched = make_trade(self.alternativeUser, other_player, 'INITIATED')
+        closing_date = now()
+
+        with self.assertNumQueries(2):
+            nb_aborted = Trade.objects.filter(Q(initiator = self.loginUser) | Q(responder = self.loginUser), game = self.game).abort(self.loginUser, closing_date)
+
+        self.assertEqual(4, nb_aborted)
+        for trade, expected_status in trades.iteritems():
+            trade_db = Trade.objects.get(id = trade.id)
+            self.assertEqual(expected_status, trade_db.status)
+            if trade.is_pending():
+                self.assertEqual(self.loginUser, trade_db.finalizer)
+                self.assertEqual(closing_date, trade_db.closing_date)
+        self.assertEqual('INITIATED', Trade.objects.get(id = untouched.id).status)
+
+        # by the game master: all the remaining pending trades are cancelled
+        self.assertEqual(1, Trade.objects.filter(game = self.game).abort(self.master, closing_date))
+        self.assertEqual('CANCELLED', Trade.objects.get(id = untouched.id).status)
+        self.assertEqual(self.master, Trade.objects.get(id = untouched.id).finalizer)
+
     def _test_trade_abort_for_status_and_finalizer(self, current_status, expected_status, finalizer):
         closing_date = now()
         trade = mommy.make(Trade, game = self.game, initiator = self.loginUser, responder = self.alternativeUser,
                               status = current_status, finalizer = None, closing_date = None)
-        trade.abort(finalizer, closing_date)
+        self.assertEqual(1, Trade.objects.filter(id = trade.id).abort(finalizer, closing_date))
         try:
             trade_db = Trade.objects.get(pk = trade.id)
             self.assertEqual(expected_status, trade_db.status)
@@ -1131,3 +1330,36 @@ class TradeModelsTest(MystradeTestCase):
             self.assertEqual(closing_date, trade_db.closing_date)
         except Trade.DoesNotExist:
             self.fail("Trade should have been saved")
+
+    def test_offer_total_traded_cards(self):
+        offer = mommy.make(Offer, rules = [mommy.make(RuleInHand)])
+        mommy.make(TradedCommodities, offer = offer, nb_traded_cards = 2)
+        mommy.make(TradedCommodities, offer = offer, nb_traded_cards = 1)
+        self.assertEqual(4, offer.total_traded_cards) # computed from the cards
+
+        offer.set_card_counts({mommy.make(CommodityInHand): 3, mommy.make(CommodityInHand): 0}, [mommy.make(RuleInHand)] * 2)
+        self.assertEqual(2, offer.nb_rulecards)
+        self.assertEqual(3, offer.nb_commodity_cards)
+        with self.assertNumQueries(0):
+            self.assertEqual(5, offer.total_traded_cards) # stored
+
+    def test_offer_cards_in_canonical_order_with_or_without_prefetching(self):
+        rih_b = mommy.make(RuleInHand, game = self.game, player = self.loginUser, rulecard = mommy.make(RuleCard, ref_name = 'B'))
+        rih_a = mommy.make(RuleInHand, game = self.game, player = self.loginUser, rulecard = mommy.make(RuleCard, ref_name = 'A'))
+        offer = mommy.make(Offer, rules = [rih_b, rih_a])
+        tc_yellow = mommy.make(TradedCommodities, offer = offer, nb_traded_cards = 1,
+                               commodityinhand = mommy.make(CommodityInHand, commodity = mommy.make(Commodity, name = 'Yellow')))
+        tc_blue = mommy.make(TradedCommodities, offer = offer, nb_traded_cards = 1,
+                             commodityinhand = mommy.make(CommodityInHand, commodity = mommy.make(Commodity, name = 'Blue')))
+        trade = mommy.make(Trade, game = self.game, initiator = self.loginUser, responder = self.alternativeUser, initiator_offer = offer)
+
+        self.assertEqual([rih_a, rih_b], list(Offer.objects.get(id = offer.id).rulecards))
+        self.assertEqual([tc_blue, tc_yellow], list(Offer.objects.get(id = offer.id).tradedcommodities))
+
+        trade = Trade.objects.with_offers().get(id = trade.id)
+        with self.assertNumQueries(0):
+            self.assertEqual([rih_a, rih_b], list(trade.initiator_offer.rulecards))
+            self.assertEqual(['A', 'B'], [rih.rulecard.ref_name for rih in trade.initiator_offer.rulecards])
+            self.assertEqual(['Blue', 'Yellow'], [tc.commodityinhand.commodity.name for tc in trade.initiator_offer.tradedcommodities])
+            self.assertEqual(self.loginUser, trade.initiator)
+            self.assertIsNone(trade.responder_offer)
@@ -1,16 +1,21 @@
+import datetime
 import logging
 import bleach
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied, NON_FIELD_ERRORS
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.core.urlresolvers import reverse
 from django.db import transaction
 from django.db.models import Q
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.shortcuts import get_object_or_404, render
-from django.utils.timezone import now
-from game.helpers import rules_in_hand, commodities_in_hand, _check_game_access_or_PermissionDenied
-from game.models import RuleInHand, CommodityInHand, Game, GamePlayer
+from django.utils.timezone import now, utc
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from game.archive import load_archive
+from game.helpers import rules_in_hand, commodities_in_hand, _check_game_access_or_PermissionDenied, game_etag
+from game.ledger import record_trade
+from game.models import Game, GamePlayer
+from mystrade.routers import read_from_replica
 from trade.forms import FinalizeReasonForm, TradeForm, OfferForm
 from trade.models import Trade, TradedCommodities, Offer
 from utils import utils, stats
@@ -22,43 +27,153 @@ logger = logging.getLogger(__name__)
 #############################################################################
 TRADE_PAGINATION = 8
 
+@read_from_replica
 @login_required
+@cache_control(private = True, max_age = 0, must_revalidate = True)
+@condition(etag_func = game_etag)
 def trade_list(request, game_id):
     game = get_object_or_404(Game, id = game_id)
 
     super_access = _check_game_access_or_PermissionDenied(game, request.user)
 
     if request.is_ajax():
-        # the players can only see their own trades, whereas the game master can see all trades
-        trade_list = Trade.objects.filter(game = game).order_by('-creation_date')
-        if not super_access:
-            trade_list = list(trade_list.filter(Q(initiator = request.user) | Q(responder = request.user)))
-
-            # since sort() is guaranteed to be stable, this second sort will only push pending trades at the start,
-            #   keeping the sorting by (reverse) chronological creation_date otherwise
-            trade_list.sort(key = Trade.is_pending, reverse = True)
-
-        paginator = Paginator(trade_list, TRADE_PAGINATION, orphans = 1)
+        # the players can only see their own trades, pending trades first, whereas the game master can see all trades
+        archive = load_archive(game)
+        if archive:
+            trade_list = [trade for trade in archive.trades() if super_access or request.user.id in (trade.initiator_id, trade.responder_id)]
+            page = ArchivedTradeListPage
+        else:
+            trade_list = Trade.objects.filter(game = game).with_offers()
+            if not super_access:
+                trade_list = trade_list.filter(Q(initiator = request.user) | Q(responder = request.user))
+            page = TradeListPage
 
-        page = request.GET.get('page')
-        try:
-            trades = paginator.page(page)
-        except PageNotAnInteger:
-            trades = paginator.page(1)
-        except EmptyPage:
-            trades = paginator.page(paginator.num_pages) # If page is out of range (e.g. 9999), deliver last page of results.
+        trades = page(trade_list, pending_first = not super_access, after = request.GET.get('after'), before = request.GET.get('before'))
 
         return render(request, 'trade/trade_list.html', {'game': game, 'trade_list': trades})
 
     raise PermissionDenied
 
+class TradeListPage(object):
+    """ One page of TRADE_PAGINATION trades, ordered by (reverse) chronological creation date, optionally with the pending trades first.
+        The ordering and the pagination are done in the database: the page is fetched by comparing with the key of the last trade of
+         the previous page (after) or of the first trade of the next page (before), so that its cost doesn't depend on its position.
+        A key is the string "<pending>_<creation date in microseconds>_<id>", see key().
+    """
+    EPOCH = utc.localize(datetime.datetime(1970, 1, 1))
+
+    def __init__(self, trades, pending_first = True, after = None, before = None):
+        self.pending_first = pending_first
+        trades = self._ordered(trades)
+
+        try:
+            if before:
+                page = self._page(trades, before, after = False)
+                self.trades, self.has_previous, self.has_next = page[-TRADE_PAGINATION:], len(page) > TRADE_PAGINATION, True
+            elif after:
+                page = self._page(trades, after, after = True)
+                self.trades, self.has_previous, self.has_next = page[:TRADE_PAGINATION], True, len(page) > TRADE_PAGINATION
+            else:
+                self.trades = None
+        except (ValueError, OverflowError): # a tampered key
+            self.trades = None
+
+        if not self.trades: # first page, or the trades of the requested page are not there anymore
+            page = self._page(trades)
+            self.trades, self.has_previous, self.has_next = page[:TRADE_PAGINATION], False, len(page) > TRADE_PAGINATION
+
+    def _ordered(self, trades):
+        return trades.extra(select = {'pending': "{0}.status IN ('INITIATED', 'REPLIED')".format(Trade._meta.db_table)})
+
+    def _page(self, trades, key = None, after = True):
+        """ Up to TRADE_PAGINATION + 1 trades after (or before) the trade of this key, or from the start, in the order of the list """
+        ordering = ['-pending', '-creation_date', '-id'] if self.pending_first else ['-creation_date', '-id']
+        if key is None:
+            return list(trades.extra(order_by = ordering)[:TRADE_PAGINATION + 1])
+        elif after:
+            return list(trades.filter(self._after_or_before(key, after = True)).extra(order_by = ordering)[:TRADE_PAGINATION + 1])
+        page = list(trades.filter(self._after_or_before(key, after = False))
+                          .extra(order_by = [field.lstrip('-') for field in ordering])[:TRADE_PAGINATION + 1])
+        page.reverse()
+        return page
+
+    def _after_or_before(self, key, after):
+        """ The trades after (or before) the trade of this key, in the order of the list """
+        pending, creation_date, trade_id = self._parse_key(key)
+        if after:
+            condition = Q(creation_date__lt = creation_date) | Q(creation_date = creation_date, id__lt = trade_id)
+        else:
+            condition = Q(creation_date__gt = creation_date) | Q(creation_date = creation_date, id__gt = trade_id)
+        if self.pending_first:
+            same_pending = Q(status__in = ['INITIATED', 'REPLIED']) if int(pending) else ~Q(status__in = ['INITIATED', 'REPLIED'])
+            if int(pending) == after: # from the pending trades, the finalized trades come after; from the finalized ones, the pending trades come before
+                condition = (same_pending & condition) | ~same_pending
+            else:
+                condition = same_pending & condition
+        return condition
+
+    @classmethod
+    def key(cls, trade):
+        delta = trade.creation_date - cls.EPOCH
+        return "{0:d}_{1}_{2}".format(trade.is_pending(), (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds, trade.id)
+
+    @classmethod
+    def _parse_key(cls, key):
+        pending, creation_date, trade_id = key.split('_')
+        return int(pending), cls.EPOCH + datetime.timedelta(microseconds = int(creation_date)), int(trade_id)
+
+    def __iter__(self):
+        return iter(self.trades)
+
+    def __len__(self):
+        return len(self.trades)
+
+    def __getitem__(self, index):
+        return self.trades[index]
+
+    def has_other_pages(self):
+        return self.has_previous or self.has_next
+
+    def previous_key(self):
+        return self.key(self.trades[0])
+
+    def next_key(self):
+        return self.key(self.trades[-1])
+
+class ArchivedTradeListPage(TradeListPage):
+    """ The same pages, with the same keys, of the trades of an archived game (see game.archive), ordered in memory """
+    def _ordered(self, trades):
+        return sorted(trades, key = self._sort_key, reverse = True)
+
+    def _page(self, trades, key = None, after = True):
+        if key is None:
+            return trades[:TRADE_PAGINATION + 1]
+        pending, creation_date, trade_id = self._parse_key(key)
+        key = (pending if self.pending_first else 0, creation_date, trade_id)
+        if after:
+            return [trade for trade in trades if self._sort_key(trade) < key][:TRADE_PAGINATION + 1]
+        return [trade for trade in trades if self._sort_key(trade) > key][-(TRADE_PAGINATION + 1):]
+
+    def _sort_key(self, trade):
+        return (int(trade.is_pending()) if self.pending_first else 0, trade.creation_date, trade.id)
+
 #############################################################################
 ##                            Show Trade                                   ##
 #############################################################################
 
+@read_from_replica
 @login_required
 def show_trade(request, game_id, trade_id):
-    trade = get_object_or_404(Trade, id = trade_id)
+    try:
+        trade = Trade.objects.with_offers().get(id = trade_id)
+    except Trade.DoesNotExist: # maybe a trade of an archived game
+        archive = load_archive(get_object_or_404(Game, id = game_id))
+        if archive is None:
+            raise Http404
+        try:
+            trade = archive.trade(trade_id)
+        except Trade.DoesNotExist:
+            raise Http404
 
     if trade.game_id != int(game_id):
         raise PermissionDenied
@@ -108,6 +223,7 @@ def create_trade(request, game_id):
                 offer, selected_commodities, selected_rulecards = _parse_offer_form(request, game)
 
                 if trade_form.is_valid():
+                    offer.set_card_counts(selected_commodities, selected_rulecards)
                     offer.save()
                     for cih, nb_traded_cards in selected_commodities.iteritems():
                         if nb_traded_cards > 0:
@@ -117,6 +233,7 @@ def create_trade(request, game_id):
 
                     trade = Trade.objects.create(game = game, initiator = request.user, initiator_offer = offer,
                                                               responder = trade_form.cleaned_data['responder'])
+                    Game.bump_version(game.id)
 
                     # email notification
                     _trade_event_notification(request, trade)
@@ -149,15 +266,12 @@ def cancel_trade(request, game_id, trade_id):
         if (trade.game_id == int(game_id) and trade.game.is_active() and
             ((trade.status == 'INITIATED' and request.user == trade.initiator) or
              (trade.status == 'REPLIED' and request.user == trade.responder))):
-            trade.status = 'CANCELLED'
-            trade.finalizer = request.user
-            trade.closing_date = now()
-            trade.save()
-
-            # email notification                               x
-            _trade_event_notification(request, trade)
+            # a concurrent action on the trade may have changed its status since it has been read
+            if trade.transition(trade.status, 'CANCELLED', finalizer = request.user, closing_date = now()):
+                # email notification                               x
+                _trade_event_notification(request, trade)
 
-            return HttpResponse()
+                return HttpResponse()
 
     raise PermissionDenied
 
@@ -171,16 +285,17 @@ def reply_trade(request, game_id, trade_id):
             try:
                 offer, selected_commodities, selected_rulecards = _parse_offer_form(request, trade.game)
 
-                offer.save()
-                for cih, nb_traded_cards in selected_commodities.iteritems():
-                    if nb_traded_cards > 0:
-                        TradedCommodities.objects.create(offer = offer, commodityinhand = cih, nb_traded_cards = nb_traded_cards)
-                for rih in selected_rulecards:
-                    offer.rules.add(rih)
+                with transaction.atomic(): # the offer is rolled back if the trade has been cancelled in the meantime
+                    offer.set_card_counts(selected_commodities, selected_rulecards)
+                    offer.save()
+                    for cih, nb_traded_cards in selected_commodities.iteritems():
+                        if nb_traded_cards > 0:
+                            TradedCommodities.objects.create(offer = offer, commodityinhand = cih, nb_traded_cards = nb_traded_cards)
+                    for rih in selected_rulecards:
+                        offer.rules.add(rih)
 
-                trade.status = 'REPLIED'
-                trade.responder_offer = offer
-                trade.save()
+                    if not trade.transition('INITIATED', 'REPLIED', responder_offer = offer):
+                        raise PermissionDenied
 
                 # email notification
                 _trade_event_notification(request, trade)
@@ -206,52 +321,13 @@ def accept_trade(request, game_id, trade_id):
                 with transaction.atomic():
                     finalize_reason_form = FinalizeReasonForm(request.POST)
                     if finalize_reason_form.is_valid():
-                        trade.status = 'ACCEPTED'
-                        trade.finalizer = request.user
-                        trade.finalize_reason = bleach.clean(finalize_reason_form.cleaned_data['finalize_reason'], tags = [], strip = True)
-                        trade.closing_date = now()
-                        trade.save()
-
-                        # Exchange rule cards
-                        for rule_from_initiator in trade.initiator_offer.rulecards:
-                            RuleInHand.objects.create(game = trade.game, player = trade.responder, rulecard = rule_from_initiator.rulecard,
-                                                      ownership_date = trade.closing_date, previous_owner = trade.initiator)
-                            rule_from_initiator.abandon_date = trade.closing_date
-                            rule_from_initiator.next_owner = trade.responder
-                            rule_from_initiator.save()
-                        for rule_from_responder in trade.responder_offer.rulecards:
-                            RuleInHand.objects.create(game = trade.game, player = trade.initiator, rulecard = rule_from_responder.rulecard,
-                                                      ownership_date = trade.closing_date, previous_owner = trade.responder)
-                            rule_from_responder.abandon_date = trade.closing_date
-                            rule_from_responder.next_owner = trade.initiator
-                            rule_from_responder.save()
-
-                        # Exchange commodity cards
-                        for tradedcommodity_from_initiator in trade.initiator_offer.tradedcommodities:
-                            cih_from_initiator = tradedcommodity_from_initiator.commodityinhand
-                            try:
-                                cih_for_responder = CommodityInHand.objects.get(game = trade.game, player = trade.responder,
-                                                                                commodity = cih_from_initiator.commodity)
-                            except CommodityInHand.DoesNotExist:
-                                cih_for_responder = CommodityInHand(game = trade.game, player = trade.responder,
-                                                                    commodity = cih_from_initiator.commodity, nb_cards = 0)
-                            cih_for_responder.nb_cards += tradedcommodity_from_initiator.nb_traded_cards
-                            cih_for_responder.save()
-                            cih_from_initiator.nb_cards -= tradedcommodity_from_initiator.nb_traded_cards
-                            cih_from_initiator.save()
-
-                        for tradedcommodity_from_responder in trade.responder_offer.tradedcommodities:
-                            cih_from_responder = tradedcommodity_from_responder.commodityinhand
-                            try:
-                                cih_for_initiator = CommodityInHand.objects.get(game = trade.game, player = trade.initiator,
-                                                                                commodity = cih_from_responder.commodity)
-                            except CommodityInHand.DoesNotExist:
-                                cih_for_initiator = CommodityInHand(game = trade.game, player = trade.initiator,
-                                                                    commodity = cih_from_responder.commodity, nb_cards = 0)
-                            cih_for_initiator.nb_cards += tradedcommodity_from_responder.nb_traded_cards
-                            cih_for_initiator.save()
-                            cih_from_responder.nb_cards -= tradedcommodity_from_responder.nb_traded_cards
-                            cih_from_responder.save()
+                        # the cards are exchanged only by the request that wins the transition: no double accept, no accept after a cancel
+                        if not trade.transition('REPLIED', 'ACCEPTED', finalizer = request.user, closing_date = now(),
+                                                finalize_reason = bleach.clean(finalize_reason_form.cleaned_data['finalize_reason'], tags = [], strip = True)):
+                            raise PermissionDenied
+
+                        # Exchange the cards, in the ledger and in the hands
+                        record_trade(trade)
 
                         # record score stats after each completed trade
                         stats.record(trade.game, trade = trade)
@@ -260,6 +336,8 @@ def accept_trade(request, game_id, trade_id):
                         _trade_event_notification(request, trade)
                     else:
                         raise FormInvalidException({'form': 'finalize_reason_form'})
+            except PermissionDenied:
+                raise
             except BaseException as ex:
                 # if anything crappy happens, rollback the transaction and do nothing else except logging
                 logger.error("Error in accept_trace({0}, {1})".format(game_id, trade_id), exc_info = ex)
@@ -276,13 +354,9 @@ def decline_trade(request, game_id, trade_id):
             ((trade.status == 'INITIATED' and request.user == trade.responder) or
             (trade.status == 'REPLIED' and request.user == trade.initiator))):
             finalize_reason_form = FinalizeReasonForm(request.POST)
-            if finalize_reason_form.is_valid():
-                trade.status = 'DECLINED'
-                trade.finalizer = request.user
-                trade.finalize_reason = bleach.clean(finalize_reason_form.cleaned_data['finalize_reason'], tags = [], strip = True)
-                trade.closing_date = now()
-                trade.save()
-
+            if finalize_reason_form.is_valid() and \
+               trade.transition(trade.status, 'DECLINED', finalizer = request.user, closing_date = now(),
+                                finalize_reason = bleach.clean(finalize_reason_form.cleaned_data['finalize_reason'], tags = [], strip = True)):
                 # email notification
                 _trade_event_notification(request, trade)
 
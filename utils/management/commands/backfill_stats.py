@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from game.models import Game
+from utils.stats import backfill
+
+class Command(BaseCommand):
+    help = ("Replay the scores of the games played before they were recorded at their start, after each trade and at their closing "
+            "(see scoring.replay), from the ledger of their cards, which must have been rebuilt first for the oldest games (see the command backfill_card_ledger).")
+
+    def handle(self, *args, **options):
+        nb_games = 0
+        for game in Game.objects.filter(statsscore__isnull = True, statssnapshot__isnull = True, cardmovement__isnull = False).distinct().order_by('id'):
+            with transaction.atomic():
+                if backfill(game):
+                    nb_games += 1
+                    if int(options['verbosity']) > 1:
+                        self.stdout.write("Scores of game #{0} replayed".format(game.id))
+        self.stdout.write("{0} game{1} replayed".format(nb_games, 's' if nb_games > 1 else ''))
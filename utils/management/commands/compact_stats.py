@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from game.models import Game
+from utils.stats import compact
+
+class Command(BaseCommand):
+    help = ("Pack the scores recorded one row per player (StatsScore) into a single row per snapshot (StatsSnapshot), for the games "
+            "not archived yet, once settings.STATS_STORAGE is 'snapshots'.")
+
+    def handle(self, *args, **options):
+        nb_games = 0
+        for game in Game.objects.filter(gamearchive__isnull = True, statsscore__isnull = False).distinct().order_by('id'):
+            with transaction.atomic():
+                if compact(game):
+                    nb_games += 1
+                    if int(options['verbosity']) > 1:
+                        self.stdout.write("Scores of game #{0} packed".format(game.id))
+        self.stdout.write("{0} game{1} packed".format(nb_games, 's' if nb_games > 1 else ''))
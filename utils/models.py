@@ -14,3 +14,36 @@ class StatsScore(models.Model):
     score = models.IntegerField()
 
     random = models.BooleanField(default = False)
+
+    class Meta:
+        index_together = [('game', 'date_score')] # the evolution of the scores of a game
+
+class StatsSnapshot(models.Model):
+    """ The scores of all the players of a game at a given time in a single row, as recorded by utils.stats.record() when
+         settings.STATS_STORAGE is 'snapshots': the ids of the players, their scores and whether each score is random are packed
+         in the same order, e.g. players '7,12,31', scores '45,-3,60', random '010'. """
+    game = models.ForeignKey(Game)
+    trade = models.ForeignKey(Trade, null = True, related_name = '+') # after which completed trade this snapshot was taken, if not null
+
+    date_score = models.DateTimeField(default = now)
+
+    players = models.TextField()
+    scores = models.TextField()
+    random = models.TextField()
+
+    class Meta:
+        index_together = [('game', 'date_score')] # the evolution of the scores of a game
+
+    @classmethod
+    def pack(cls, rows, **kwargs):
+        """ rows: [(player id, score, random)], in the order of the players """
+        return cls(players = ','.join(str(player_id) for player_id, _score, _random in rows),
+                   scores = ','.join(str(score) for _player_id, score, _random in rows),
+                   random = ''.join('1' if random else '0' for _player_id, _score, random in rows), **kwargs)
+
+    def unpack(self):
+        """ [(player id, score, random)], in the order of the players """
+        if not self.players:
+            return []
+        return zip([int(player_id) for player_id in self.players.split(',')], [int(score) for score in self.scores.split(',')],
+                   [flag == '1' for flag in self.random])
@@ -0,0 +1,139 @@
+"""
+    Sampled profiling of the requests in production, where the debug toolbar is not available.
+
+    A fraction of the requests (settings.REQUEST_PROFILING_RATE) is run under cProfile with the SQL queries recorded, see
+     mystrade.middlewares.SamplingProfilerMiddleware. Each sampled request is written as one JSON line to the logger
+     'mystrade.profiling', which the settings send to a rotating file (settings.REQUEST_PROFILING_LOG). The staff page
+     utils.views.profiling_report reads back those files and aggregates the samples per view.
+"""
+import cProfile
+import glob
+import json
+import logging
+import os
+import pstats
+import re
+import time
+from collections import Counter
+from django.utils.timezone import now
+from utils import QueryCounter
+
+logger = logging.getLogger('mystrade.profiling')
+
+NB_TOP_FUNCTIONS = 15
+NB_TOP_QUERIES = 10
+
+class RequestProfile(object):
+    """ The profile of one request, from start() to stop() """
+    def __init__(self, request):
+        self.path = request.path
+        self.method = request.method
+        self.view_name = None
+        self.profiler = cProfile.Profile()
+        self.query_counter = QueryCounter()
+
+    def start(self):
+        self.start_time = time.time()
+        self.query_counter.__enter__()
+        self.profiler.enable()
+
+    def stop(self, response):
+        """ Stop profiling and return the sample as a dict that can be serialized in JSON """
+        self.profiler.disable()
+        duration = time.time() - self.start_time
+        self.query_counter.__exit__(None, None, None)
+
+        queries = {}
+        for query in self.query_counter.queries:
+            nb_queries, sql_time = queries.get(normalize_sql(query['sql']), (0, 0.0))
+            queries[normalize_sql(query['sql'])] = (nb_queries + 1, sql_time + float(query['time']))
+
+        functions = []
+        for (filename, line, function), (_cc, nb_calls, own_time, cumulative_time, _callers) in pstats.Stats(self.profiler).stats.iteritems():
+            functions.append({'function':      "{0}:{1}({2})".format(_short_filename(filename), line, function),
+                              'calls':         nb_calls,
+                              'own_ms':        1000 * own_time,
+                              'cumulative_ms': 1000 * cumulative_time})
+        functions.sort(key = lambda function: function['own_ms'], reverse = True)
+
+        return {'date':        now().isoformat(),
+                'view':        self.view_name or self.path,
+                'path':        self.path,
+                'method':      self.method,
+                'status':      response.status_code,
+                'duration_ms': 1000 * duration,
+                'nb_queries':  self.query_counter.count,
+                'sql_ms':      1000 * sum(sql_time for _nb, sql_time in queries.itervalues()),
+                'queries':     [{'sql': sql, 'count': nb_queries, 'ms': 1000 * sql_time}
+                                for sql, (nb_queries, sql_time) in sorted(queries.iteritems(), key = lambda query: query[1][1], reverse = True)[:NB_TOP_QUERIES]],
+                'functions':   functions[:NB_TOP_FUNCTIONS]}
+
+def write_profile(sample):
+    logger.info(json.dumps(sample))
+
+def read_profiles(path):
+    """ All the samples found in the log file and its rotated backups (path.1, path.2, ...) """
+    samples = []
+    for filename in [path] + glob.glob(path + '.*'):
+        if not os.path.isfile(filename):
+            continue
+        with open(filename) as fic:
+            for line in fic:
+                try:
+                    samples.append(json.loads(line))
+                except ValueError:
+                    pass # a line truncated by a crash or by a concurrent write
+    return samples
+
+def summarize_profiles(samples):
+    """ Per view: the number of samples, the percentiles of the latency, the average number and duration of the SQL queries,
+         and the queries and functions where the most time is spent on average. The slowest views (at the 90th percentile) first. """
+    samples_per_view = {}
+    for sample in samples:
+        samples_per_view.setdefault(sample['view'], []).append(sample)
+
+    summary = []
+    for view, view_samples in samples_per_view.iteritems():
+        nb_samples = len(view_samples)
+        durations = sorted(sample['duration_ms'] for sample in view_samples)
+
+        query_counts, query_times, function_calls, function_times = Counter(), Counter(), Counter(), Counter()
+        for sample in view_samples:
+            for query in sample['queries']:
+                query_counts[query['sql']] += query['count']
+                query_times[query['sql']] += query['ms']
+            for function in sample['functions']:
+                function_calls[function['function']] += function['calls']
+                function_times[function['function']] += function['own_ms']
+
+        summary.append({'view':        view,
+                        'nb_samples':  nb_samples,
+                        'p50_ms':      percentile(durations, 0.50),
+                        'p90_ms':      percentile(durations, 0.90),
+                        'p99_ms':      percentile(durations, 0.99),
+                        'max_ms':      durations[-1],
+                        'nb_queries':  float(sum(sample['nb_queries'] for sample in view_samples)) / nb_samples,
+                        'sql_ms':      sum(sample['sql_ms'] for sample in view_samples) / nb_samples,
+                        'queries':     [{'sql': sql, 'count': float(query_counts[sql]) / nb_samples, 'ms': sql_time / nb_samples}
+                                        for sql, sql_time in query_times.most_common(NB_TOP_QUERIES)],
+                        'functions':   [{'function': function, 'calls': float(function_calls[function]) / nb_samples, 'own_ms': own_time / nb_samples}
+                                        for function, own_time in function_times.most_common(NB_TOP_FUNCTIONS)]})
+    summary.sort(key = lambda view: view['p90_ms'], reverse = True)
+    return summary
+
+def percentile(sorted_values, fraction):
+    """ Nearest-rank percentile of a non empty sorted list """
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def normalize_sql(sql):
+    """ Queries differing only by their parameters are the same query """
+    match = re.match(r"^QUERY = u?(['\"])(.*)\1 - PARAMS = ", sql) # how the SQLite backend records the queries
+    if match:
+        sql = match.group(2)
+    sql = re.sub(r"'[^']*'", "?", sql)
+    sql = re.sub(r"\b\d+(\.\d+)?\b|%s", "?", sql)
+    return re.sub(r"\(\?(, \?)*\)", "(...)", sql)
+
+def _short_filename(filename):
+    """ The last two components of the path are enough to recognize a module """
+    return os.path.join(*filename.split(os.sep)[-2:]) if os.sep in filename else filename
@@ -1,15 +1,101 @@
+import datetime
+from itertools import chain, groupby
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.utils.timezone import now
+from game.archive import load_archive
 from scoring.card_scoring import tally_scores
-from models import StatsScore
+from scoring.replay import replay_scores
+from models import StatsScore, StatsSnapshot
 
 def record(game, trade = None, scoresheets = None):
+    """ A snapshot of the scores of all the players. The snapshot taken after a trade is skipped if the previous one is more recent than
+         settings.STATS_MIN_INTERVAL seconds: the scores in between can still be replayed (see scoring.replay). """
+    min_interval = getattr(settings, 'STATS_MIN_INTERVAL', 0)
+    if trade and min_interval and _model().objects.filter(game = game, date_score__gt = now() - datetime.timedelta(seconds = min_interval)).exists():
+        return
+
     if not scoresheets:
         scoresheets = tally_scores(game)
 
     # save in db
     date_score = now()
-    for scoresheet in scoresheets:
-        StatsScore.objects.create(game = game, player = scoresheet.gameplayer.player, trade = trade,
-                                  score = scoresheet.total_score, date_score = date_score,
-                                  random = len([sfr for sfr in scoresheet.scores_from_rule
-                                                        if getattr(sfr, 'is_random', False)]) > 0)
\ No newline at end of file
+    if _is_compact():
+        StatsSnapshot.pack(_rows(scoresheets), game = game, trade = trade, date_score = date_score).save()
+    else:
+        for scoresheet in scoresheets:
+            StatsScore.objects.create(game = game, player = scoresheet.gameplayer.player, trade = trade,
+                                      score = scoresheet.total_score, date_score = date_score, random = _is_random(scoresheet))
+
+def backfill(game):
+    """ The snapshots of a game played before the scores were recorded, replayed from the ledger of its cards like those of a live
+         game: at its start, after each accepted trade, and at its closing if it is closed (with the cards submitted), in a single
+         insert. Returns False if the game already has snapshots. """
+    if StatsScore.objects.filter(game = game).exists() or StatsSnapshot.objects.filter(game = game).exists():
+        return False
+    points = chain(replay_scores(game, [game.start_date]), replay_scores(game),
+                   replay_scores(game, [game.closing_date]) if game.is_closed() else [])
+    if _is_compact():
+        StatsSnapshot.objects.bulk_create([StatsSnapshot.pack(_rows(scoresheets), game = game, trade_id = trade_id, date_score = date_score)
+                                           for date_score, trade_id, scoresheets in points])
+    else:
+        StatsScore.objects.bulk_create([StatsScore(game = game, player = scoresheet.gameplayer.player, trade_id = trade_id, score = scoresheet.total_score,
+                                                   date_score = date_score, random = _is_random(scoresheet))
+                                        for date_score, trade_id, scoresheets in points for scoresheet in scoresheets])
+    return True
+
+def compact(game):
+    """ Pack the StatsScore rows of a game into StatsSnapshots, one per date, in a single insert. Returns False if it has none. """
+    rows = list(StatsScore.objects.filter(game = game).order_by('date_score', 'player').values_list('id', 'date_score', 'trade', 'player', 'score', 'random'))
+    if not rows:
+        return False
+    StatsSnapshot.objects.bulk_create([StatsSnapshot.pack([(player_id, score, random) for _id, _date, _trade, player_id, score, random in snapshot],
+                                                          game = game, trade_id = trade_id, date_score = date_score)
+                                       for (date_score, trade_id), snapshot in groupby(rows, key = lambda row: (row[1], row[2]))])
+    StatsScore.objects.filter(id__in = [row[0] for row in rows]).delete()
+    return True
+
+def timeline(game):
+    """ The evolution of the scores of the game: (dates, {player: [scores]}), read from the snapshots of the game in a single query,
+         or from its StatsScore rows if it has none, plus one query for the players. A long game is downsampled to
+         settings.STATS_MAX_POINTS dates evenly spread, the first and the last ones included. """
+    archive = load_archive(game)
+    if archive:
+        snapshots, stats_scores = archive.stats_snapshots(), archive.stats_scores()
+    else:
+        snapshots = StatsSnapshot.objects.filter(game = game).order_by('date_score', 'id')
+        stats_scores = StatsScore.objects.filter(game = game).order_by('date_score', 'player') # only read if there is no snapshot
+
+    points = [(snapshot.date_score, [(player_id, score) for player_id, score, _random in snapshot.unpack()])
+              for snapshot in sorted(snapshots, key = lambda snapshot: (snapshot.date_score, snapshot.id))]
+    if not points:
+        points = [(date_score, [(stats.player_id, stats.score) for stats in rows]) for date_score, rows in
+                  groupby(sorted(stats_scores, key = lambda stats: (stats.date_score, stats.player_id)), key = lambda stats: stats.date_score)]
+
+    points = _downsample(points, getattr(settings, 'STATS_MAX_POINTS', None))
+    players = get_user_model().objects.in_bulk(list(set(player_id for _date, rows in points for player_id, _score in rows)))
+    dates, scores = [], {}
+    for date_score, rows in points:
+        dates.append(date_score)
+        for player_id, score in rows:
+            scores.setdefault(players[player_id], []).append(score)
+    return dates, scores
+
+def _downsample(points, max_points):
+    if not max_points or len(points) <= max_points:
+        return points
+    if max_points == 1:
+        return points[-1:]
+    return [points[index * (len(points) - 1) // (max_points - 1)] for index in range(max_points)]
+
+def _is_compact():
+    return getattr(settings, 'STATS_STORAGE', 'rows') == 'snapshots'
+
+def _model():
+    return StatsSnapshot if _is_compact() else StatsScore
+
+def _rows(scoresheets):
+    return [(scoresheet.gameplayer.player_id, scoresheet.total_score, _is_random(scoresheet)) for scoresheet in scoresheets]
+
+def _is_random(scoresheet):
+    return len([sfr for sfr in scoresheet.scores_from_rule if getattr(sfr, 'is_random', False)]) > 0
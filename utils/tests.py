@@ -2,19 +2,38 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import json
+import os
+import random
+import shutil
+import tempfile
+from collections import Counter
 from django.contrib.auth import get_user_model
 from django.core import mail
+from django.core.signals import request_started
+from django.core.urlresolvers import reverse, resolve
+from django.db import connection
+from django.http import HttpResponse
 from django.template import Template
-from django.test import TestCase
-from django.test.utils import override_settings
+from django.test import TestCase, RequestFactory
+from django.test.utils import override_settings, CaptureQueriesContext
 from django.utils.timezone import now, utc
 from model_mommy import mommy
-from game.models import Game, CommodityInHand
-from ruleset.models import RuleCard, Commodity
+from mystrade import middlewares
+from mystrade.routers import ReplicaRouter, read_from_replica, start_replica_reads, stop_replica_reads
+from benchmark.generator import generate_game, PASSWORD
+from game import urls as game_urls
+from game.ledger import backfill_ledger, record_trade
+from game.models import Game, CommodityInHand, GameCreationJob, Message
+from ruleset.models import RuleCard, Commodity, Ruleset
+from scoring.card_scoring import tally_scores
+from trade import urls as trade_urls
 from trade.models import Trade, Offer, TradedCommodities
-from utils import roundTimeToMinute, _send_notification_email, send_notification_email, _limit_line_breaks, get_timestamp
-from stats import record
-from models import StatsScore
+from utils import roundTimeToMinute, _send_notification_email, send_notification_email, _limit_line_breaks, get_timestamp, QueryCounter
+from stats import record, backfill, compact, timeline
+from models import StatsScore, StatsSnapshot
+from profiling import summarize_profiles, normalize_sql, write_profile
+import urls as utils_urls
 
 class MystradeTestCase(TestCase):
     """ Parent test case class with default element bootstrapped, to be inherited by other apps' test cases """
@@ -159,6 +178,17 @@ class UtilsTest(TestCase):
         self.assertEqual("hello\n\nworld!", _limit_line_breaks("hello\n\n\nworld!"))
         self.assertEqual("hello\n\nworld!", _limit_line_breaks("hello\n\n\n\nworld!"))
 
+    def test_query_counters_can_be_nested_and_leave_the_signals_alone(self):
+        receivers = list(request_started.receivers)
+        with QueryCounter() as outer:
+            get_user_model().objects.count()
+            with QueryCounter() as inner:
+                get_user_model().objects.count()
+                self.assertEqual(receivers, request_started.receivers)
+            get_user_model().objects.count()
+        self.assertEqual((3, 1), (outer.count, inner.count))
+        self.assertEqual(receivers, request_started.receivers)
+
     def _prepare_user(self, email, send_notifications):
         return mommy.make(get_user_model(), email = email, send_notifications = send_notifications)
 
@@ -209,6 +239,99 @@ class StatsTest(MystradeTestCase):
 
         self.assertEqual(stats_loginUser.date_score, stats_alternativeUser.date_score)
 
+    @override_settings(STATS_MIN_INTERVAL = 60)
+    def test_record_after_a_trade_is_thinned_out(self):
+        record(self.game, trade = mommy.make(Trade))
+        nb_snapshots = StatsScore.objects.filter(game = self.game).count()
+        self.assertGreater(nb_snapshots, 0)
+
+        record(self.game, trade = mommy.make(Trade)) # less than a minute later
+        self.assertEqual(nb_snapshots, StatsScore.objects.filter(game = self.game).count())
+        record(self.game) # not after a trade
+        self.assertEqual(2 * nb_snapshots, StatsScore.objects.filter(game = self.game).count())
+
+    def test_backfill_replays_the_scores_at_the_start_after_each_trade_and_at_the_closing(self):
+        self.game.rules.add(RuleCard.objects.get(ref_name = 'HAG10')) # 5 different colors => +10 points
+        cih_loginUser = mommy.make(CommodityInHand, game = self.game, player = self.loginUser, nb_cards = 3,
+                                   commodity = Commodity.objects.get(ruleset = 1, name = 'Yellow'))
+        cih_alternativeUser = mommy.make(CommodityInHand, game = self.game, player = self.alternativeUser, nb_cards = 2,
+                                         commodity = Commodity.objects.get(ruleset = 1, name = 'Blue'))
+        backfill_ledger(self.game)
+        offers = [mommy.make(Offer), mommy.make(Offer)]
+        mommy.make(TradedCommodities, offer = offers[0], commodityinhand = cih_loginUser, nb_traded_cards = 1)
+        mommy.make(TradedCommodities, offer = offers[1], commodityinhand = cih_alternativeUser, nb_traded_cards = 1)
+        trade = mommy.make(Trade, game = self.game, initiator = self.loginUser, responder = self.alternativeUser, status = 'ACCEPTED',
+                           initiator_offer = offers[0], responder_offer = offers[1], closing_date = now() - datetime.timedelta(hours = 1))
+        record_trade(trade)
+        self.game.closing_date = now()
+        self.game.save()
+
+        self.assertTrue(backfill(self.game))
+        self.assertFalse(backfill(self.game))
+
+        final_scores = sorted((scoresheet.gameplayer.player_id, scoresheet.total_score) for scoresheet in tally_scores(self.game))
+        snapshots = StatsScore.objects.filter(game = self.game)
+        self.assertEqual([self.game.start_date, trade.closing_date, self.game.closing_date], sorted(set(stats.date_score for stats in snapshots)))
+
+        at_start = [stats for stats in snapshots if stats.date_score == self.game.start_date]
+        self.assertEqual(set([None]), set(stats.trade for stats in at_start))
+        self.assertEqual(sorted([(self.loginUser.id, 3), (self.alternativeUser.id, 4)]),
+                         sorted((stats.player_id, stats.score) for stats in at_start if stats.player_id in (self.loginUser.id, self.alternativeUser.id)))
+
+        after_trade = [stats for stats in snapshots if stats.date_score == trade.closing_date]
+        self.assertEqual(set([trade]), set(stats.trade for stats in after_trade))
+        self.assertEqual(final_scores, sorted((stats.player_id, stats.score) for stats in after_trade))
+
+        at_closing = [stats for stats in snapshots if stats.date_score == self.game.closing_date]
+        self.assertEqual(set([None]), set(stats.trade for stats in at_closing))
+        self.assertEqual(final_scores, sorted((stats.player_id, stats.score) for stats in at_closing))
+
+    @override_settings(STATS_STORAGE = 'snapshots')
+    def test_record_packs_the_scores_of_all_the_players_in_a_snapshot(self):
+        mommy.make(CommodityInHand, game = self.game, player = self.loginUser, nb_cards = 3, commodity = Commodity.objects.get(ruleset = 1, name = 'Yellow'))
+        trade = mommy.make(Trade)
+
+        scoresheets = tally_scores(self.game)
+        with self.assertNumQueries(1):
+            record(self.game, trade = trade, scoresheets = scoresheets)
+
+        self.assertFalse(StatsScore.objects.filter(game = self.game).exists())
+        snapshot = StatsSnapshot.objects.get(game = self.game)
+        self.assertEqual(trade, snapshot.trade)
+        self.assertEqual([(scoresheet.gameplayer.player_id, scoresheet.total_score, False) for scoresheet in scoresheets], snapshot.unpack())
+        self.assertEqual(3, [score for player_id, score, _random in snapshot.unpack() if player_id == self.loginUser.id][0])
+
+    def test_compact_packs_the_rows_of_each_date(self):
+        date_now = now()
+        for index, date_score in enumerate([date_now - datetime.timedelta(hours = 1), date_now]):
+            mommy.make(StatsScore, game = self.game, player = self.loginUser, score = 10 + index, date_score = date_score)
+            mommy.make(StatsScore, game = self.game, player = self.alternativeUser, score = -index, date_score = date_score, random = True)
+        timeline_before = timeline(self.game)
+
+        self.assertTrue(compact(self.game))
+        self.assertFalse(compact(self.game))
+
+        self.assertFalse(StatsScore.objects.filter(game = self.game).exists())
+        self.assertEqual([[(self.loginUser.id, 10, False), (self.alternativeUser.id, 0, True)], [(self.loginUser.id, 11, False), (self.alternativeUser.id, -1, True)]],
+                         [snapshot.unpack() for snapshot in StatsSnapshot.objects.filter(game = self.game).order_by('date_score')])
+        self.assertEqual(timeline_before, timeline(self.game))
+        self.assertEqual({self.loginUser: [10, 11], self.alternativeUser: [0, -1]}, timeline_before[1])
+
+    @override_settings(STATS_MAX_POINTS = 4)
+    def test_the_timeline_of_a_long_game_is_read_in_two_queries_and_downsampled(self):
+        date_now = now()
+        StatsSnapshot.objects.bulk_create([StatsSnapshot.pack([(self.loginUser.id, index, False), (self.alternativeUser.id, 2 * index, False)],
+                                                              game = self.game, date_score = date_now + datetime.timedelta(minutes = index))
+                                           for index in range(10)])
+
+        with self.assertNumQueries(2):
+            dates, scores = timeline(self.game)
+            self.assertEqual("test2", [player for player in scores if player.id == self.loginUser.id][0].username)
+
+        self.assertEqual([date_now + datetime.timedelta(minutes = index) for index in [0, 3, 6, 9]], dates)
+        self.assertEqual({self.loginUser: [0, 3, 6, 9], self.alternativeUser: [0, 6, 12, 18]}, scores)
+
+    @override_settings(GAME_CREATION_IN_BACKGROUND = False)
     def test_record_scores_at_game_creation(self):
         self.game.delete()
         self.client.logout()
@@ -327,3 +450,413 @@ class StatsTest(MystradeTestCase):
         except StatsScore.DoesNotExist:
             self.fail("StatsScore does not contain record for alternativeUser (test5)")
 
+
+class SamplingProfilerTest(MystradeTestCase):
+
+    def setUp(self):
+        super(SamplingProfilerTest, self).setUp()
+        self.samples = []
+        middlewares.write_profile = self.samples.append # logging is disabled during the tests
+
+    def tearDown(self):
+        middlewares.write_profile = write_profile
+
+    @override_settings(REQUEST_PROFILING_RATE = 1)
+    def test_a_sampled_request_is_written_with_its_view_queries_and_functions(self):
+        self.client.get("/game/{0}/".format(self.game.id))
+
+        self.assertEqual(1, len(self.samples))
+        sample = json.loads(json.dumps(self.samples[0]))
+        self.assertEqual('game.views.game_board', sample['view'])
+        self.assertEqual("/game/{0}/".format(self.game.id), sample['path'])
+        self.assertEqual(200, sample['status'])
+        self.assertGreater(sample['nb_queries'], 0)
+        self.assertGreaterEqual(sample['nb_queries'], sum(query['count'] for query in sample['queries']))
+        self.assertTrue(sample['functions'])
+        self.assertGreaterEqual(sample['duration_ms'], sample['functions'][0]['own_ms'])
+
+    @override_settings(REQUEST_PROFILING_RATE = 0)
+    def test_no_request_is_sampled_when_profiling_is_disabled(self):
+        self.client.get("/game/{0}/".format(self.game.id))
+        self.assertEqual(0, len(self.samples))
+
+    def test_summarize_profiles(self):
+        samples = [{'view': 'a', 'duration_ms': duration, 'nb_queries': 4, 'sql_ms': 2.0,
+                    'queries': [{'sql': 'SELECT ?', 'count': 4, 'ms': 2.0}],
+                    'functions': [{'function': 'f', 'calls': 2, 'own_ms': 1.0, 'cumulative_ms': 3.0}]} for duration in range(1, 101)]
+        samples.append({'view': 'b', 'duration_ms': 500, 'nb_queries': 1, 'sql_ms': 1.0, 'queries': [], 'functions': []})
+
+        summary = summarize_profiles(samples)
+
+        self.assertEqual(['b', 'a'], [view['view'] for view in summary])
+        self.assertEqual(100, summary[1]['nb_samples'])
+        self.assertEqual(51, summary[1]['p50_ms'])
+        self.assertEqual(91, summary[1]['p90_ms'])
+        self.assertEqual(100, summary[1]['p99_ms'])
+        self.assertEqual(4, summary[1]['nb_queries'])
+        self.assertEqual([{'sql': 'SELECT ?', 'count': 4, 'ms': 2.0}], summary[1]['queries'])
+        self.assertEqual([{'function': 'f', 'calls': 2, 'own_ms': 1.0}], summary[1]['functions'])
+        self.assertEqual(500, summary[0]['p99_ms'])
+
+    def test_profiling_report_reads_the_log_and_its_backups(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'profiling.log')
+            with open(path, 'w') as fic:
+                fic.write(json.dumps({'view': 'game.views.game_board', 'duration_ms': 10, 'nb_queries': 4, 'sql_ms': 2.0,
+                                      'queries': [], 'functions': []}) + "\n")
+            with open(path + '.1', 'w') as fic:
+                fic.write(json.dumps({'view': 'trade.views.trade_list', 'duration_ms': 20, 'nb_queries': 8, 'sql_ms': 3.0,
+                                      'queries': [], 'functions': []}) + "\n")
+                fic.write('{"truncated": \n')
+
+            with self.settings(REQUEST_PROFILING_LOG = path):
+                response = self.client.get(reverse('profiling_report'))
+                self.assertTemplateUsed(response, 'admin/login.html') # staff only
+
+                self.login_as(self.admin)
+                response = self.client.get(reverse('profiling_report'))
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(2, response.context['nb_samples'])
+                self.assertEqual(['trade.views.trade_list', 'game.views.game_board'], [view['view'] for view in response.context['views']])
+        finally:
+            shutil.rmtree(directory)
+
+class ReplicaRoutingTest(TestCase):
+    REPLICA_SETTINGS = {'DATABASES': {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'primary.db'},
+                                      'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'replica.db'}},
+                        'REPLICA_DATABASE': 'replica', 'REPLICA_PINNING_DURATION': 10}
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.middleware = middlewares.ReplicaPinningMiddleware()
+        self.factory = RequestFactory()
+        self.view = read_from_replica(lambda request: None)
+
+    def tearDown(self):
+        stop_replica_reads()
+
+    def test_reads_go_to_the_replica_until_the_first_write(self):
+        with self.settings(**self.REPLICA_SETTINGS):
+            self.assertIsNone(self.router.db_for_read(Game))
+            start_replica_reads()
+            self.assertEqual('replica', self.router.db_for_read(Game))
+            self.assertEqual('default', self.router.db_for_write(Game))
+            self.assertIsNone(self.router.db_for_read(Game))
+
+    def test_nothing_goes_to_the_replica_if_there_is_none(self):
+        with self.settings(REPLICA_DATABASE = 'replica'):
+            start_replica_reads()
+            self.assertIsNone(self.router.db_for_read(Game))
+
+    def test_no_table_is_created_in_the_replica(self):
+        with self.settings(**self.REPLICA_SETTINGS):
+            self.assertFalse(self.router.allow_syncdb('replica', Game))
+            self.assertIsNone(self.router.allow_syncdb('default', Game))
+
+    def test_only_the_get_requests_of_the_decorated_views_read_from_the_replica(self):
+        with self.settings(**self.REPLICA_SETTINGS):
+            for request, view, expected_db in [(self.factory.get('/'), self.view, 'replica'),
+                                               (self.factory.head('/'), self.view, 'replica'),
+                                               (self.factory.post('/'), self.view, None),
+                                               (self.factory.get('/'), lambda request: None, None)]:
+                self.middleware.process_request(request)
+                self.middleware.process_view(request, view, [], {})
+                self.assertEqual(expected_db, self.router.db_for_read(Game))
+                self.middleware.process_response(request, HttpResponse())
+                self.assertIsNone(self.router.db_for_read(Game))
+
+    def test_a_browser_is_pinned_to_the_primary_after_a_post(self):
+        with self.settings(**self.REPLICA_SETTINGS):
+            response = self.middleware.process_response(self.factory.post('/'), HttpResponse())
+            cookie = response.cookies[middlewares.ReplicaPinningMiddleware.COOKIE_KEY]
+            self.assertEqual(10, cookie['max-age'])
+
+            request = self.factory.get('/')
+            request.COOKIES[cookie.key] = cookie.value
+            self.middleware.process_view(request, self.view, [], {})
+            self.assertIsNone(self.router.db_for_read(Game))
+
+            request.COOKIES[cookie.key] = str(int(cookie.value) - 11) # the window is over
+            self.middleware.process_view(request, self.view, [], {})
+            self.assertEqual('replica', self.router.db_for_read(Game))
+
+    def test_no_browser_is_pinned_without_a_replica(self):
+        response = self.middleware.process_response(self.factory.post('/'), HttpResponse())
+        self.assertNotIn(middlewares.ReplicaPinningMiddleware.COOKIE_KEY, response.cookies)
+
+    def test_the_board_and_polling_views_are_read_from_the_replica(self):
+        for name, args in [('game', [1]), ('game_with_trade', [1, 2]), ('events', [1]), ('trade_list', [1]), ('show_trade', [1, 2]), ('stats', [1])]:
+            self.assertTrue(getattr(resolve(reverse(name, args = args)).func, 'read_from_replica', False), name)
+        for name, args in [('post_message', [1]), ('create_trade', [1]), ('accept_trade', [1, 2])]:
+            self.assertFalse(getattr(resolve(reverse(name, args = args)).func, 'read_from_replica', False), name)
+
+@override_settings(GAME_CREATION_IN_BACKGROUND = False) # select_rules measured with the whole creation of the game
+class QueryCountRegressionTest(TestCase):
+    """ Each view of the game, trade and utils apps is called on a small game and on a larger one. The number of SQL queries
+         it issues may not grow between the two sizes by more than the budget declared below; a count growing with the size of
+         the game is usually a N+1 pattern, typically a template walking a relation for each row of a list.
+        On failure, the queries that have multiplied are listed. Budgets should only ever go down.
+    """
+    SMALL_GAME = {'nb_players': 5,  'nb_trades': 6,  'nb_messages': 10}
+    LARGE_GAME = {'nb_players': 10, 'nb_trades': 24, 'nb_messages': 40}
+
+    # measured growth between the two sizes plus about 5%, rounded up to a multiple of 5 (0 where the count doesn't grow at all):
+    #  measure them again and lower them along with the optimizations of the views
+    QUERY_BUDGETS = {
+        # game.urls
+        'game_list':       0,
+        'game':            0,
+        'game_with_trade': 0,
+        'events':          0,
+        'post_message':    0,
+        'delete_message':  0,
+        'submit_hand':     0,
+        'close_game':      440,
+        'create_game':     0,
+        'search_players':  0,
+        'select_rules':    25,
+        'game_creation':   0,
+        # trade.urls
+        'trade_list':      2,
+        'create_trade':    0,
+        'show_trade':      0,
+        'cancel_trade':    0,
+        'reply_trade':     0,
+        'accept_trade':    280,
+        'decline_trade':   0,
+        # utils.urls
+        'stats':           0,
+        'profiling_report': 0,
+    }
+
+    def setUp(self):
+        pizzaz = Ruleset.objects.get(module = 'pizzaz') # the ruleset with the most expensive scoring
+        self.games = [generate_game(pizzaz, prefix = 'small', seed = 1, **self.SMALL_GAME),
+                      generate_game(pizzaz, prefix = 'large', seed = 1, **self.LARGE_GAME)]
+
+    def test_all_the_url_patterns_have_a_query_budget_and_a_scenario(self):
+        for urlpatterns in [game_urls.urlpatterns, trade_urls.urlpatterns, utils_urls.urlpatterns]:
+            for pattern in urlpatterns:
+                self.assertIn(pattern.name, self.QUERY_BUDGETS)
+                self.assertTrue(hasattr(self, '_prepare_' + pattern.name), "No scenario for the url '{0}'".format(pattern.name))
+
+    def test_query_budget_game_list(self):
+        self.assertQueryBudget('game_list')
+
+    def test_query_budget_game(self):
+        self.assertQueryBudget('game')
+
+    def test_query_budget_game_with_trade(self):
+        self.assertQueryBudget('game_with_trade')
+
+    def test_query_budget_events(self):
+        self.assertQueryBudget('events')
+
+    def test_query_budget_post_message(self):
+        self.assertQueryBudget('post_message')
+
+    def test_query_budget_delete_message(self):
+        self.assertQueryBudget('delete_message')
+
+    def test_query_budget_submit_hand(self):
+        self.assertQueryBudget('submit_hand')
+
+    def test_query_budget_close_game(self):
+        self.assertQueryBudget('close_game')
+
+    def test_query_budget_create_game(self):
+        self.assertQueryBudget('create_game')
+
+    def test_query_budget_search_players(self):
+        self.assertQueryBudget('search_players')
+
+    def test_query_budget_select_rules(self):
+        self.assertQueryBudget('select_rules')
+
+    def test_query_budget_game_creation(self):
+        self.assertQueryBudget('game_creation')
+
+    def test_query_budget_trade_list(self):
+        self.assertQueryBudget('trade_list')
+
+    def test_query_budget_create_trade(self):
+        self.assertQueryBudget('create_trade')
+
+    def test_query_budget_show_trade(self):
+        self.assertQueryBudget('show_trade')
+
+    def test_query_budget_cancel_trade(self):
+        self.assertQueryBudget('cancel_trade')
+
+    def test_query_budget_reply_trade(self):
+        self.assertQueryBudget('reply_trade')
+
+    def test_query_budget_accept_trade(self):
+        self.assertQueryBudget('accept_trade')
+
+    def test_query_budget_decline_trade(self):
+        self.assertQueryBudget('decline_trade')
+
+    def test_query_budget_stats(self):
+        self.assertQueryBudget('stats')
+
+    def test_query_budget_profiling_report(self):
+        self.assertQueryBudget('profiling_report')
+
+    def assertQueryBudget(self, url_name):
+        captured_queries = []
+        for game in self.games:
+            request = getattr(self, '_prepare_' + url_name)(game)
+            with CaptureQueriesContext(connection) as queries:
+                response = request()
+            self.assertLess(response.status_code, 400, "{0} returned HTTP status code {1}".format(url_name, response.status_code))
+            captured_queries.append([query['sql'] for query in queries])
+
+        small, large = captured_queries
+        if len(large) - len(small) > self.QUERY_BUDGETS[url_name]:
+            self.fail("'{0}' issued {1} queries on the small game and {2} on the large game, more than the budget of {3} additional queries:\n{4}"
+                      .format(url_name, len(small), len(large), self.QUERY_BUDGETS[url_name], self._multiplied_queries(small, large)))
+
+    def _multiplied_queries(self, small, large):
+        nb_small_queries = Counter(normalize_sql(sql) for sql in small)
+        nb_large_queries = Counter(normalize_sql(sql) for sql in large)
+        return "\n".join("  +{0} x {1}".format(nb_queries - nb_small_queries[sql], sql) for sql, nb_queries in nb_large_queries.most_common()
+                                                                                      if nb_queries > nb_small_queries[sql])
+
+    ##### Scenarios: each one prepares the data and the logged in user, and returns the request to measure #####
+
+    def _player(self, game):
+        player = game.players.order_by('id')[0]
+        self.client.login(username = player.username, password = PASSWORD)
+        return player
+
+    def _trade_initiator(self, game):
+        """ The first trade of the game, with its initiator logged in """
+        trade = Trade.objects.filter(game = game).select_related('initiator').order_by('id')[0]
+        self.client.login(username = trade.initiator.username, password = PASSWORD)
+        return trade
+
+    def _master(self, game):
+        game.master.is_superuser = True # permission to create games
+        game.master.save()
+        self.client.login(username = game.master.username, password = PASSWORD)
+        return game.master
+
+    def _ajax_get(self, url_name, *args):
+        return lambda: self.client.get(reverse(url_name, args = args), HTTP_X_REQUESTED_WITH = 'XMLHttpRequest')
+
+    def _ajax_post(self, url_name, args, data = None):
+        return lambda: self.client.post(reverse(url_name, args = args), data or {}, HTTP_X_REQUESTED_WITH = 'XMLHttpRequest')
+
+    def _new_trade(self, game, initiator, responder, status):
+        trade = Trade.objects.create(game = game, initiator = initiator, responder = responder, status = status,
+                                     initiator_offer = Offer.objects.create(free_information = 'secret'))
+        if status == 'REPLIED':
+            trade.responder_offer = Offer.objects.create(free_information = 'another secret')
+            trade.save()
+        return trade
+
+    def _prepare_game_list(self, game):
+        self._player(game)
+        return lambda: self.client.get(reverse('game_list'))
+
+    def _prepare_game(self, game):
+        self._player(game)
+        return lambda: self.client.get(reverse('game', args = [game.id]))
+
+    def _prepare_game_with_trade(self, game):
+        trade = self._trade_initiator(game)
+        return lambda: self.client.get(reverse('game_with_trade', args = [game.id, trade.id]))
+
+    def _prepare_events(self, game):
+        self._player(game)
+        return self._ajax_get('events', game.id)
+
+    def _prepare_post_message(self, game):
+        self._player(game)
+        return self._ajax_post('post_message', [game.id], {'message': 'Hello *world*'})
+
+    def _prepare_delete_message(self, game):
+        message = Message.objects.create(game = game, sender = self._player(game), content = 'Oops')
+        return self._ajax_post('delete_message', [game.id], {'event_id': message.id})
+
+    def _prepare_submit_hand(self, game):
+        player = self._player(game)
+        data = dict(('commodity_{0}'.format(cih.commodity_id), cih.nb_tradable_cards())
+                    for cih in CommodityInHand.objects.filter(game = game, player = player, nb_cards__gt = 0))
+        return self._ajax_post('submit_hand', [game.id], data)
+
+    def _prepare_close_game(self, game):
+        self._master(game)
+        game.end_date = game.start_date
+        game.save()
+        return self._ajax_post('close_game', [game.id])
+
+    def _prepare_create_game(self, game):
+        self._master(game)
+        return lambda: self.client.get(reverse('create_game'))
+
+    def _prepare_search_players(self, game):
+        self._master(game)
+        return self._ajax_get('search_players')
+
+    def _prepare_select_rules(self, game):
+        self._master(game)
+        players = game.players.all()
+        self.client.post(reverse('create_game'), {'ruleset': game.ruleset_id, 'start_date': '11/10/2012 18:30', 'end_date': '11/13/2037 00:15',
+                                                  'players': [player.id for player in players]})
+        # the same number of rules in both games, so that only the number of players varies
+        data = dict(('rulecard_{0}'.format(rulecard.id), 'True') for rulecard in game.rules.order_by('ref_name')[:len(self.games[0].rules.all())])
+        random.seed(0) # the cards may have to be dealt more than once
+        return lambda: self.client.post(reverse('select_rules'), data)
+
+    def _prepare_game_creation(self, game):
+        master = self._master(game)
+        job = GameCreationJob.objects.create(master = master, ruleset = game.ruleset, start_date = game.start_date, end_date = game.end_date,
+                                             players = ",".join(str(player.id) for player in game.players.all()),
+                                             rules = ",".join(str(rule.id) for rule in game.rules.all()), status = 'NOTIFYING', game = game)
+        return self._ajax_get('game_creation', job.id)
+
+    def _prepare_trade_list(self, game):
+        self._player(game)
+        return self._ajax_get('trade_list', game.id)
+
+    def _prepare_create_trade(self, game):
+        self._player(game)
+        return self._ajax_get('create_trade', game.id)
+
+    def _prepare_show_trade(self, game):
+        trade = self._trade_initiator(game)
+        return self._ajax_get('show_trade', game.id, trade.id)
+
+    def _prepare_cancel_trade(self, game):
+        player = self._player(game)
+        trade = self._new_trade(game, player, game.players.exclude(id = player.id)[0], 'INITIATED')
+        return self._ajax_post('cancel_trade', [game.id, trade.id])
+
+    def _prepare_reply_trade(self, game):
+        player = self._player(game)
+        trade = self._new_trade(game, game.players.exclude(id = player.id)[0], player, 'INITIATED')
+        return self._ajax_post('reply_trade', [game.id, trade.id], {'free_information': 'my secret'})
+
+    def _prepare_accept_trade(self, game):
+        player = self._player(game)
+        trade = self._new_trade(game, player, game.players.exclude(id = player.id)[0], 'REPLIED')
+        return self._ajax_post('accept_trade', [game.id, trade.id])
+
+    def _prepare_decline_trade(self, game):
+        player = self._player(game)
+        trade = self._new_trade(game, game.players.exclude(id = player.id)[0], player, 'INITIATED')
+        return self._ajax_post('decline_trade', [game.id, trade.id])
+
+    def _prepare_stats(self, game):
+        self._player(game)
+        record(game)
+        return lambda: self.client.get(reverse('stats', args = [game.id]))
+
+    def _prepare_profiling_report(self, game):
+        game.master.is_staff = True
+        game.master.save()
+        self.client.login(username = game.master.username, password = PASSWORD)
+        return lambda: self.client.get(reverse('profiling_report'))
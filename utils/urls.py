@@ -2,4 +2,5 @@ from django.conf.urls import patterns, url
 
 urlpatterns = patterns('utils.views',
     url(r'^stats/(\d+)/$', 'stats', name='stats'),
+    url(r'^profiling/$', 'profiling_report', name='profiling_report'),
 )
@@ -4,6 +4,7 @@ import re
 from django.conf import settings
 from django.core.mail import EmailMessage
 from django.core.mail.message import BadHeaderError
+from django.db import connections, DEFAULT_DB_ALIAS
 from django.template import Context
 from django.template.loader import get_template
 from django.utils.timezone import now, utc
@@ -70,4 +71,35 @@ def _send_notification_email(template, recipients, data = None):
 
 def _limit_line_breaks(text):
     """ Blocks of 3 or more line breaks are crushed to 2 line breaks """
-    return '\n\n'.join(re.split('\\n{3,}', text))
\ No newline at end of file
+    return '\n\n'.join(re.split('\\n{3,}', text))
+
+class QueryCounter(object):
+    """ Context manager counting the SQL queries sent to a database within its block, even when DEBUG is off. The counters can be
+         nested. A request processed within the block by the test client empties the list of the queries of the connection at its
+         start: the caller has to disconnect reset_queries() from request_started for that (see benchmark.run_benchmark).
+        Usage:
+            with QueryCounter() as counter:
+                ...
+            print counter.count, counter.queries
+    """
+    def __init__(self, using = DEFAULT_DB_ALIAS):
+        self.connection = connections[using]
+
+    def __enter__(self):
+        self.former_use_debug_cursor = self.connection.use_debug_cursor
+        self.connection.use_debug_cursor = True
+        self.first_query = len(self.connection.queries)
+        self.last_query = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.use_debug_cursor = self.former_use_debug_cursor
+        self.last_query = len(self.connection.queries)
+
+    @property
+    def queries(self):
+        return self.connection.queries[self.first_query:self.last_query]
+
+    @property
+    def count(self):
+        return len(self.queries)
@@ -1,8 +1,10 @@
 import numpy
 
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+from django.shortcuts import get_object_or_404, render
 from django.views.decorators.cache import never_cache
 import matplotlib
 matplotlib.use('Agg')
@@ -10,23 +12,19 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 from game.models import Game
-from models import StatsScore
+from mystrade.routers import read_from_replica
+from game.views import board_fragments_hit_rate
+from profiling import read_profiles, summarize_profiles
+from stats import timeline
 
+@read_from_replica
 @login_required
 @never_cache
 def stats(request, game_id):
     game = get_object_or_404(Game, id = game_id)
 
-    x = []
-    y = {}
-    last_date = None
-    for stats in StatsScore.objects.filter(game = game).order_by('date_score', 'player'):
-        if stats.date_score <> last_date:
-            last_date = stats.date_score
-            x.append(stats.date_score)
-        if stats.player.name not in y:
-            y[stats.player.name] = []
-        y[stats.player.name].append(stats.score)
+    x, scores = timeline(game)
+    y = dict((player.name, player_scores) for player, player_scores in scores.iteritems())
 
     colormap = plt.cm.gist_ncar
     plt.gca().set_color_cycle([colormap(i) for i in numpy.linspace(0, 0.9, len(y))])
@@ -53,4 +51,13 @@ def stats(request, game_id):
 
     response = HttpResponse(content_type='image/png')
     canvas.print_png(response)
-    return response
\ No newline at end of file
+    return response
+
+@staff_member_required
+@never_cache
+def profiling_report(request):
+    samples = read_profiles(settings.REQUEST_PROFILING_LOG)
+    return render(request, 'admin/utils/profiling_report.html', {'title': 'Profiling of the requests', 'nb_samples': len(samples),
+                                                                 'profiling_rate': settings.REQUEST_PROFILING_RATE,
+                                                                 'views': summarize_profiles(samples),
+                                                                 'board_fragments': board_fragments_hit_rate()})